@@ -60,6 +60,62 @@ function gcbAssessmentAudit(data_dict) {
   gcbAudit(gcbCanPostEvents, data_dict, 'attempt-assessment', true);
 }
 
+// asynchronous events are held briefly and sent to the server in batches
+var GCB_EVENT_BATCH_DELAY_MS = 1000;
+var GCB_MAX_EVENTS_PER_BATCH = 100;
+var gcbPendingEvents = [];
+var gcbPendingEventsTimer = null;
+
+function gcbCancelPendingEventsTimer() {
+  if (gcbPendingEventsTimer) {
+    clearTimeout(gcbPendingEventsTimer);
+    gcbPendingEventsTimer = null;
+  }
+}
+
+function gcbTakeEventsBatchRequest() {
+  return JSON.stringify({
+      'events': gcbPendingEvents.splice(0, GCB_MAX_EVENTS_PER_BATCH),
+      'xsrf_token': eventXsrfToken});
+}
+
+function gcbPostEventsBatchRequest(request, is_async) {
+  $.ajax({
+      url: 'rest/events/batch',
+      type: 'POST',
+      async: is_async,
+      data: {'request': request},
+      success: function(){},
+      error: function(){}
+  });
+}
+
+function gcbPostPendingEvents(is_async) {
+  gcbCancelPendingEventsTimer();
+  while (gcbPendingEvents.length) {
+    gcbPostEventsBatchRequest(gcbTakeEventsBatchRequest(), is_async);
+  }
+}
+
+function gcbPostPendingEventsOnPageHide() {
+  // The timer won't fire once the page is gone; send pending events now.
+  // A beacon is delivered after the page unloads without delaying the next
+  // page; fall back to a synchronous post where beacons are not supported.
+  gcbCancelPendingEventsTimer();
+  while (gcbPendingEvents.length) {
+    var request = gcbTakeEventsBatchRequest();
+    var isQueued = navigator.sendBeacon && navigator.sendBeacon(
+        'rest/events/batch',
+        new Blob(['request=' + encodeURIComponent(request)],
+            {type: 'application/x-www-form-urlencoded'}));
+    if (!isQueued) {
+      gcbPostEventsBatchRequest(request, false);
+    }
+  }
+}
+
+$(window).on('pagehide beforeunload', gcbPostPendingEventsOnPageHide);
+
 function gcbAudit(can_post, data_dict, source, is_async) {
   // There may be a course-specific config to save $$ by preventing us
   // from emitting too much volume to AppEngine; respect that setting.
@@ -67,18 +123,18 @@ function gcbAudit(can_post, data_dict, source, is_async) {
     data_dict['location'] = '' + window.location;
     data_dict['loc'] = {}
     data_dict['loc']['page_locale'] = $('body').data('gcb-page-locale')
-    var request = {
+    gcbPendingEvents.push({
         'source': source,
-        'payload': JSON.stringify(data_dict),
-        'xsrf_token': eventXsrfToken};
-    $.ajax({
-        url: 'rest/events',
-        type: 'POST',
-        async: is_async,
-        data: {'request': JSON.stringify(request)},
-        success: function(){},
-        error: function(){}
-    });
+        'payload': JSON.stringify(data_dict)});
+    if (!is_async) {
+      // Synchronous events are sent when leaving the page; send them now,
+      // together with any events still pending.
+      gcbPostPendingEvents(false);
+    } else if (!gcbPendingEventsTimer) {
+      gcbPendingEventsTimer = setTimeout(function() {
+        gcbPostPendingEvents(true);
+      }, GCB_EVENT_BATCH_DELAY_MS);
+    }
   }
 
   // ----------------------------------------------------------------------
@@ -27,6 +27,7 @@ from webapp2_extras import i18n
 import appengine_config
 from common import caching
 from models import config
+from models import counters
 from models import models
 from models.counters import PerfCounter
 
@@ -34,6 +35,9 @@ from models.counters import PerfCounter
 # max size for in-process jinja template cache
 MAX_GLOBAL_CACHE_SIZE_BYTES = 8 * 1024 * 1024
 
+# max number of jinja environments kept in-process for reuse
+MAX_POOLED_ENVIRONMENTS = 200
+
 # this cache used to be memcache based; now it's in-process
 CAN_USE_JINJA2_TEMPLATE_CACHE = config.ConfigProperty(
     'gcb_can_use_jinja2_template_cache', bool, safe_dom.Text(
@@ -161,6 +165,83 @@ def create_jinja_environment(loader, locale=None, autoescape=True):
     return jinja_environment
 
 
+class ProcessScopedJinjaEnvironmentPool(caching.ProcessScopedSingleton):
+    """This class holds in-process pool of Jinja environments.
+
+    Each pooled environment keeps the templates it has compiled in its own
+    in-memory cache, so templates are not loaded and compiled again until
+    their source changes, as reported by the uptodate function the template
+    loader returns for them.
+    """
+
+    @classmethod
+    def get_pool_len(cls):
+        return len(
+            ProcessScopedJinjaEnvironmentPool.instance().environments.items)
+
+    def __init__(self):
+        self.environments = caching.LRUCache(
+            max_item_count=MAX_POOLED_ENVIRONMENTS)
+
+
+JINJA_ENVIRONMENT_POOL_HIT = PerfCounter(
+    'gcb-models-JinjaEnvironmentPool-hit',
+    'A number of times a Jinja environment was reused from the pool.')
+JINJA_ENVIRONMENT_POOL_MISS = PerfCounter(
+    'gcb-models-JinjaEnvironmentPool-miss',
+    'A number of times a Jinja environment was created.')
+JINJA_ENVIRONMENT_POOL_LEN = PerfCounter(
+    'gcb-models-JinjaEnvironmentPool-len',
+    'A total number of Jinja environments in the pool.')
+
+JINJA_ENVIRONMENT_POOL_LEN.poll_value = (
+    ProcessScopedJinjaEnvironmentPool.get_pool_len)
+
+
+def get_jinja_environment(
+    loader_key, create_loader, locale=None, autoescape=True):
+    """Gets an environment with translations from the pool, or creates it.
+
+    Environments are pooled per loader_key, namespace and autoescape. The
+    translations installed read the locale of the current request, so one
+    environment serves all locales; the locale given is made current.
+    Callers may replace filters and globals of the environment they get,
+    but must do so every time, as the environment is shared.
+
+    Args:
+      loader_key: a hashable value; equal for all loaders create_loader()
+          may return.
+      create_loader: a function returning a new jinja2.BaseLoader.
+      locale: a locale to make current, or None to leave it as is.
+      autoescape: whether to turn on autoescaping.
+    Returns:
+      A jinja2.Environment.
+    """
+    if locale:
+        i18n.get_i18n().set_locale(locale)
+
+    if not CAN_USE_JINJA2_TEMPLATE_CACHE.value:
+        jinja_environment = create_jinja_environment(
+            create_loader(), autoescape=autoescape)
+        jinja_environment.install_gettext_translations(i18n)
+        return jinja_environment
+
+    key = (loader_key, models.MemcacheManager.get_namespace(), autoescape)
+    pool = ProcessScopedJinjaEnvironmentPool.instance().environments
+    found, jinja_environment = pool.get(key)
+    if found:
+        JINJA_ENVIRONMENT_POOL_HIT.inc()
+        return jinja_environment
+
+    JINJA_ENVIRONMENT_POOL_MISS.inc()
+    jinja_environment = create_jinja_environment(
+        create_loader(), autoescape=autoescape)
+    jinja_environment.install_gettext_translations(i18n)
+    pool.put(key, jinja_environment)
+    return jinja_environment
+
+
+@counters.traced('jinja_utils.get_template')
 def get_template(
     template_name, dirs, handler=None, autoescape=True):
     """Sets up an environment and gets jinja template."""
@@ -177,8 +258,9 @@ def get_template(
     if not locale:
         locale = 'en_US'
 
-    jinja_environment = create_jinja_environment(
-        jinja2.FileSystemLoader(dirs), locale=locale, autoescape=autoescape)
+    jinja_environment = get_jinja_environment(
+        ('local',) + tuple(dirs), lambda: jinja2.FileSystemLoader(dirs),
+        locale=locale, autoescape=autoescape)
 
     jinja_environment.filters['gcb_tags'] = get_gcb_tags_filter(handler)
 
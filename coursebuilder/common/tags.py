@@ -17,10 +17,12 @@
 __author__ = 'John Orr (jorr@google.com)'
 
 
+import hashlib
 import logging
 import mimetypes
 import os
 import re
+import sys
 from xml.etree import cElementTree
 
 import html5lib
@@ -29,8 +31,13 @@ import safe_dom
 import webapp2
 
 import appengine_config
+from common import caching
 from common import schema_fields
 from models import config
+from models import counters
+from models.counters import PerfCounter
+
+from google.appengine.api import namespace_manager
 
 
 CAN_USE_DYNAMIC_TAGS = config.ConfigProperty(
@@ -41,6 +48,16 @@ CAN_USE_DYNAMIC_TAGS = config.ConfigProperty(
     default_value=True)
 
 
+CAN_USE_FRAGMENT_CACHE = config.ConfigProperty(
+    'gcb_can_use_tag_fragment_cache', bool, safe_dom.Text(
+        'Whether HTML rendered from lesson content can be cached in-process '
+        'and shared by all students, if all custom tags in the content allow '
+        'it.'),
+    default_value=True)
+
+# max size for in-process cache of rendered HTML fragments
+MAX_FRAGMENT_CACHE_SIZE_BYTES = 8 * 1024 * 1024
+
 DUPLICATE_INSTANCE_ID_MESSAGE = (
     'Error processing custom HTML tag: duplicate tag id')
 INVALID_HTML_TAG_MESSAGE = 'Invalid HTML tag'
@@ -85,6 +102,22 @@ class BaseTag(object):
         """
         return []
 
+    @classmethod
+    def get_fragment_cache_key(cls):
+        """Lets HTML with this tag be rendered once and shared by all students.
+
+        HTML rendered by html_to_safe_dom() is cached only if every custom
+        tag in it returns a string from this method. Override to return one if
+        render() depends only on the node and the locale, and not on the
+        student, the request, the time or other content of the course. The
+        string must change whenever anything else render() depends on, such
+        as a config property, changes.
+
+        Returns:
+            A string, or None to not allow caching.
+        """
+        return None
+
     def render(self, node, handler):  # pylint: disable=W0613
         """Receive a node and return a node.
 
@@ -325,8 +358,105 @@ def html_string_to_element_tree(html_string):
     return parser.parseFragment('<div>%s</div>' % html_string)[0]
 
 
+class ProcessScopedFragmentCache(caching.ProcessScopedSingleton):
+    """This class holds in-process cache of rendered HTML fragments."""
+
+    @classmethod
+    def get_cache_len(cls):
+        return len(ProcessScopedFragmentCache.instance().cache.items.keys())
+
+    @classmethod
+    def get_cache_size(cls):
+        return ProcessScopedFragmentCache.instance().cache.total_size
+
+    def __init__(self):
+        self.cache = caching.LRUCache(
+            max_size_bytes=MAX_FRAGMENT_CACHE_SIZE_BYTES,
+            max_item_size_bytes=MAX_FRAGMENT_CACHE_SIZE_BYTES // 16)
+        self.cache.get_entry_size = self._get_entry_size
+
+    def _get_entry_size(self, key, value):
+        unused_tag_keys, sanitized = value
+        return sys.getsizeof(key) + sys.getsizeof(sanitized)
+
+
+FRAGMENT_CACHE_HIT = PerfCounter(
+    'gcb-tags-fragment-cache-hit',
+    'A number of times rendered HTML was found in the fragment cache.')
+FRAGMENT_CACHE_MISS = PerfCounter(
+    'gcb-tags-fragment-cache-miss',
+    'A number of times rendered HTML was not found in the fragment cache.')
+FRAGMENT_CACHE_PUT = PerfCounter(
+    'gcb-tags-fragment-cache-put',
+    'A number of times rendered HTML was put into the fragment cache.')
+FRAGMENT_CACHE_NOT_CACHEABLE = PerfCounter(
+    'gcb-tags-fragment-cache-not-cacheable',
+    'A number of times rendered HTML could not be cached because one of the '
+    'custom tags in it does not allow that.')
+FRAGMENT_CACHE_LEN = PerfCounter(
+    'gcb-tags-fragment-cache-len',
+    'A total number of items in the fragment cache.')
+FRAGMENT_CACHE_SIZE_BYTES = PerfCounter(
+    'gcb-tags-fragment-cache-bytes',
+    'A total size of items in the fragment cache in bytes.')
+
+FRAGMENT_CACHE_LEN.poll_value = ProcessScopedFragmentCache.get_cache_len
+FRAGMENT_CACHE_SIZE_BYTES.poll_value = ProcessScopedFragmentCache.get_cache_size
+
+
+class _SanitizedFragment(safe_dom.Node):
+    """Holds HTML which was sanitized when it was rendered and cached."""
+
+    def __init__(self, sanitized):
+        super(_SanitizedFragment, self).__init__()
+        self._sanitized = sanitized
+
+    @property
+    def sanitized(self):
+        return self._sanitized
+
+
+def _make_fragment_cache_key(html_string, handler, tag_bindings):
+    """Returns a key for HTML rendered for the handler; None if not cached."""
+    app_context = getattr(handler, 'app_context', None)
+    if not app_context or not CAN_USE_FRAGMENT_CACHE.value:
+        return None
+    if isinstance(html_string, unicode):
+        html_string = html_string.encode('utf-8')
+    return '%s:%s:%s:%s' % (
+        namespace_manager.get_namespace(), app_context.get_current_locale(),
+        hashlib.sha1(' '.join(sorted(tag_bindings))).hexdigest(),
+        hashlib.sha1(html_string).hexdigest())
+
+
+def _get_cached_fragment(key, tag_bindings):
+    """Returns cached HTML if all its tags still have the same cache keys."""
+    found, entry = ProcessScopedFragmentCache.instance().cache.get(key)
+    if not found:
+        return None
+    tag_keys, sanitized = entry
+    for tag_name, tag_key in tag_keys.iteritems():
+        if tag_bindings[tag_name].get_fragment_cache_key() != tag_key:
+            return None
+    return sanitized
+
+
+@counters.traced('tags.html_to_safe_dom')
 def html_to_safe_dom(html_string, handler, render_custom_tags=True):
-    """Render HTML text as a tree of safe_dom elements."""
+    """Render HTML text as a tree of safe_dom elements.
+
+    If the HTML is rendered for a course and every custom tag in it allows
+    that, the HTML rendered is cached and shared by all students; see
+    BaseTag.get_fragment_cache_key().
+
+    Args:
+        html_string: string. The HTML to render.
+        handler: controllers.utils.BaseHandler. The server runtime.
+        render_custom_tags: bool. Whether to render custom tags.
+
+    Returns:
+        A safe_dom.NodeList.
+    """
 
     tag_bindings = get_tag_bindings()
 
@@ -334,6 +464,21 @@ def html_to_safe_dom(html_string, handler, render_custom_tags=True):
     if not html_string:
         return node_list
 
+    cache_key = None
+    if render_custom_tags:
+        cache_key = _make_fragment_cache_key(
+            html_string, handler, tag_bindings)
+    if cache_key:
+        sanitized = _get_cached_fragment(cache_key, tag_bindings)
+        if sanitized is not None:
+            FRAGMENT_CACHE_HIT.inc()
+            return node_list.append(_SanitizedFragment(sanitized))
+        FRAGMENT_CACHE_MISS.inc()
+
+    # Cache keys of the tags rendered, and whether the result can be cached
+    tag_keys = {}
+    cacheable = [cache_key is not None]
+
     # Set of all instance id's used in this dom tree, used to detect duplication
     used_instance_ids = set([])
     # A dictionary of environments, one for each tag type which appears in the
@@ -354,6 +499,10 @@ def html_to_safe_dom(html_string, handler, render_custom_tags=True):
             node_list.append(safe_dom.Text(elt.tail))
         return node_list
 
+    def _disable_caching():
+        # Errors may be transient, and some tags are rendered for one student.
+        cacheable[0] = False
+
     def _remove_namespace(tag_name):
         # Remove any namespacing which html5lib may have introduced. Html5lib
         # namespacing is of the form, e.g.,
@@ -376,6 +525,12 @@ def html_to_safe_dom(html_string, handler, render_custom_tags=True):
         try:
             if render_custom_tags and elt.tag in tag_bindings:
                 tag = tag_bindings[elt.tag]()
+                if cacheable[0]:
+                    tag_key = tag.get_fragment_cache_key()
+                    if tag_key is None:
+                        _disable_caching()
+                    else:
+                        tag_keys[elt.tag] = tag_key
                 if isinstance(tag, ContextAwareTag):
                     # Get or initialize a environment dict for this type of tag.
                     # Each tag type gets a separate environment shared by all
@@ -412,6 +567,7 @@ def html_to_safe_dom(html_string, handler, render_custom_tags=True):
 
         except Exception as e:  # pylint: disable=broad-except
             logging.exception('Error handling tag: %s', elt.tag)
+            _disable_caching()
             return _generate_error_message_node_list(
                 original_elt, '%s: %s' % (INVALID_HTML_TAG_MESSAGE, e))
 
@@ -429,6 +585,15 @@ def html_to_safe_dom(html_string, handler, render_custom_tags=True):
         node_list.insert(0, _process_html_tree(header))
         node_list.append(_process_html_tree(footer))
 
+    if cacheable[0]:
+        sanitized = node_list.sanitized
+        if ProcessScopedFragmentCache.instance().cache.put(
+                cache_key, (tag_keys, sanitized)):
+            FRAGMENT_CACHE_PUT.inc()
+        return safe_dom.NodeList().append(_SanitizedFragment(sanitized))
+    elif cache_key:
+        FRAGMENT_CACHE_NOT_CACHEABLE.inc()
+
     return node_list
 
 
@@ -55,6 +55,14 @@ COURSE_EVENTS_RECORDED = PerfCounter(
     'gcb-course-events-recorded',
     'A number of activity/assessment events recorded in a datastore.')
 
+COURSE_EVENT_BATCHES_RECEIVED = PerfCounter(
+    'gcb-course-event-batches-received',
+    'A number of batches of activity/assessment events received by the '
+    'server.')
+
+# The maximum number of events accepted in one batch.
+MAX_EVENTS_PER_BATCH = 100
+
 UNIT_PAGE_TYPE = 'unit'
 ACTIVITY_PAGE_TYPE = 'activity'
 ASSESSMENT_PAGE_TYPE = 'assessment'
@@ -219,31 +227,53 @@ def is_progress_recorded(handler, student):
     return False
 
 
+def declare_progress_prefetch(handler, user):
+    """Declares the progress record pages with a course outline will load."""
+    models.StudentPropertyEntity.prefetch(
+        user.user_id(), handler.get_progress_tracker().PROPERTY_KEY)
+
+
 def add_course_outline_to_template(handler, student):
-    """Adds course outline with all units, lessons, progress to the template."""
+    """Adds course outline with all units, lessons, progress to the template.
+
+    The outline is built in one pass over the units matching the student's
+    track. Lessons of all units are fetched at once, pre/post assessments
+    are looked up by id, and lesson ids used for progress come from the
+    course structure index, which is shared by all requests to the same
+    version of the course. Student progress is loaded once and used for
+    course, unit and lesson progress alike.
+    """
+    course = handler.get_course()
     _tracker = handler.get_progress_tracker()
+    progress = None
     if student and not student.is_transient:
-        augment_assessment_units(handler.get_course(), student)
+        augment_assessment_units(course, student)
+        progress = _tracker.get_or_create_progress(student)
         handler.template_value['course_progress'] = (
-            _tracker.get_course_progress(student))
+            _tracker.get_course_status(progress) or
+            _tracker.NOT_STARTED_STATE)
+    if not is_progress_recorded(handler, student):
+        progress = None
+
+    units = filter_assessments_used_within_units(
+        handler.get_track_matching_student(student))
+    lessons_by_unit_id = course.get_lessons_by_unit_id()
+    units_by_id = dict(
+        (str(unit.unit_id), unit) for unit in course.get_units())
 
     _tuples = []
-    units = handler.get_track_matching_student(student)
-    units = filter_assessments_used_within_units(units)
-    progress = _tracker.get_or_create_progress(
-          student) if is_progress_recorded(handler, student) else None
     for _unit in units:
-        _lessons = handler.get_lessons(_unit.unit_id)
+        _lessons = lessons_by_unit_id.get(str(_unit.unit_id), [])
         _lesson_progress = None
         if progress:
             _lesson_progress = _tracker.get_lesson_progress(
                 student, _unit.unit_id, progress=progress)
         pre_assessment = None
         if _unit.pre_assessment:
-            pre_assessment = handler.find_unit_by_id(_unit.pre_assessment)
+            pre_assessment = units_by_id.get(str(_unit.pre_assessment))
         post_assessment = None
         if _unit.post_assessment:
-            post_assessment = handler.find_unit_by_id(_unit.post_assessment)
+            post_assessment = units_by_id.get(str(_unit.post_assessment))
 
         _tuple = (_unit, _lessons, _lesson_progress,
                   pre_assessment, post_assessment)
@@ -260,7 +290,13 @@ class CourseHandler(BaseHandler):
     @classmethod
     def get_child_routes(cls):
         """Add child handlers for REST."""
-        return [('/rest/events', EventsRESTHandler)]
+        return [
+            ('/rest/events', EventsRESTHandler),
+            ('/rest/events/batch', EventsBatchRESTHandler)]
+
+    def declare_prefetch(self, user):
+        super(CourseHandler, self).declare_prefetch(user)
+        declare_progress_prefetch(self, user)
 
     def get(self):
         """Handles GET requests."""
@@ -381,6 +417,10 @@ class UnitHandler(BaseHandler):
             else:
                 return None
 
+    def declare_prefetch(self, user):
+        super(UnitHandler, self).declare_prefetch(user)
+        declare_progress_prefetch(self, user)
+
     @classmethod
     def set_lesson_title_provider(cls, lesson_title_provider):
         if cls._LESSON_TITLE_PROVIDER:
@@ -1242,8 +1282,7 @@ class EventsRESTHandler(BaseRESTHandler):
         self.error(404)
         return
 
-    def _add_request_facts(self, payload_json):
-        payload_dict = transforms.loads(payload_json)
+    def _add_request_facts(self, payload_dict):
         if 'loc' not in payload_dict:
             payload_dict['loc'] = {}
         loc = payload_dict['loc']
@@ -1260,19 +1299,19 @@ class EventsRESTHandler(BaseRESTHandler):
         user_agent = self.request.headers.get('User-Agent')
         if user_agent:
             payload_dict['user_agent'] = user_agent
-        payload_json = transforms.dumps(payload_dict).lstrip(
-            models.transforms.JSON_XSSI_PREFIX)
-        return payload_json
+        return payload_dict
+
+    def _can_persist_events(self):
+        return (
+            CAN_PERSIST_ACTIVITY_EVENTS.value or
+            CAN_PERSIST_PAGE_EVENTS.value or
+            CAN_PERSIST_TAG_EVENTS.value)
 
     def post(self):
         """Receives event and puts it into datastore."""
 
         COURSE_EVENTS_RECEIVED.inc()
-        can = (
-            CAN_PERSIST_ACTIVITY_EVENTS.value or
-            CAN_PERSIST_PAGE_EVENTS.value or
-            CAN_PERSIST_TAG_EVENTS.value)
-        if not can:
+        if not self._can_persist_events():
             return
 
         request = transforms.loads(self.request.get('request'))
@@ -1283,25 +1322,59 @@ class EventsRESTHandler(BaseRESTHandler):
         if not user:
             return
 
-        source = request.get('source')
-        payload_json = request.get('payload')
-        payload_json = self._add_request_facts(payload_json)
-        models.EventEntity.record(source, user, payload_json)
-        COURSE_EVENTS_RECORDED.inc()
+        self.record_events(
+            user, [(request.get('source'), request.get('payload'))])
 
-        self.process_event(user, source, payload_json)
+    def record_events(self, user, source_payload_pairs):
+        """Records events of a user and updates the progress they make.
+
+        Args:
+          user: the user who sent the events.
+          source_payload_pairs: a list of (source, payload_json) tuples.
+        """
+        events = []
+        for source, payload_json in source_payload_pairs:
+            payload = self._add_request_facts(transforms.loads(payload_json))
+            events.append((source, payload))
+
+        models.EventEntity.record_many(user, [
+            (source, transforms.dumps(payload).lstrip(
+                models.transforms.JSON_XSSI_PREFIX))
+            for source, payload in events])
+        COURSE_EVENTS_RECORDED.inc(len(events))
+
+        self.process_events(user, events)
 
     def process_event(self, user, source, payload_json):
         """Processes an event after it has been recorded in the event stream."""
+        self.process_events(user, [(source, transforms.loads(payload_json))])
 
+    def process_events(self, user, source_payload_pairs):
+        """Updates progress of a student for events recorded in one request.
+
+        Args:
+          user: the user who sent the events.
+          source_payload_pairs: a list of (source, payload) tuples, where the
+              payload is a dict.
+        """
         student = models.Student.get_enrolled_student_by_email(user.email())
         if not student:
             return
 
-        payload = transforms.loads(payload_json)
-
+        tracker = self.get_course().get_progress_tracker()
+        progress_events = []
+        for source, payload in source_payload_pairs:
+            event = self._make_progress_event(
+                tracker, student, source, payload)
+            if event:
+                progress_events.append(event)
+        if progress_events:
+            tracker.put_events(progress_events)
+
+    def _make_progress_event(self, tracker, student, source, payload):
+        """Returns a progress event for tracker.put_events(), or None."""
         if 'location' not in payload:
-            return
+            return None
 
         source_url = payload['location']
 
@@ -1309,7 +1382,7 @@ class EventsRESTHandler(BaseRESTHandler):
             unit_id, lesson_id = get_unit_and_lesson_id_from_url(
                 self, source_url)
             if unit_id is not None and lesson_id is not None:
-                self.get_course().get_progress_tracker().put_block_completed(
+                return tracker.make_block_completed_event(
                     student, unit_id, lesson_id, payload['index'])
         elif source in TAGS_THAT_TRIGGER_COMPONENT_COMPLETION:
             unit_id, lesson_id = get_unit_and_lesson_id_from_url(
@@ -1317,9 +1390,8 @@ class EventsRESTHandler(BaseRESTHandler):
             cpt_id = payload['instanceid']
             if (unit_id is not None and lesson_id is not None and
                 cpt_id is not None):
-                self.get_course().get_progress_tracker(
-                    ).put_component_completed(
-                        student, unit_id, lesson_id, cpt_id)
+                return tracker.make_component_completed_event(
+                    student, unit_id, lesson_id, cpt_id)
         elif source in TAGS_THAT_TRIGGER_HTML_COMPLETION:
             # Records progress for scored lessons.
             unit_id, lesson_id = get_unit_and_lesson_id_from_url(
@@ -1330,5 +1402,50 @@ class EventsRESTHandler(BaseRESTHandler):
             if (unit_id is not None and
                 lesson_id is not None and
                 not lesson.manual_progress):
-                self.get_course().get_progress_tracker().put_html_completed(
+                return tracker.make_html_completed_event(
                     student, unit_id, lesson_id)
+        return None
+
+
+class EventsBatchRESTHandler(EventsRESTHandler):
+    """Provides REST API for recording many events with one request.
+
+    The request holds a list of events, each with a 'source' and a
+    'payload', and one XSRF token for all of them.
+    """
+
+    @classmethod
+    def _is_valid_event(cls, event):
+        return (
+            isinstance(event, dict) and
+            isinstance(event.get('source'), basestring) and
+            isinstance(event.get('payload'), basestring))
+
+    def post(self):
+        """Receives a batch of events and puts them into datastore."""
+
+        request = transforms.loads(self.request.get('request'))
+        events = request.get('events')
+        if (not isinstance(events, list) or
+            len(events) > MAX_EVENTS_PER_BATCH or
+            not all(self._is_valid_event(event) for event in events)):
+            transforms.send_json_response(
+                self, 400, 'Expected a list of at most %s events, each with '
+                'a string source and payload.' % MAX_EVENTS_PER_BATCH)
+            return
+
+        if not self.assert_xsrf_token_or_fail(request, 'event-post', {}):
+            return
+
+        COURSE_EVENT_BATCHES_RECEIVED.inc()
+        COURSE_EVENTS_RECEIVED.inc(len(events))
+        if not events or not self._can_persist_events():
+            return
+
+        user = self.get_user()
+        if not user:
+            return
+
+        self.record_events(
+            user, [(event.get('source'), event.get('payload'))
+                   for event in events])
@@ -104,11 +104,17 @@ not hosting multiple courses, your course will run in a default namespace
 Good luck!
 """
 
+import calendar
+import email.utils
+import gzip
+import hashlib
 import logging
 import mimetypes
 import os
 import posixpath
 import re
+import StringIO
+import sys
 import threading
 import traceback
 import urlparse
@@ -121,6 +127,7 @@ from webapp2_extras import i18n
 import appengine_config
 from common import caching
 from common import safe_dom
+from models import counters
 from models import models
 from models import transforms
 from models.config import ConfigProperty
@@ -134,6 +141,7 @@ from models.vfs import DatastoreBackedFileSystem
 from models.vfs import LocalReadOnlyFileSystem
 from modules.courses import courses as courses_module
 
+from google.appengine.api import apiproxy_stub_map
 from google.appengine.api import namespace_manager
 from google.appengine.api import users
 from google.appengine.ext import db
@@ -172,6 +180,20 @@ DEFAULT_CACHE_CONTROL_PUBLIC = 'public'
 DEFAULT_EXPIRY_DATE = 'Mon, 01 Jan 1990 00:00:00 GMT'
 DEFAULT_PRAGMA = 'no-cache'
 
+# max size for in-process cache of files served from zip bundles
+MAX_ZIP_BUNDLE_CACHE_SIZE_BYTES = 16 * 1024 * 1024
+
+# files larger than this are read from their zip bundle on each request
+MAX_ZIP_BUNDLE_CACHE_ITEM_SIZE_BYTES = 1024 * 1024
+
+# files smaller than this are not worth compressing
+MIN_ZIP_BUNDLE_GZIP_SIZE_BYTES = 512
+
+# non-text content types of files served from zip bundles that compress well
+ZIP_BUNDLE_GZIP_CONTENT_TYPES = frozenset([
+    'application/javascript', 'application/json', 'application/x-javascript',
+    'image/svg+xml'])
+
 # thread local storage for current request PATH_INFO
 PATH_INFO_THREAD_LOCAL = threading.local()
 
@@ -189,6 +211,17 @@ NO_HANDLER_COUNT = PerfCounter(
     'gcb-sites-handler-none',
     'A number of times request was not matched to any handler.')
 
+ZIP_BUNDLE_CACHE_HIT = PerfCounter(
+    'gcb-sites-zip-bundle-cache-hit',
+    'A number of times a file from a zip bundle was found in cache.')
+ZIP_BUNDLE_CACHE_MISS = PerfCounter(
+    'gcb-sites-zip-bundle-cache-miss',
+    'A number of times a file from a zip bundle was not found in cache.')
+ZIP_BUNDLE_NOT_MODIFIED = PerfCounter(
+    'gcb-sites-zip-bundle-not-modified',
+    'A number of times a file from a zip bundle was not sent because the '
+    'client already had it.')
+
 HTTP_BYTES_IN = PerfCounter(
     'gcb-sites-bytes-in',
     'A number of bytes received from clients by the handler.')
@@ -212,6 +245,149 @@ COUNTER_BY_HTTP_CODE = {
     200: HTTP_STATUS_200, 300: HTTP_STATUS_300, 400: HTTP_STATUS_400,
     500: HTTP_STATUS_500}
 
+RPC_CALLS = PerfCounter(
+    'gcb-sites-rpc-calls',
+    'A number of API calls (datastore, memcache, etc.) made while serving '
+    'requests by dynamic handlers.')
+
+CAN_LOG_REQUEST_RPC_COUNTS = ConfigProperty(
+    'gcb_can_log_request_rpc_counts', bool, (
+        'Whether or not to log, for each request served by a dynamic handler, '
+        'the number of API calls it made to each service method, like '
+        'memcache.Get or datastore_v3.Get. Use this to find pages that make '
+        'more calls than they need to.'),
+    False)
+
+TRACE_SAMPLE_EVERY_N_REQUESTS = ConfigProperty(
+    'gcb_trace_sample_every_n_requests', int, (
+        'Trace one in every N requests served by dynamic handlers. A trace '
+        'records where the request spent its time: memcache, datastore '
+        'files, templates and custom tags, with the number of API calls made '
+        'in each. The most recent traces of this application instance are '
+        'shown on the Request Traces tab of the admin console. Set to 0 to '
+        'sample no requests.'),
+    0)
+
+SLOW_REQUEST_LOG_THRESHOLD_MSEC = ConfigProperty(
+    'gcb_slow_request_log_threshold_msec', int, (
+        'Log the trace of any request served by a dynamic handler that takes '
+        'at least this many milliseconds, and show it on the Request Traces '
+        'tab of the admin console. All requests are traced while this is '
+        'set, which adds a small overhead to each. Set to 0 to disable.'),
+    0)
+
+TRACED_REQUESTS = PerfCounter(
+    'gcb-sites-traced-requests',
+    'A number of requests served by dynamic handlers that were traced.')
+SLOW_REQUESTS = PerfCounter(
+    'gcb-sites-slow-requests',
+    'A number of requests served by dynamic handlers that took longer than '
+    'gcb_slow_request_log_threshold_msec.')
+
+
+class RequestRpcCounter(object):
+    """Counts API calls made while serving a request, like Appstats does.
+
+    A hook on the API proxy counts calls by service and method between
+    begin() and end(). Unlike Appstats, no stack traces or timings are kept,
+    so counting is cheap enough to be always on.
+    """
+
+    HOOK_NAME = 'gcb-request-rpc-counter'
+
+    _hooked_apiproxy = None
+    _counts = None
+    _total = 0
+
+    @classmethod
+    def _on_call(cls, service, call, unused_request, unused_response):
+        if cls._counts is not None:
+            name = '%s.%s' % (service, call)
+            cls._counts[name] = cls._counts.get(name, 0) + 1
+            cls._total += 1
+
+    @classmethod
+    def begin(cls):
+        # Tests replace the API proxy; make sure the current one is hooked.
+        if cls._hooked_apiproxy is not apiproxy_stub_map.apiproxy:
+            apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+                cls.HOOK_NAME, cls._on_call)
+            cls._hooked_apiproxy = apiproxy_stub_map.apiproxy
+        cls._counts = {}
+        cls._total = 0
+
+    @classmethod
+    def get_total(cls):
+        """Returns the number of API calls counted so far."""
+        return cls._total
+
+    @classmethod
+    def end(cls):
+        """Stops counting; returns a dict of 'service.method' to call count."""
+        counts = cls._counts or {}
+        cls._counts = None
+        cls._total = 0
+        return counts
+
+
+counters.get_request_rpc_count = RequestRpcCounter.get_total
+
+
+class RequestTracing(object):
+    """Decides which requests to trace and what to do with their traces."""
+
+    _request_count = 0
+    _is_sampled = False
+
+    @classmethod
+    def begin(cls, verb, path):
+        """Traces a request if it is sampled or slow requests are logged."""
+        cls._request_count += 1
+        sample_every = TRACE_SAMPLE_EVERY_N_REQUESTS.value
+        cls._is_sampled = (
+            sample_every > 0 and cls._request_count % sample_every == 0)
+        if cls._is_sampled or SLOW_REQUEST_LOG_THRESHOLD_MSEC.value > 0:
+            counters.Tracer.begin_request('%s %s' % (verb, path))
+
+    @classmethod
+    def end(cls):
+        """Stops tracing; keeps the trace if sampled and logs it if slow."""
+        trace = counters.Tracer.end_request()
+        if not trace:
+            return
+        try:
+            TRACED_REQUESTS.inc()
+            threshold_msec = SLOW_REQUEST_LOG_THRESHOLD_MSEC.value
+            is_slow = (
+                threshold_msec > 0 and trace.duration_msec >= threshold_msec)
+            if is_slow:
+                SLOW_REQUESTS.inc()
+                logging.warning(
+                    'Slow request took %.0f ms:\n%s',
+                    trace.duration_msec, trace.to_text())
+            if cls._is_sampled or is_slow:
+                counters.Tracer.keep(trace)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error(
+                'Failed to end request trace: %s\n%s',
+                e, traceback.format_exc())
+
+
+def report_rpc_counts(verb, path, counts):
+    """Records API calls made by a request as counted by RequestRpcCounter."""
+    try:
+        total = sum(counts.values())
+        RPC_CALLS.inc(increment=total)
+        appengine_config.log_appstats_event('RequestRpcCounts', counts)
+        if CAN_LOG_REQUEST_RPC_COUNTS.value:
+            logging.info(
+                'API calls made by %s %s: %s (%s)', verb, path, total,
+                ', '.join(
+                    '%s: %s' % item for item in sorted(counts.iteritems())))
+    except Exception as e:  # pylint: disable=broad-except
+        logging.error(
+            'Failed to report_rpc_counts(): %s\n%s', e, traceback.format_exc())
+
 
 def count_stats(handler):
     """Records statistics about the request and the response."""
@@ -306,6 +482,40 @@ def unprefix(path, prefix):
     return path
 
 
+def parse_byte_range(range_header, size):
+    """Parses an HTTP Range header asking for a single range of bytes.
+
+    Args:
+      range_header: string. The value of the Range header.
+      size: int. The size of the resource in bytes.
+    Returns:
+      A tuple (start, end) of the offsets of the first byte to serve and of
+      the byte past the last one; None if the header is malformed or asks
+      for several ranges, in which case the whole resource is to be served.
+    Raises:
+      ValueError: if the range asked for is outside of the resource.
+    """
+    match = re.match(r'^bytes=(\d*)-(\d*)$', range_header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if not match.group(1):
+        # A suffix range: the last N bytes.
+        length = int(match.group(2))
+        if not length:
+            raise ValueError('Empty suffix range.')
+        return max(size - length, 0), size
+    start = int(match.group(1))
+    end = size
+    if match.group(2):
+        last = int(match.group(2))
+        if last < start:
+            return None
+        end = min(last + 1, size)
+    if start >= size:
+        raise ValueError('Range starts past the end.')
+    return start, end
+
+
 def set_static_resource_cache_control(handler):
     """Properly sets Cache-Control for a WebOb/webapp2 response."""
     handler.response.cache_control.no_cache = None
@@ -333,6 +543,160 @@ def set_default_response_headers(handler):
         handler.response.pragma = DEFAULT_PRAGMA
 
 
+class ZipBundleEntry(object):
+    """A file of a zip bundle, ready to be served."""
+
+    def __init__(self, content, content_type, etag, last_modified=None):
+        self.content = content
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.gzipped = None
+        if self._can_gzip():
+            gzipped = self._gzip(content)
+            if len(gzipped) < len(content):
+                self.gzipped = gzipped
+
+    def _can_gzip(self):
+        if len(self.content) < MIN_ZIP_BUNDLE_GZIP_SIZE_BYTES:
+            return False
+        if not self.content_type:
+            return False
+        return (self.content_type.startswith('text/') or
+                self.content_type in ZIP_BUNDLE_GZIP_CONTENT_TYPES)
+
+    @classmethod
+    def _gzip(cls, content):
+        buf = StringIO.StringIO()
+        gzip_file = gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)
+        try:
+            gzip_file.write(content)
+        finally:
+            gzip_file.close()
+        return buf.getvalue()
+
+    def get_size(self):
+        size = sys.getsizeof(self.content)
+        if self.gzipped:
+            size += sys.getsizeof(self.gzipped)
+        return size
+
+    def is_not_modified(self, request):
+        """Checks if the client sending the request already has the file."""
+        etags = request.headers.get('If-None-Match')
+        if etags:
+            for etag in etags.split(','):
+                etag = etag.strip()
+                if etag.startswith('W/'):
+                    etag = etag[2:]
+                if etag == self.etag or etag == '*':
+                    return True
+            return False
+        since = request.headers.get('If-Modified-Since')
+        if since and self.last_modified:
+            return since.split(';')[0].strip() == self.last_modified
+        return False
+
+    def serve(self, handler):
+        """Writes the file, or 304 if client has it, to the handler response."""
+        handler.response.headers['ETag'] = self.etag
+        if self.last_modified:
+            handler.response.headers['Last-Modified'] = self.last_modified
+        if self.gzipped:
+            handler.response.headers['Vary'] = 'Accept-Encoding'
+        handler.SetCachingHeaders()
+
+        if self.is_not_modified(handler.request):
+            ZIP_BUNDLE_NOT_MODIFIED.inc()
+            handler.response.set_status(304)
+            return
+
+        if self.content_type:
+            handler.response.headers['Content-Type'] = self.content_type
+        if self.gzipped and 'gzip' in handler.request.headers.get(
+                'Accept-Encoding', ''):
+            handler.response.headers['Content-Encoding'] = 'gzip'
+            handler.response.out.write(self.gzipped)
+        else:
+            handler.response.out.write(self.content)
+
+
+class ZipBundle(object):
+    """A zip file indexed once, with its files served from in-process cache.
+
+    Files are decompressed when first requested and kept, together with their
+    compressed copy, in a bounded LRU cache shared by all bundles.
+    """
+
+    def __init__(self, zipfilename):
+        self._zipfilename = zipfilename
+        self._zipfile = zipfile.ZipFile(zipfilename)
+        self._infos = dict(
+            (info.filename, info) for info in self._zipfile.infolist())
+
+    @classmethod
+    def get(cls, zipfilename):
+        """Returns bundle for a zip file; None if it can't be opened."""
+        bundles = ProcessScopedZipBundleCache.instance().bundles
+        bundle = bundles.get(zipfilename)
+        if bundle is None:
+            try:
+                bundle = ZipBundle(zipfilename)
+            except (IOError, RuntimeError, zipfile.BadZipfile), err:
+                # If the zipfile can't be opened, that's probably a
+                # configuration error in the app, so it's logged as an error.
+                logging.error('Can\'t open zipfile %s: %s', zipfilename, err)
+                bundle = ''  # Special value to cache negative results.
+            bundles[zipfilename] = bundle
+        return bundle or None
+
+    def read(self, name):
+        """Returns content of a file; raises KeyError if there is no file."""
+        return self._zipfile.read(self._infos[name])
+
+    def get_entry(self, name):
+        """Returns an entry to serve for a file; None if there is no file."""
+        info = self._infos.get(name)
+        if info is None:
+            return None
+
+        cache = ProcessScopedZipBundleCache.instance().entries
+        key = 'file:%s:%s' % (self._zipfilename, name)
+        found, entry = cache.get(key)
+        if found:
+            ZIP_BUNDLE_CACHE_HIT.inc()
+            return entry
+        ZIP_BUNDLE_CACHE_MISS.inc()
+
+        try:
+            content = self._zipfile.read(info)
+        except RuntimeError, err:
+            logging.error(
+                'Can\'t read %s in %s: %s', name, self._zipfilename, err)
+            return None
+        entry = ZipBundleEntry(
+            content, mimetypes.guess_type(name)[0],
+            '"%08x-%x"' % (info.CRC, info.file_size),
+            last_modified=email.utils.formatdate(
+                calendar.timegm(info.date_time), usegmt=True))
+        cache.put(key, entry)
+        return entry
+
+
+class ProcessScopedZipBundleCache(caching.ProcessScopedSingleton):
+    """This class holds indexed zip bundles and cache of their files."""
+
+    def __init__(self):
+        self.bundles = {}
+        self.entries = caching.LRUCache(
+            max_size_bytes=MAX_ZIP_BUNDLE_CACHE_SIZE_BYTES,
+            max_item_size_bytes=MAX_ZIP_BUNDLE_CACHE_ITEM_SIZE_BYTES)
+        self.entries.get_entry_size = self._get_entry_size
+
+    def _get_entry_size(self, key, entry):
+        return sys.getsizeof(key) + entry.get_size()
+
+
 def make_zip_handler(zipfilename):
     """Creates a handler that serves files from a zip file."""
 
@@ -362,9 +726,21 @@ def make_zip_handler(zipfilename):
                 return
 
             ZIP_HANDLER_COUNT.inc()
-            self.ServeFromZipFile(zipfilename, path)
+            self.serve_from_zip_bundle(zipfilename, path)
             count_stats(self)
 
+        def serve_from_zip_bundle(self, zipfilename, name):
+            """Serves a file from an indexed zip bundle."""
+            bundle = ZipBundle.get(zipfilename)
+            entry = None
+            if bundle:
+                entry = bundle.get_entry(name)
+            if not entry:
+                self.error(404)
+                self.response.out.write('Not found')
+                return
+            entry.serve(self)
+
         def SetCachingHeaders(self):  # pylint: disable=C6409
             """Properly controls caching."""
             set_static_resource_cache_control(self)
@@ -376,11 +752,9 @@ class CssComboZipHandler(zipserve.ZipHandler):
     """A handler which combines a files served from a zip file.
 
     The paths for the files within the zip file are presented
-    as query parameters.
+    as query parameters. The combined output is cached by query string.
     """
 
-    zipfile_cache = {}
-
     def get(self):
         raise NotImplementedError()
 
@@ -390,20 +764,25 @@ class CssComboZipHandler(zipserve.ZipHandler):
 
     def serve_from_zip_file(self, zipfilename, static_file_handler):
         """Assemble the download by reading file from zip file."""
-        zipfile_object = self.zipfile_cache.get(zipfilename)
-        if zipfile_object is None:
-            try:
-                zipfile_object = zipfile.ZipFile(zipfilename)
-            except (IOError, RuntimeError, zipfile.BadZipfile), err:
-                # If the zipfile can't be opened, that's probably a
-                # configuration error in the app, so it's logged as an error.
-                logging.error('Can\'t open zipfile %s: %s', zipfilename, err)
-                zipfile_object = ''  # Special value to cache negative results.
-            self.zipfile_cache[zipfilename] = zipfile_object
-        if not zipfile_object:
+        bundle = ZipBundle.get(zipfilename)
+        if not bundle:
             self.error(404)
             return
 
+        cache = ProcessScopedZipBundleCache.instance().entries
+        key = 'combo:%s:%s?%s' % (
+            zipfilename, static_file_handler, self.request.query_string)
+        found, entry = cache.get(key)
+        if found:
+            ZIP_BUNDLE_CACHE_HIT.inc()
+        else:
+            ZIP_BUNDLE_CACHE_MISS.inc()
+            entry = self._combine(bundle, zipfilename, static_file_handler)
+            cache.put(key, entry)
+        entry.serve(self)
+
+    def _combine(self, bundle, zipfilename, static_file_handler):
+        """Reads and combines the files named in the query string."""
         all_content_types = set()
         for name in self.request.GET:
             all_content_types.add(mimetypes.guess_type(name))
@@ -411,19 +790,22 @@ class CssComboZipHandler(zipserve.ZipHandler):
             content_type = all_content_types.pop()[0]
         else:
             content_type = 'text/plain'
-        self.response.headers['Content-Type'] = content_type
-
-        self.SetCachingHeaders()
 
+        parts = []
         for name in self.request.GET:
             try:
-                content = zipfile_object.read(name)
+                content = bundle.read(name)
                 if content_type == 'text/css':
                     content = self._fix_css_paths(
-                        name, content, static_file_handler)
-                self.response.out.write(content)
+                        name, content, static_file_handler).encode('utf-8')
+                parts.append(content)
             except (KeyError, RuntimeError), err:
                 logging.error('Not found %s in %s', name, zipfilename)
+        content = ''.join(parts)
+
+        return ZipBundleEntry(
+            content, content_type,
+            '"%s"' % hashlib.md5(content).hexdigest())
 
     def _fix_css_paths(self, path, css, static_file_handler):
         """Transform relative url() settings in CSS to absolute.
@@ -488,7 +870,7 @@ class AssetHandler(utils.BaseHandler):
         """Handles GET requests."""
         models.MemcacheManager.begin_readonly()
         try:
-            stream = self.app_context.fs.open(self.filename)
+            stream = self.app_context.fs.open_chunked(self.filename)
             if not stream:
                 self.error(404)
                 return
@@ -498,7 +880,27 @@ class AssetHandler(utils.BaseHandler):
             set_static_resource_cache_control(self)
             self.response.headers['Content-Type'] = self.get_mime_type(
                 self.filename)
-            self.response.write(stream.read())
+            self.response.headers['Accept-Ranges'] = 'bytes'
+
+            start, end = 0, stream.size
+            range_header = self.request.headers.get('Range')
+            if range_header:
+                try:
+                    byte_range = parse_byte_range(range_header, stream.size)
+                except ValueError:
+                    self.response.set_status(416)
+                    self.response.headers['Content-Range'] = (
+                        'bytes */%s' % stream.size)
+                    return
+                if byte_range:
+                    start, end = byte_range
+                    self.response.set_status(206)
+                    self.response.headers['Content-Range'] = (
+                        'bytes %s-%s/%s' % (start, end - 1, stream.size))
+
+            # Large files are written a chunk at a time, as chunks arrive.
+            for chunk in stream.iter_chunks(start, end):
+                self.response.write(chunk)
         finally:
             models.MemcacheManager.end_readonly()
 
@@ -802,8 +1204,8 @@ class ApplicationContext(object):
             dirs += additional_dirs
         jinja_environment = self.fs.get_jinja_environ(dirs)
 
+        # Translations are installed; they follow the current locale.
         i18n.get_i18n().set_locale(locale)
-        jinja_environment.install_gettext_translations(i18n)
         return jinja_environment
 
     def is_editable_fs(self):
@@ -860,6 +1262,7 @@ def set_path_info(path):
         raise Exception('Expected no path set.')
     try:
         PATH_INFO_THREAD_LOCAL.path = path
+        PATH_INFO_THREAD_LOCAL.course = None
         PATH_INFO_THREAD_LOCAL.old_namespace = namespace_manager.get_namespace()
         namespace_manager.set_namespace(
             ApplicationContext.get_namespace_name_for_request())
@@ -893,11 +1296,23 @@ def unset_path_info():
                 namespace_manager.set_namespace(
                     PATH_INFO_THREAD_LOCAL.old_namespace)
                 del PATH_INFO_THREAD_LOCAL.old_namespace
+                del PATH_INFO_THREAD_LOCAL.course
                 del PATH_INFO_THREAD_LOCAL.path
 
 
-def _build_course_list_from(rules_text, create_vfs=True):
-    """Compute the list of contexts from the text rules."""
+def _build_course_list_from(rules_text, create_vfs=True, reusable=None):
+    """Compute the list of contexts from the text rules.
+
+    Args:
+        rules_text: string. The text of course definition rules.
+        create_vfs: bool. Whether to create a file system for each context.
+        reusable: dict of existing ApplicationContext objects keyed by the rule
+            they were created from; a context is reused instead of creating a
+            new one if its rule is unchanged.
+
+    Returns:
+        A list of ApplicationContext objects, one for each rule.
+    """
     if not rules_text:
         return []
 
@@ -972,6 +1387,10 @@ def _build_course_list_from(rules_text, create_vfs=True):
                 'Namespace \'%s\' is already defined.' % (rule, namespace))
         namespaces[namespace] = True
 
+        if reusable and rule in reusable:
+            all_contexts.append(reusable[rule])
+            continue
+
         vfs = None
         if create_vfs:
             vfs = AbstractFileSystem(create_fs(namespace))
@@ -1000,13 +1419,47 @@ def get_course_index(rules_text=None):
     if course_index:
         return course_index
 
-    course_index = CourseIndex(_build_course_list_from(rules_text))
+    course_index = _rebuild_course_index(
+        rules_text, ApplicationContext._COURSE_INDEX_CACHE.values())
 
     # pylint: disable=protected-access
     ApplicationContext._COURSE_INDEX_CACHE = {rules_text: course_index}
     return course_index
 
 
+@appengine_config.timeandlog('CourseIndex.rebuild', duration_only=True)
+def _rebuild_course_index(rules_text, old_indexes):
+    """Builds course index reusing contexts of unchanged rules of old indexes.
+
+    Contexts hold the file system and the caches of the course; recreating all
+    of them whenever any rule changes, e.g. when a new course is added, would
+    make all courses start with cold caches.
+
+    Args:
+        rules_text: string. The text of course definition rules.
+        old_indexes: list of CourseIndex objects to reuse contexts from.
+
+    Returns:
+        A new CourseIndex.
+    """
+    reusable = {}
+    for old_index in old_indexes:
+        for app_context in old_index.get_all_courses():
+            if app_context.raw and app_context.fs is not None:
+                reusable[app_context.raw] = app_context
+
+    all_contexts = _build_course_list_from(rules_text, reusable=reusable)
+
+    reused = set([
+        id(app_context) for app_context in all_contexts
+        if reusable.get(app_context.raw) is app_context])
+    logging.info(
+        'Course index rebuilt: %s contexts reused, %s created, %s retired.',
+        len(reused), len(all_contexts) - len(reused),
+        len(reusable) - len(reused))
+    return CourseIndex(all_contexts)
+
+
 def get_app_context_for_namespace(namespace):
     """Chooses the app_context that matches a namespace."""
     app_context = get_course_index().get_app_context_for_namespace(namespace)
@@ -1024,7 +1477,17 @@ def get_course_for_current_request():
     """Chooses app_context that matches current request context path."""
     if not has_path_info():
         return None
-    return get_course_for_path(get_path_info())
+
+    # The course is looked up several times for each request; we remember it
+    # for as long as the course index that found it is current.
+    course_index = get_course_index()
+    if PATH_INFO_THREAD_LOCAL.course:
+        found_in_index, app_context = PATH_INFO_THREAD_LOCAL.course
+        if found_in_index is course_index:
+            return app_context
+    app_context = course_index.get_course_for_path(get_path_info())
+    PATH_INFO_THREAD_LOCAL.course = (course_index, app_context)
+    return app_context
 
 
 def get_all_courses(rules_text=None):
@@ -1187,6 +1650,60 @@ order they are defined.""")
     ), 'course:/:/:', multiline=True, validator=_courses_config_validator)
 
 
+class RoutingTrie(object):
+    """Resolves a URL path to a handler using routes compiled in advance.
+
+    Routes are matched in their entirety. Only zipserve.ZipHandler routes are
+    also matched by a prefix, as they serve all files below them; the longest
+    such prefix wins. These routes are kept in a tree keyed by path part, so
+    the prefix match is a single walk over the parts of the path.
+    """
+
+    def __init__(self, urls_map):
+        self._routes = dict(urls_map)
+        self._prefix_routes = {}
+        for path, handler in urls_map.iteritems():
+            if self._is_prefix_handler(handler):
+                node = self._prefix_routes
+                for part in self._split(path):
+                    node = node.setdefault(part, {})
+                node[None] = handler
+
+    @classmethod
+    def _is_prefix_handler(cls, handler):
+        return isinstance(handler, zipserve.ZipHandler) or (
+            isinstance(handler, type) and
+            issubclass(handler, zipserve.ZipHandler))
+
+    @classmethod
+    def _split(cls, path):
+        return [part for part in path.split('/') if part]
+
+    def get_handler_factory(self, path):
+        """Returns handler for the path, or None if no route matches."""
+        handler = self._routes.get(path)
+        if handler:
+            return handler
+
+        candidate = None
+        node = self._prefix_routes
+        for part in path.split('/'):
+            if not part:
+                continue
+            node = node.get(part)
+            if node is None:
+                break
+            candidate = node.get(None, candidate)
+        return candidate
+
+
+class WarmupHandler(webapp2.RequestHandler):
+    """Prepares a new instance before App Engine sends it user requests."""
+
+    def get(self):
+        Registry.get_overrides(force_update=True)
+
+
 class ApplicationRequestHandler(webapp2.RequestHandler):
     """Handles dispatching of all URL's to proper handlers."""
 
@@ -1249,6 +1766,7 @@ class ApplicationRequestHandler(webapp2.RequestHandler):
         urls_map = {}
         cls.bind_to(urls, urls_map)
         cls.urls_map = urls_map
+        cls.routing_trie = RoutingTrie(urls_map)
 
     def get_handler(self):
         """Finds a course suitable for handling this request."""
@@ -1270,26 +1788,7 @@ class ApplicationRequestHandler(webapp2.RequestHandler):
 
     def _get_handler_factory_for_path(self, path):
         """Picks a handler to handle the path."""
-        # Checks if path maps in its entirety.
-        if path in ApplicationRequestHandler.urls_map:
-            return ApplicationRequestHandler.urls_map[path]
-
-        # Check if partial path maps. For now, let only zipserve.ZipHandler
-        # handle partial matches. We want to find the longest possible match.
-        parts = path.split('/')
-        candidate = None
-        partial_path = ''
-        for part in parts:
-            if part:
-                partial_path += '/' + part
-                if partial_path in ApplicationRequestHandler.urls_map:
-                    handler = ApplicationRequestHandler.urls_map[partial_path]
-                    if (
-                            isinstance(handler, zipserve.ZipHandler) or
-                            issubclass(handler, zipserve.ZipHandler)):
-                        candidate = handler
-
-        return candidate
+        return ApplicationRequestHandler.routing_trie.get_handler_factory(path)
 
     def get_handler_for_course_type(self, context, path):
         """Gets the right handler for the given context and path."""
@@ -1342,6 +1841,8 @@ class ApplicationRequestHandler(webapp2.RequestHandler):
     @appengine_config.timeandlog('invoke_http_verb')
     def invoke_http_verb(self, verb, path, no_handler):
         """Sets up the environemnt and invokes HTTP verb on the self.handler."""
+        RequestRpcCounter.begin()
+        RequestTracing.begin(verb, path)
         try:
             set_path_info(path)
             handler = self.get_handler()
@@ -1357,6 +1858,8 @@ class ApplicationRequestHandler(webapp2.RequestHandler):
         finally:
             count_stats(self)
             unset_path_info()
+            RequestTracing.end()
+            report_rpc_counts(verb, path, RequestRpcCounter.end())
 
     def _error_404(self, path):
         """Fail with 404."""
@@ -1728,6 +2231,8 @@ def test_url_to_handler_mapping_for_course_type():
     assert_handled('/zip/a', FakeHandler3)
     assert_handled('/zip/a/b', FakeHandler4)
     assert_handled('/zip/a/b/c', FakeHandler4)
+    assert_handled('/zip/a/b/', FakeHandler4)
+    assert_handled('/zip/a/c', FakeHandler3)
 
     # Negative cases
     assert_handled('/baz', None)
@@ -1739,6 +2244,28 @@ def test_url_to_handler_mapping_for_course_type():
     ApplicationRequestHandler.bind([])
 
 
+def test_course_index_reuses_unchanged_contexts():
+    """Test that contexts of unchanged rules survive a change of rules."""
+    setup_courses('course:/a:/c/a, course:/b:/c/b')
+    course_a, course_b = get_all_courses()
+
+    setup_courses('course:/a:/c/a, course:/b:/c/b2, course:/d:/c/d')
+    all_courses = get_all_courses()
+    assert 3 == len(all_courses)
+    assert all_courses[0] is course_a
+    assert all_courses[1] is not course_b
+    assert '/c/b2' == all_courses[1].get_home_folder()
+    assert all_courses[2].get_slug() == '/d'
+    assert get_course_for_path('/a/foo') is course_a
+
+    setup_courses('course:/d:/c/d')
+    remaining_courses = get_all_courses()
+    assert 1 == len(remaining_courses)
+    assert remaining_courses[0] is all_courses[2]
+    assert not get_course_for_path('/a/foo')
+    reset_courses()
+
+
 def test_namespace_collisions_are_detected():
     """Test that namespace collisions are detected and are not allowed."""
     setup_courses('foo:/a/b:/c/d, bar:/a/b:/c-d')
@@ -1776,6 +2303,7 @@ def run_all_unit_tests():
 
     test_get_course_for_path()
     test_namespace_collisions_are_detected()
+    test_course_index_reuses_unchanged_contexts()
     test_unprefix()
     test_rule_definitions()
     test_url_to_rule_mapping()
@@ -38,6 +38,7 @@ from common import schema_fields
 from common import tags
 from common import utils as common_utils
 from common.crypto import XsrfTokenManager
+from models import counters
 from models import courses
 from models import resources_display
 from models import models
@@ -720,6 +721,7 @@ class CourseHandler(ApplicationHandler):
             self.template_value['selected_locale'] = self.get_locale_for(
                 self.request, self.app_context, prefs=prefs)
 
+    @counters.traced('CourseHandler.get_template')
     def get_template(self, template_file, additional_dirs=None, prefs=None):
         """Computes location of template files for the current namespace."""
 
@@ -746,12 +748,39 @@ class CourseHandler(ApplicationHandler):
 class BaseHandler(CourseHandler):
     """Base handler."""
 
+    # Callbacks declaring objects that pages of a course are going to load,
+    # so all of them are read at once before the page is rendered. Each is
+    # called with the handler and the current user, and calls the prefetch
+    # methods of the DAOs, like models.StudentPropertyEntity.prefetch().
+    PREFETCH_HOOKS = []
+
     def __init__(self, *args, **kwargs):
         super(BaseHandler, self).__init__(*args, **kwargs)
         self._old_locale = None
 
+    def declare_prefetch(self, user):
+        """Declares objects this handler is going to load for a user.
+
+        Handlers that load more objects of a user extend this method.
+
+        Args:
+          user: users.User; the current user.
+        """
+        Student.prefetch_by_email(user.email())
+        StudentProfileDAO.prefetch_profile_by_user_id(user.user_id())
+        models.StudentPreferencesDAO.prefetch(user.user_id())
+        common_utils.run_hooks(self.PREFETCH_HOOKS, self, user)
+
+    def prefetch(self):
+        """Loads objects declared by declare_prefetch() with batched RPCs."""
+        user = self.get_user()
+        if user:
+            self.declare_prefetch(user)
+            models.EntityPrefetcher.instance().fetch()
+
     def before_method(self, verb, path):
         """Modify global locale value for the duration of this handler."""
+        self.prefetch()
         self._old_locale = self.app_context.get_current_locale()
         new_locale = self.get_locale_for(self.request, self.app_context)
         self.app_context.set_current_locale(new_locale)
@@ -846,7 +875,8 @@ class BaseHandler(CourseHandler):
         try:
             template = self.get_template(
                 template_file, additional_dirs=additional_dirs, prefs=prefs)
-            self.response.out.write(template.render(self.template_value))
+            with counters.Tracer.span('BaseHandler.render_template'):
+                self.response.out.write(template.render(self.template_value))
         finally:
             models.MemcacheManager.end_readonly()
             courses.Course.clear_current()
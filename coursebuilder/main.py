@@ -53,6 +53,9 @@ global_routes, namespaced_routes = custom_modules.Registry.get_all_routes()
 sites.ApplicationRequestHandler.bind(namespaced_routes)
 app_routes = [(r'(.*)', sites.ApplicationRequestHandler)]
 
+# load config overrides when a new instance starts, not on a user request
+warmup_routes = [('/_ah/warmup', sites.WarmupHandler)]
+
 # enable Appstats handlers if requested
 appstats_routes = []
 if appengine_config.gcb_appstats_enabled():
@@ -69,6 +72,6 @@ webapp2_i18n_config = {'translations_path': os.path.join(
 
 # init application
 app = webapp2.WSGIApplication(
-    global_routes + appstats_routes + app_routes,
+    global_routes + appstats_routes + warmup_routes + app_routes,
     config={'webapp2_extras.i18n': webapp2_i18n_config},
     debug=not appengine_config.PRODUCTION_MODE)
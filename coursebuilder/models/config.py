@@ -33,6 +33,7 @@ import transforms
 
 import appengine_config
 
+from google.appengine.api import memcache
 from google.appengine.api import namespace_manager
 from google.appengine.ext import db
 
@@ -43,6 +44,21 @@ DEFAULT_UPDATE_INTERVAL_SEC = 60
 # The longest update interval supported.
 MAX_UPDATE_INTERVAL_SEC = 60 * 5
 
+# How often to check the version of overrides in memcache.
+VERSION_CHECK_INTERVAL_SEC = 1
+
+# How often to reload all overrides even if their version did not change; this
+# recovers from changes that failed to bump the version.
+FULL_RELOAD_INTERVAL_SEC = 60 * 60
+
+# The longest list of changes to apply one by one instead of reloading all.
+MAX_CHANGES_TO_APPLY = 100
+
+# Memcache key holding the version of overrides, and keys holding the name of
+# the property changed by each version.
+VERSION_MEMCACHE_KEY = 'gcb-config-overrides-version'
+CHANGE_MEMCACHE_KEY_PREFIX = 'gcb-config-overrides-change-'
+
 
 # Allowed property types.
 TYPE_INT = int
@@ -204,52 +220,137 @@ class Registry(object):
     test_overrides = {}
     db_items = {}
     db_overrides = {}
-    names_with_draft = {}
+    names_with_draft = set()
     last_update_time = 0
+    last_version_check_time = 0
+    version = None
     update_index = 0
     threadlocal = threading.local()
     REENTRY_ATTR_NAME = 'busy'
 
     @classmethod
     def get_overrides(cls, force_update=False):
-        """Returns current property overrides, maybe cached."""
+        """Returns current property overrides, maybe cached.
+
+        Instead of reloading all overrides from a datastore on a fixed
+        interval, we check their version in memcache, which is bumped by each
+        ConfigPropertyEntity put or delete, and only reload properties that
+        changed. All overrides are reloaded if the changes are not known, or if
+        the version is not in memcache and UPDATE_INTERVAL_SEC has elapsed.
+
+        Args:
+            force_update: bool. Whether to reload all overrides now.
+
+        Returns:
+            A dict of property values keyed by property name.
+        """
 
         now = long(time.time())
         age = now - cls.last_update_time
-        max_age = UPDATE_INTERVAL_SEC.get_value(db_overrides=cls.db_overrides)
+        since_check = now - cls.last_version_check_time
 
         # do not update if call is reentrant or outer db transaction exists
         busy = hasattr(cls.threadlocal, cls.REENTRY_ATTR_NAME) or (
             db.is_in_transaction())
 
-        if (not busy) and (force_update or age < 0 or age >= max_age):
+        if (not busy) and (
+                force_update or age < 0 or age >= FULL_RELOAD_INTERVAL_SEC or
+                since_check < 0 or since_check >= VERSION_CHECK_INTERVAL_SEC):
             # Value of '0' disables all datastore overrides.
             if UPDATE_INTERVAL_SEC.get_value() == 0:
                 cls.db_overrides = {}
                 return cls.db_overrides
 
-            # Load overrides from a datastore.
+            max_age = UPDATE_INTERVAL_SEC.get_value(
+                db_overrides=cls.db_overrides)
             setattr(cls.threadlocal, cls.REENTRY_ATTR_NAME, True)
             try:
                 old_namespace = namespace_manager.get_namespace()
                 try:
                     namespace_manager.set_namespace(
                         appengine_config.DEFAULT_NAMESPACE_NAME)
-                    cls._load_from_db()
+                    cls._update_from_db(now, force_update or (
+                        age < 0 or age >= FULL_RELOAD_INTERVAL_SEC), max_age)
                 finally:
                     namespace_manager.set_namespace(old_namespace)
             except Exception as e:  # pylint: disable=broad-except
                 logging.error(
                     'Failed to load properties from a database: %s.', str(e))
+                cls.last_update_time = now
             finally:
                 delattr(cls.threadlocal, cls.REENTRY_ATTR_NAME)
 
                 # Avoid overload and update timestamp even if we failed.
-                cls.last_update_time = now
-                cls.update_index += 1
+                cls.last_version_check_time = now
 
         return cls.db_overrides
 
+    @classmethod
+    def _update_from_db(cls, now, force_reload, max_age):
+        """Reloads changed or all properties, depending on their version."""
+        version = cls._get_version()
+        if version is None:
+            # The version is not known; reload all on the old schedule.
+            force_reload = force_reload or now - cls.last_update_time >= max_age
+            if not force_reload:
+                return
+        elif version == cls.version and not force_reload:
+            return
+
+        names = None
+        if not force_reload:
+            names = cls._get_changed_names(cls.version, version)
+        if names is None:
+            cls.last_update_time = now
+            cls._load_from_db()
+        else:
+            cls._load_from_db_by_name(names)
+        cls.version = version
+        cls.update_index += 1
+
+    @classmethod
+    def _get_version(cls):
+        """Returns version of overrides from memcache; None if unavailable."""
+        version = memcache.get(
+            VERSION_MEMCACHE_KEY,
+            namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
+        if version is None and memcache.add(
+                VERSION_MEMCACHE_KEY, 0,
+                namespace=appengine_config.DEFAULT_NAMESPACE_NAME):
+            version = 0
+        return version
+
+    @classmethod
+    def _get_changed_names(cls, old_version, new_version):
+        """Returns names of properties changed between versions, if known."""
+        if old_version is None or new_version is None:
+            return None
+        if not 0 < new_version - old_version <= MAX_CHANGES_TO_APPLY:
+            return None
+        keys = [
+            '%s%s' % (CHANGE_MEMCACHE_KEY_PREFIX, version)
+            for version in xrange(old_version + 1, new_version + 1)]
+        names = memcache.get_multi(
+            keys, namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
+        if len(names) != len(keys):
+            return None
+        return set(names.values())
+
+    @classmethod
+    def _bump_version(cls, name):
+        """Tells other instances that a property has changed."""
+        try:
+            version = memcache.incr(
+                VERSION_MEMCACHE_KEY, initial_value=0,
+                namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
+            if version is not None:
+                memcache.set(
+                    '%s%s' % (CHANGE_MEMCACHE_KEY_PREFIX, version), name,
+                    namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error(
+                'Failed to bump version of property %s: %s.', name, str(e))
+
     @classmethod
     def _load_from_db(cls):
         """Loads dynamic properties from db."""
@@ -263,10 +364,31 @@ class Registry(object):
         cls.db_overrides = overrides
         cls.names_with_draft = drafts
 
+    @classmethod
+    def _load_from_db_by_name(cls, names):
+        """Loads only the named dynamic properties from db."""
+        names = list(names)
+        items = ConfigPropertyEntity.get_by_key_name(names)
+        for name, item in zip(names, items):
+            if item:
+                cls.db_items[name] = item
+                cls._config_property_entity_changed(item)
+            else:
+                cls._config_property_entity_deleted(name)
+
     @classmethod
     def _config_property_entity_changed(cls, item):
+        # A value that fails to cast or validate is left out, as it is by a
+        # full reload, rather than keeping the value it replaces.
+        cls.db_overrides.pop(item.key().name(), None)
         cls._set_value(item, cls.db_overrides, cls.names_with_draft)
 
+    @classmethod
+    def _config_property_entity_deleted(cls, name):
+        cls.db_items.pop(name, None)
+        cls.db_overrides.pop(name, None)
+        cls.names_with_draft.discard(name)
+
     @classmethod
     def _set_value(cls, item, overrides, drafts):
         name = item.key().name()
@@ -323,13 +445,20 @@ class ConfigPropertyEntity(entities.BaseEntity):
 
         # And tell local registry.  Do this by direct call and synchronously
         # so that this setting will be internally consistent within the
-        # remainder of this server's path of execution.  (Note that the
-        # setting is _not_ going to be immediately available at all other
-        # instances; they will pick it up in due course after
-        # UPDATE_INTERVAL_SEC has elapsed.
+        # remainder of this server's path of execution.  Other instances
+        # pick it up when they next check the version of overrides.
 
         # pylint: disable=protected-access
         Registry._config_property_entity_changed(self)
+        Registry._bump_version(self.key().name())
+
+    def delete(self):
+        name = self.key().name()
+        super(ConfigPropertyEntity, self).delete()
+
+        # pylint: disable=protected-access
+        Registry._config_property_entity_deleted(name)
+        Registry._bump_version(name)
 
 
 def run_all_unit_tests():
@@ -374,9 +503,12 @@ def validate_update_interval(value, errors):
 
 UPDATE_INTERVAL_SEC = ConfigProperty(
     'gcb_config_update_interval_sec', int, (
-        'An update interval (in seconds) for reloading runtime properties '
-        'from a datastore. Using this editor, you can set this value to an '
-        'integer between 1 and %s, inclusive. To completely disable reloading '
+        'An update interval (in seconds) for reloading all runtime '
+        'properties from a datastore when their version cannot be read from '
+        'memcache. Otherwise, changes are noticed by checking the version in '
+        'memcache, and only changed properties are reloaded. Using this '
+        'editor, you can set this value to an integer between 1 and %s, '
+        'inclusive. To completely disable reloading '
         'properties from a datastore, you must set the value to 0. However, '
         'you can only set the value to 0 by directly modifying the app.yaml '
         'file.' % MAX_UPDATE_INTERVAL_SEC),
@@ -16,6 +16,10 @@
 
 __author__ = 'Pavel Simakov (psimakov@google.com)'
 
+import collections
+import functools
+import time
+
 
 def incr_counter_global_value(unused_name, unused_delta):
     """Hook method for global aggregation."""
@@ -82,3 +86,209 @@ class Registry(object):
         """Clears all counters for tests."""
         for counter in cls.registered.values():
             counter._clear()  # pylint: disable=protected-access
+
+
+def get_request_rpc_count():
+    """Hook method returning the number of API calls made by this request."""
+    return 0
+
+
+class TraceSpan(object):
+    """A named and timed piece of work done while serving a request."""
+
+    def __init__(self, name):
+        self.name = name
+        self.children = []
+        self.start_time = time.time()
+        self.end_time = None
+        self._rpc_count_at_start = get_request_rpc_count()
+        self.rpc_count = 0
+
+    def close(self):
+        self.end_time = time.time()
+        self.rpc_count = get_request_rpc_count() - self._rpc_count_at_start
+
+    @property
+    def duration_msec(self):
+        end_time = self.end_time if self.end_time else time.time()
+        return (end_time - self.start_time) * 1000
+
+
+class RequestTrace(object):
+    """Nested spans of work done while serving one request.
+
+    The root span covers the whole request. To keep the cost of tracing low
+    for requests doing a lot of small things, at most MAX_SPANS spans are
+    recorded; time spent in the rest is still included in the enclosing
+    spans, and the number of spans dropped is reported.
+    """
+
+    MAX_SPANS = 2000
+
+    def __init__(self, name):
+        self.root = TraceSpan(name)
+        self._open_spans = [self.root]
+        self.span_count = 1
+        self.dropped_span_count = 0
+
+    @property
+    def name(self):
+        return self.root.name
+
+    @property
+    def duration_msec(self):
+        return self.root.duration_msec
+
+    def begin_span(self, name):
+        if self.span_count >= self.MAX_SPANS:
+            self.dropped_span_count += 1
+            self._open_spans.append(None)
+            return
+        span = TraceSpan(name)
+        self._open_spans[-1].children.append(span)
+        self._open_spans.append(span)
+        self.span_count += 1
+
+    def end_span(self):
+        if len(self._open_spans) > 1:
+            span = self._open_spans.pop()
+            if span is not None:
+                span.close()
+
+    def close(self):
+        while len(self._open_spans) > 1:
+            self.end_span()
+        self.root.close()
+
+    def to_text(self):
+        """Formats spans as an indented outline.
+
+        Sibling spans with the same name, like many memcache reads in a row,
+        are shown as one line with their count and total time and RPCs.
+
+        Returns:
+          A string with one line per group of spans.
+        """
+        lines = []
+        _format_spans([self.root], 0, lines)
+        if self.dropped_span_count:
+            lines.append('(%s more spans not recorded)' % (
+                self.dropped_span_count))
+        return '\n'.join(lines)
+
+
+def _format_spans(spans, depth, lines):
+    groups = collections.OrderedDict()
+    for span in spans:
+        groups.setdefault(span.name, []).append(span)
+    for name, group in groups.iteritems():
+        if len(group) > 1:
+            name = '%s x %s' % (name, len(group))
+        lines.append('%s%s: %.1f ms, %s RPCs' % (
+            '  ' * depth, name,
+            sum(span.duration_msec for span in group),
+            sum(span.rpc_count for span in group)))
+        _format_spans(
+            [child for span in group for child in span.children],
+            depth + 1, lines)
+
+
+class _SpanContext(object):
+    """Begins and ends a span of the current trace in a 'with' statement."""
+
+    def __init__(self, trace, name):
+        self._trace = trace
+        self._name = name
+
+    def __enter__(self):
+        self._trace.begin_span(self._name)
+
+    def __exit__(self, *unused_exc_info):
+        self._trace.end_span()
+
+
+class _NoSpanContext(object):
+    """Does nothing; used when the current request is not traced."""
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *unused_exc_info):
+        pass
+
+
+_NO_SPAN_CONTEXT = _NoSpanContext()
+
+
+class Tracer(object):
+    """Records spans of work done by the current request, if it is traced.
+
+    Requests are not traced unless begin_request() is called for them. Code
+    that wants its work to show up in traces uses span() or traced(); when
+    the current request is not traced these cost one attribute lookup.
+    Recently finished traces worth looking at are kept in this process.
+    """
+
+    MAX_RECENT_TRACES = 50
+
+    _current = None
+    _recent = collections.deque(maxlen=MAX_RECENT_TRACES)
+
+    @classmethod
+    def begin_request(cls, name):
+        cls._current = RequestTrace(name)
+
+    @classmethod
+    def end_request(cls):
+        """Stops tracing; returns the trace of the request or None."""
+        trace = cls._current
+        cls._current = None
+        if trace:
+            trace.close()
+        return trace
+
+    @classmethod
+    def is_tracing(cls):
+        return cls._current is not None
+
+    @classmethod
+    def span(cls, name):
+        """Returns a context manager recording a span of the current trace."""
+        if cls._current is None:
+            return _NO_SPAN_CONTEXT
+        return _SpanContext(cls._current, name)
+
+    @classmethod
+    def keep(cls, trace):
+        cls._recent.appendleft(trace)
+
+    @classmethod
+    def get_recent(cls):
+        """Returns recently kept traces, most recent first."""
+        return list(cls._recent)
+
+    @classmethod
+    def clear_recent(cls):
+        cls._recent.clear()
+
+
+def traced(name):
+    """Decorates a function so its calls are spans of the current trace."""
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # pylint: disable=protected-access
+            trace = Tracer._current
+            if trace is None:
+                return func(*args, **kwargs)
+            trace.begin_span(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                trace.end_span()
+
+        return wrapper
+
+    return decorator
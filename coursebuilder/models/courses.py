@@ -20,12 +20,16 @@ import collections
 import copy
 from datetime import datetime
 import logging
+import marshal
 import os
 import pickle
 import re
 import sys
 import threading
+import uuid
+import zlib
 import config
+from counters import PerfCounter
 import custom_units
 
 import messages
@@ -37,6 +41,7 @@ import vfs
 import yaml
 
 import appengine_config
+from common import caching
 from common import locales
 from common import safe_dom
 from common import schema_fields
@@ -56,6 +61,17 @@ COURSE_MODEL_VERSION_1_3 = '1.3'
 
 DEFAULT_FETCH_LIMIT = 100
 
+# max size for in-process cache of deserialized course objects
+MAX_GLOBAL_COURSE_CACHE_SIZE_BYTES = 32 * 1024 * 1024
+
+COURSE_PROCESS_CACHE_HIT = PerfCounter(
+    'gcb-models-course-process-cache-hit',
+    'A number of times a course was found in the in-process cache.')
+COURSE_PROCESS_CACHE_MISS = PerfCounter(
+    'gcb-models-course-process-cache-miss',
+    'A number of times a course was not found in the in-process cache or '
+    'was found, but was out of date.')
+
 # all entities of these types are copies from source to target during course
 # import
 COURSE_CONTENT_ENTITIES = frozenset([
@@ -311,9 +327,49 @@ def has_only_new_style_activities(course):
     return not has_at_least_one_old_style_activity(course)
 
 
+class ProcessScopedCourseCache(caching.ProcessScopedSingleton):
+    """This class holds in-process cache of deserialized course mementos."""
+
+    @classmethod
+    def get_cache_len(cls):
+        return len(ProcessScopedCourseCache.instance().cache.items.keys())
+
+    @classmethod
+    def get_cache_size(cls):
+        return ProcessScopedCourseCache.instance().cache.total_size
+
+    def __init__(self):
+        self.cache = caching.LRUCache(
+            max_size_bytes=MAX_GLOBAL_COURSE_CACHE_SIZE_BYTES,
+            max_item_size_bytes=MAX_GLOBAL_COURSE_CACHE_SIZE_BYTES // 4)
+        self.cache.get_entry_size = self._get_entry_size
+
+    def _get_entry_size(self, key, value):
+        # Sizing the object graph is expensive; serialized size is a good
+        # approximation and is known at the time the entry is created.
+        unused_stamp, unused_memento, size = value
+        return sys.getsizeof(key) + size
+
+
+COURSE_PROCESS_CACHE_LEN = PerfCounter(
+    'gcb-models-course-process-cache-len',
+    'A total number of items in the in-process course cache.')
+COURSE_PROCESS_CACHE_SIZE_BYTES = PerfCounter(
+    'gcb-models-course-process-cache-bytes',
+    'A total size of items in the in-process course cache in bytes.')
+
+COURSE_PROCESS_CACHE_LEN.poll_value = ProcessScopedCourseCache.get_cache_len
+COURSE_PROCESS_CACHE_SIZE_BYTES.poll_value = (
+    ProcessScopedCourseCache.get_cache_size)
+
+
 class AbstractCachedObject(object):
     """Abstract serializable versioned object that can stored in memcache."""
 
+    # Whether to keep deserialized mementos in the in-process cache in front
+    # of memcache. Derived types enabling this must implement clone_memento().
+    CAN_USE_PROCESS_CACHE = False
+
     @classmethod
     def _max_size(cls):
         # By default, max out at one cache record.
@@ -338,6 +394,51 @@ class AbstractCachedObject(object):
                 cls.VERSION, os.environ.get('CURRENT_VERSION_ID'), shard)
             for shard in xrange(num_shards)]
 
+    @classmethod
+    def _make_version_stamp_key(cls):
+        # A small memcache record changed each time the object is saved or
+        # deleted; in-process copies are valid only while it stays the same.
+        return 'course:model:stamp:%s:%s' % (
+            cls.VERSION, os.environ.get('CURRENT_VERSION_ID'))
+
+    @classmethod
+    def _make_process_cache_key(cls, app_context):
+        return '%s:%s' % (cls.__name__, app_context.get_namespace_name())
+
+    @classmethod
+    def _process_cache_get(cls, app_context):
+        """Gets the current version stamp and a copy of a matching memento."""
+        stamp = MemcacheManager.get(
+            cls._make_version_stamp_key(),
+            namespace=app_context.get_namespace_name())
+        if not stamp:
+            # Without the stamp no in-process copy can be trusted. A fresh
+            # stamp matches none of them and lets them be refilled; if another
+            # process adds one first, skip the process cache this time.
+            stamp = uuid.uuid4().hex
+            if not MemcacheManager.add(
+                cls._make_version_stamp_key(), stamp,
+                namespace=app_context.get_namespace_name()):
+                return None, None
+        found, entry = ProcessScopedCourseCache.instance().cache.get(
+            cls._make_process_cache_key(app_context))
+        if found and entry and entry[0] == stamp:
+            COURSE_PROCESS_CACHE_HIT.inc()
+            return stamp, cls.clone_memento(entry[1])
+        COURSE_PROCESS_CACHE_MISS.inc()
+        return stamp, None
+
+    @classmethod
+    def _process_cache_put(cls, app_context, stamp, memento, size):
+        ProcessScopedCourseCache.instance().cache.put(
+            cls._make_process_cache_key(app_context),
+            (stamp, cls.clone_memento(memento), size))
+
+    @classmethod
+    def _process_cache_delete(cls, app_context):
+        ProcessScopedCourseCache.instance().cache.delete(
+            cls._make_process_cache_key(app_context))
+
     @classmethod
     def new_memento(cls):
         """Creates new empty memento instance; must be pickle serializable."""
@@ -353,12 +454,23 @@ class AbstractCachedObject(object):
         """Creates serializable memento from instance."""
         raise Exception('Not implemented')
 
+    @classmethod
+    def clone_memento(cls, unused_memento):
+        """Creates a copy of memento that shares no mutable course objects."""
+        raise Exception('Not implemented')
+
     @classmethod
     def load(cls, app_context):
         """Loads instance from memcache; does not fail on errors."""
         shard_keys = cls._make_keys()
         shard_contents = {}
         try:
+            stamp = None
+            if cls.CAN_USE_PROCESS_CACHE:
+                stamp, memento = cls._process_cache_get(app_context)
+                if memento:
+                    return cls.instance_from_memento(app_context, memento)
+
             shard_0 = MemcacheManager.get(
                 shard_keys[0], namespace=app_context.get_namespace_name())
             if not shard_0:
@@ -375,8 +487,11 @@ class AbstractCachedObject(object):
             data = []
             for shard_key in sorted(shard_contents.keys()):
                 data.append(shard_contents[shard_key])
+            data = ''.join(data)
             memento = cls.new_memento()
-            memento.deserialize(''.join(data))
+            memento.deserialize(data)
+            if stamp:
+                cls._process_cache_put(app_context, stamp, memento, len(data))
             return cls.instance_from_memento(app_context, memento)
 
         except Exception as e:  # pylint: disable=broad-except
@@ -411,9 +526,21 @@ class AbstractCachedObject(object):
         MemcacheManager.set_multi(
             mapping, namespace=app_context.get_namespace_name())
 
+        # The stamp goes in last, so any process that sees it also sees all
+        # the shards it describes.
+        if cls.CAN_USE_PROCESS_CACHE:
+            MemcacheManager.set(
+                cls._make_version_stamp_key(), uuid.uuid4().hex,
+                namespace=app_context.get_namespace_name())
+
     @classmethod
     def delete(cls, app_context):
         """Deletes instance from memcache."""
+        if cls.CAN_USE_PROCESS_CACHE:
+            cls._process_cache_delete(app_context)
+            MemcacheManager.delete(
+                cls._make_version_stamp_key(),
+                namespace=app_context.get_namespace_name())
         MemcacheManager.delete_multi(
             cls._make_keys(),
             namespace=app_context.get_namespace_name())
@@ -620,6 +747,7 @@ class CourseModel12(object):
         self._units = []
         self._lessons = []
         self._unit_id_to_lessons = {}
+        self._derived_cache = {}
 
         if units:
             self._units = units
@@ -648,6 +776,10 @@ class CourseModel12(object):
     def unit_id_to_lessons(self):
         return self._unit_id_to_lessons
 
+    @property
+    def derived_cache(self):
+        return self._derived_cache
+
     def get_units(self):
         return self._units[:]
 
@@ -657,6 +789,12 @@ class CourseModel12(object):
     def get_lessons(self, unit_id):
         return self._unit_id_to_lessons.get(str(unit_id), [])
 
+    def get_lessons_by_unit_id(self):
+        """Returns a dict of str(unit_id) to a list of lessons in the unit."""
+        return dict(
+            (key, lessons[:])
+            for key, lessons in self._unit_id_to_lessons.iteritems())
+
     def find_unit_by_id(self, unit_id):
         """Finds a unit given its id."""
         for unit in self._units:
@@ -998,10 +1136,72 @@ class PersistentCourse13(object):
         self._from_dict(adict)
 
 
+def _clone_course_object(instance):
+    """Copies Unit13 or Lesson13; much faster than copy.deepcopy() of all."""
+    clone = copy.copy(instance)
+    for name, value in clone.__dict__.items():
+        if isinstance(value, (dict, list)):
+            clone.__dict__[name] = copy.deepcopy(value)
+    return clone
+
+
+def _objects_to_table(instances):
+    """Encodes objects as a table of attribute values sharing column names.
+
+    Objects of the same class usually have identical attributes, so the names
+    are stored once per distinct attribute set ("shape") rather than once per
+    object, as pickle does.
+
+    Args:
+        instances: a list of objects with plain values in their __dict__.
+    Returns:
+        A tuple (shapes, rows); each row starts with the index of its shape
+        followed by the attribute values in the order of that shape.
+    """
+    shapes = []
+    shape_to_index = {}
+    rows = []
+    for instance in instances:
+        adict = instance.__dict__
+        shape = tuple(sorted(adict.keys()))
+        index = shape_to_index.get(shape)
+        if index is None:
+            index = len(shapes)
+            shapes.append(shape)
+            shape_to_index[shape] = index
+        row = [index]
+        row.extend([adict[name] for name in shape])
+        rows.append(row)
+    return shapes, rows
+
+
+def _table_to_objects(clazz, shapes, rows):
+    """Decodes a table made by _objects_to_table() into instances of clazz."""
+    instances = []
+    for row in rows:
+        instance = clazz.__new__(clazz)
+        instance.__dict__ = dict(zip(shapes[row[0]], row[1:]))
+        instances.append(instance)
+    return instances
+
+
 class CachedCourse13(AbstractCachedObject):
     """A representation of a Course13 optimized for storing in memcache."""
 
     VERSION = COURSE_MODEL_VERSION_1_3
+    CAN_USE_PROCESS_CACHE = True
+
+    # The compact format is a magic prefix, a format version byte, a flags
+    # byte and a marshal-encoded tabular body. Courses holding values marshal
+    # can't encode fall back to the pickle representation of the base class.
+    COMPACT_FORMAT_MAGIC = 'GCB:CC13'
+    COMPACT_FORMAT_VERSION = 1
+    COMPACT_FLAG_ZLIB = 0x01
+
+    # Whether to zlib-compress the compact body; it lets much larger courses
+    # fit under _max_size() at a small cost in CPU.
+    CAN_COMPRESS = True
+    COMPRESSION_LEVEL = 1
 
     def __init__(
         self, next_id=None, units=None, lessons=None,
@@ -1018,6 +1218,12 @@ class CachedCourse13(AbstractCachedObject):
         # nice to have them in memcache.
         self.unit_id_to_lesson_ids = unit_id_to_lesson_ids
 
+        # Structures computed from this version of the course, like the
+        # progress tracker's CourseStructureIndex. They are never serialized;
+        # clones of a memento share them, so they are computed once per
+        # course version per process.
+        self.derived_cache = {}
+
     @classmethod
     def _max_size(cls):
         # Cap at approximately 4M to avoid 1M single-cache-element limit,
@@ -1033,7 +1239,8 @@ class CachedCourse13(AbstractCachedObject):
         return CourseModel13(
             app_context, next_id=memento.next_id,
             units=memento.units, lessons=memento.lessons,
-            unit_id_to_lesson_ids=memento.unit_id_to_lesson_ids)
+            unit_id_to_lesson_ids=memento.unit_id_to_lesson_ids,
+            derived_cache=memento.derived_cache)
 
     @classmethod
     def memento_from_instance(cls, course):
@@ -1042,6 +1249,77 @@ class CachedCourse13(AbstractCachedObject):
             units=course.units, lessons=course.lessons,
             unit_id_to_lesson_ids=course.unit_id_to_lesson_ids)
 
+    def serialize(self):
+        """Saves instance to a compact tabular representation."""
+        unit_shapes, unit_rows = _objects_to_table(self.units or [])
+        lesson_shapes, lesson_rows = _objects_to_table(self.lessons or [])
+        body = {
+            'version': self.version,
+            'next_id': self.next_id,
+            'unit_shapes': unit_shapes,
+            'units': unit_rows,
+            'lesson_shapes': lesson_shapes,
+            'lessons': lesson_rows,
+            'unit_id_to_lesson_ids': self.unit_id_to_lesson_ids}
+        try:
+            data = marshal.dumps(body)
+        except ValueError:
+            # Some value isn't a plain Python type; use the generic format.
+            return super(CachedCourse13, self).serialize()
+
+        flags = 0
+        if self.CAN_COMPRESS:
+            data = zlib.compress(data, self.COMPRESSION_LEVEL)
+            flags |= self.COMPACT_FLAG_ZLIB
+        return '%s%s%s%s' % (
+            self.COMPACT_FORMAT_MAGIC, chr(self.COMPACT_FORMAT_VERSION),
+            chr(flags), data)
+
+    def deserialize(self, binary_data):
+        """Loads instance from a compact or a pickle representation."""
+        if not binary_data.startswith(self.COMPACT_FORMAT_MAGIC):
+            super(CachedCourse13, self).deserialize(binary_data)
+            return
+
+        offset = len(self.COMPACT_FORMAT_MAGIC)
+        format_version = ord(binary_data[offset])
+        if format_version != self.COMPACT_FORMAT_VERSION:
+            raise Exception('Expected format version %s, found %s.' % (
+                self.COMPACT_FORMAT_VERSION, format_version))
+        flags = ord(binary_data[offset + 1])
+        data = binary_data[offset + 2:]
+        if flags & self.COMPACT_FLAG_ZLIB:
+            data = zlib.decompress(data)
+        body = marshal.loads(data)
+
+        if self.version != body.get('version'):
+            raise Exception('Expected version %s, found %s.' % (
+                self.version, body.get('version')))
+        self.next_id = body['next_id']
+        self.units = _table_to_objects(
+            Unit13, body['unit_shapes'], body['units'])
+        self.lessons = _table_to_objects(
+            Lesson13, body['lesson_shapes'], body['lessons'])
+        self.unit_id_to_lesson_ids = body['unit_id_to_lesson_ids']
+        self.derived_cache = {}
+
+    @classmethod
+    def clone_memento(cls, memento):
+        unit_id_to_lesson_ids = None
+        if memento.unit_id_to_lesson_ids is not None:
+            unit_id_to_lesson_ids = dict(
+                (key, list(value)) for key, value in
+                memento.unit_id_to_lesson_ids.iteritems())
+        clone = CachedCourse13(
+            next_id=memento.next_id,
+            units=[_clone_course_object(unit)
+                   for unit in memento.units or []],
+            lessons=[_clone_course_object(lesson)
+                     for lesson in memento.lessons or []],
+            unit_id_to_lesson_ids=unit_id_to_lesson_ids)
+        clone.derived_cache = memento.derived_cache
+        return clone
+
 
 class CourseModel13(object):
     """A course defined in terms of objects (version 1.3)."""
@@ -1071,7 +1349,7 @@ class CourseModel13(object):
 
     def __init__(
         self, app_context, next_id=None, units=None, lessons=None,
-        unit_id_to_lesson_ids=None):
+        unit_id_to_lesson_ids=None, derived_cache=None):
 
         # Init default values.
         self._app_context = app_context
@@ -1079,6 +1357,7 @@ class CourseModel13(object):
         self._units = []
         self._lessons = []
         self._unit_id_to_lesson_ids = {}
+        self._derived_cache = {}
 
         # These array keep dirty object in current transaction.
         self._dirty_units = []
@@ -1097,11 +1376,27 @@ class CourseModel13(object):
             self._unit_id_to_lesson_ids = unit_id_to_lesson_ids
         else:
             self._index()
+        if derived_cache is not None:
+            self._derived_cache = derived_cache
 
     @property
     def app_context(self):
         return self._app_context
 
+    @property
+    def derived_cache(self):
+        """A dict for structures computed from this version of the course.
+
+        The dict may be shared with other instances loaded from the same
+        cached version of the course. While there are unsaved changes, a
+        throwaway dict is returned so nothing is computed from them and
+        shared.
+        """
+        if (self._dirty_units or self._dirty_lessons or
+            self._deleted_units or self._deleted_lessons):
+            return {}
+        return self._derived_cache
+
     @property
     def next_id(self):
         return self._next_id
@@ -1262,6 +1557,7 @@ class CourseModel13(object):
         self._dirty_lessons = []
         self._deleted_units = []
         self._deleted_lessons = []
+        self._derived_cache = {}
 
         self._index()
         PersistentCourse13.save(self._app_context, self)
@@ -1277,10 +1573,23 @@ class CourseModel13(object):
         lesson_ids = self._unit_id_to_lesson_ids.get(str(unit_id))
         lessons = []
         if lesson_ids:
+            # One pass over all lessons, rather than one per lesson in unit.
+            id_to_lesson = dict(
+                (str(lesson.lesson_id), lesson) for lesson in self._lessons)
             for lesson_id in lesson_ids:
-                lessons.append(self.find_lesson_by_id(None, lesson_id))
+                lessons.append(id_to_lesson.get(str(lesson_id)))
         return lessons
 
+    def get_lessons_by_unit_id(self):
+        """Returns a dict of str(unit_id) to a list of lessons in the unit."""
+        id_to_lesson = dict(
+            (str(lesson.lesson_id), lesson) for lesson in self._lessons)
+        result = {}
+        for key, lesson_ids in self._unit_id_to_lesson_ids.iteritems():
+            result[key] = [
+                id_to_lesson.get(str(lesson_id)) for lesson_id in lesson_ids]
+        return result
+
     def get_assessment_filename(self, unit_id):
         """Returns assessment base filename."""
         unit = self.find_unit_by_id(unit_id)
@@ -2732,6 +3041,10 @@ class Course(object):
     def get_lessons(self, unit_id):
         return self._model.get_lessons(unit_id)
 
+    def get_lessons_by_unit_id(self):
+        """Returns lessons of all units in one pass, keyed by str(unit_id)."""
+        return self._model.get_lessons_by_unit_id()
+
     def get_lessons_for_all_units(self):
         lessons = []
         for unit in self.get_units():
@@ -2957,6 +3270,10 @@ class Course(object):
     def get_parent_unit(self, unit_id):
         return self._model.get_parent_unit(unit_id)
 
+    def get_derived_cache(self):
+        """Returns a dict for structures computed from the course content."""
+        return self._model.derived_cache
+
     def get_components(self, unit_id, lesson_id):
         """Returns a list of dicts representing the components in a lesson.
 
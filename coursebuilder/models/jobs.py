@@ -19,14 +19,19 @@ __author__ = 'Pavel Simakov (psimakov@google.com)'
 import ast
 import datetime
 import logging
+import marshal
 import time
 import traceback
+import types
 import urllib
+import zlib
 
 import entities
 from mapreduce import base_handler
+from mapreduce import context
 from mapreduce import input_readers
 from mapreduce import mapreduce_pipeline
+from mapreduce import util
 from mapreduce.lib.pipeline import pipeline
 import transforms
 from common.utils import Namespace
@@ -169,6 +174,41 @@ class DurableJob(DurableJobBase):
         return sequence_num
 
 
+class MarshalValueCodec(object):
+    """Compact binary encoding of values passed from mappers to reducers.
+
+    Values are encoded as a flags byte and a marshal-encoded body, which is
+    zlib-compressed if that makes it smaller.  Only plain Python types can
+    be encoded: None, bool, int, long, float, str, unicode, and tuples,
+    lists, dicts and sets of these.  Note that marshal keeps tuples and
+    str apart from lists and unicode, unlike JSON.
+    """
+
+    FLAG_ZLIB = 0x01
+
+    # Bodies smaller than this are not worth compressing.
+    COMPRESS_MIN_BYTES = 128
+    COMPRESSION_LEVEL = 1
+
+    @classmethod
+    def encode(cls, value):
+        data = marshal.dumps(value)
+        flags = 0
+        if len(data) >= cls.COMPRESS_MIN_BYTES:
+            compressed = zlib.compress(data, cls.COMPRESSION_LEVEL)
+            if len(compressed) < len(data):
+                data = compressed
+                flags |= cls.FLAG_ZLIB
+        return chr(flags) + data
+
+    @classmethod
+    def decode(cls, binary_data):
+        data = binary_data[1:]
+        if ord(binary_data[0]) & cls.FLAG_ZLIB:
+            data = zlib.decompress(data)
+        return marshal.loads(data)
+
+
 class MapReduceJobPipeline(base_handler.PipelineBase):
 
     def run(self, job_name, sequence_num, kwargs, namespace):
@@ -244,6 +284,17 @@ class MapReduceJob(DurableJobBase):
     _OUTPUT_KEY_RESULTS = 'results'
     _OUTPUT_KEY_ERROR = 'error'
 
+    # Optional codec for the values passed from map() to combine() and
+    # reduce(), e.g. MarshalValueCodec.  Without one, the map/reduce
+    # framework passes str() of each value yielded by map() and combine().
+    # With one, map() and combine() may yield any value the codec can
+    # encode, and combine() and reduce() are given the decoded values.
+    INTERMEDIATE_VALUE_CODEC = None
+
+    # Mapper parameter naming the job class, for the functions in this
+    # module that apply INTERMEDIATE_VALUE_CODEC around map() and reduce().
+    _JOB_CLASS_PARAM = '_mapreduce_job_class'
+
     @staticmethod
     def build_output(root_pipeline_id, results_list, error=None):
         return transforms.dumps({
@@ -366,6 +417,47 @@ class MapReduceJob(DurableJobBase):
                                   'optionally implement combine() as a static '
                                   'method.')
 
+    @classmethod
+    def has_combiner(cls):
+        return getattr(cls, 'combine') != getattr(MapReduceJob, 'combine')
+
+    @classmethod
+    def map_encoded(cls, item):
+        """Calls map(), encoding the values it yields with the codec."""
+        results = cls.map(item)
+        if not isinstance(results, types.GeneratorType):
+            return
+        codec = cls.INTERMEDIATE_VALUE_CODEC
+        for result in results:
+            if codec and isinstance(result, tuple):
+                key, value = result
+                result = (key, codec.encode(value))
+            yield result
+
+    @classmethod
+    def combine_encoded(cls, key, values, previously_combined_outputs=None):
+        """Calls combine() on decoded values and encodes what it yields."""
+        codec = cls.INTERMEDIATE_VALUE_CODEC
+        if not codec:
+            for value in cls.combine(key, values, previously_combined_outputs):
+                yield value
+            return
+        if previously_combined_outputs is not None:
+            previously_combined_outputs = [
+                codec.decode(value) for value in previously_combined_outputs]
+        for value in cls.combine(
+            key, [codec.decode(value) for value in values],
+            previously_combined_outputs):
+            yield codec.encode(value)
+
+    @classmethod
+    def reduce_encoded(cls, key, values):
+        """Calls reduce() on decoded values."""
+        codec = cls.INTERMEDIATE_VALUE_CODEC
+        if codec:
+            values = [codec.decode(value) for value in values]
+        return cls.reduce(key, values)
+
     def build_additional_mapper_params(self, unused_app_context):
         """Build a dict of additional parameters to make available to mappers.
 
@@ -432,12 +524,21 @@ class MapReduceJob(DurableJobBase):
             'namespace': self._namespace,
             })
 
+        # The framework calls map(), combine() and reduce() directly, unless
+        # values need encoding; then it calls the functions below that look
+        # up this class from the mapper parameters.
+        job_class_name = '%s.%s' % (
+            self.__class__.__module__, self.__class__.__name__)
+        if self.INTERMEDIATE_VALUE_CODEC:
+            self.mapper_params[MapReduceJob._JOB_CLASS_PARAM] = job_class_name
+            spec_prefix = '%s._' % __name__
+        else:
+            spec_prefix = '%s.' % job_class_name
+
         kwargs = {
             'job_name': self._job_name,
-            'mapper_spec': '%s.%s.map' % (
-                self.__class__.__module__, self.__class__.__name__),
-            'reducer_spec': '%s.%s.reduce' % (
-                self.__class__.__module__, self.__class__.__name__),
+            'mapper_spec': spec_prefix + 'map',
+            'reducer_spec': spec_prefix + 'reduce',
             'input_reader_spec':
                 'mapreduce.input_readers.DatastoreInputReader',
             'output_writer_spec':
@@ -445,10 +546,8 @@ class MapReduceJob(DurableJobBase):
             'mapper_params': self.mapper_params,
             'reducer_params': self.mapper_params,
         }
-        if (getattr(self.__class__, 'combine') !=
-            getattr(MapReduceJob, 'combine')):
-            kwargs['combiner_spec'] = '%s.%s.combine' % (
-                self.__class__.__module__, self.__class__.__name__)
+        if self.has_combiner():
+            kwargs['combiner_spec'] = spec_prefix + 'combine'
         mr_pipeline = MapReduceJobPipeline(self._job_name, sequence_num,
                                            kwargs, self._namespace)
         mr_pipeline.start(base_path='/mapreduce/worker/pipeline')
@@ -485,6 +584,27 @@ class MapReduceJob(DurableJobBase):
         return job
 
 
+def _get_job_class():
+    params = context.get().mapreduce_spec.mapper.params
+    return util.for_name(params[MapReduceJob._JOB_CLASS_PARAM])
+
+
+def _map(item):
+    for result in _get_job_class().map_encoded(item):
+        yield result
+
+
+def _combine(key, values, previously_combined_outputs=None):
+    for value in _get_job_class().combine_encoded(
+        key, values, previously_combined_outputs):
+        yield value
+
+
+def _reduce(key, values):
+    for result in _get_job_class().reduce_encoded(key, values) or []:
+        yield result
+
+
 class AbstractCountingMapReduceJob(MapReduceJob):
     """Provide common functionality for map/reduce jobs that just count.
 
@@ -27,6 +27,7 @@ from config import ConfigProperty
 import counters
 from counters import PerfCounter
 from entities import BaseEntity
+from entities import put as entities_put
 import jinja2
 import services
 import transforms
@@ -39,6 +40,7 @@ from google.appengine.api import memcache
 from google.appengine.api import namespace_manager
 from google.appengine.api import users
 from google.appengine.ext import db
+from google.appengine.ext import deferred
 
 # We want to use memcache for both objects that exist and do not exist in the
 # datastore. If object exists we cache its instance, if object does not exist
@@ -89,10 +91,66 @@ CACHE_MISS_LOCAL = PerfCounter(
     'gcb-models-cache-miss-local',
     'A number of times an object was not found in local memcache.')
 
+# performance counters for copy-free reads of immutable values
+CACHE_COPY_AVOIDED = PerfCounter(
+    'gcb-models-cache-copy-avoided',
+    'A number of times a cached object was returned without a deep copy.')
+CACHE_COPY_AVOIDED_BYTES = PerfCounter(
+    'gcb-models-cache-copy-avoided-bytes',
+    'An estimate of the number of bytes of deep copy avoided by returning '
+    'shared immutable objects from cache.')
+
+# performance counters for entities prefetched for a request
+PREFETCH_ENTITIES = PerfCounter(
+    'gcb-models-prefetch-entities',
+    'A number of objects looked up in a batch before a request used them.')
+PREFETCH_ENTITIES_FROM_DATASTORE = PerfCounter(
+    'gcb-models-prefetch-entities-from-datastore',
+    'A number of prefetched objects that were not in memcache and were read '
+    'from datastore.')
+PREFETCH_HIT = PerfCounter(
+    'gcb-models-prefetch-hit',
+    'A number of times an object was served from objects prefetched for a '
+    'request.')
+
 # Intent for sending welcome notifications.
 WELCOME_NOTIFICATION_INTENT = 'welcome'
 
 
+class _FrozenDict(dict):
+    """A dict that can't be modified; see MemcacheManager._freeze()."""
+
+    def _immutable(self, *unused_args, **unused_kwargs):
+        raise TypeError('%s is immutable.' % self.__class__.__name__)
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, unused_memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+
+class _FrozenTuple(tuple):
+    """A tuple known to hold only frozen values; see _FrozenDict."""
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, unused_memo):
+        return self
+
+
+# Types of values that can be shared between readers without a copy.
+_FROZEN_TYPES = (
+    _FrozenDict, _FrozenTuple, frozenset, basestring, bool, int, long, float)
+
+
 class MemcacheManager(object):
     """Class that consolidates all memcache operations."""
 
@@ -101,6 +159,85 @@ class MemcacheManager(object):
     _READONLY_REENTRY_COUNT = 0
     _READONLY_APP_CONTEXT = None
 
+    # Keys starting with any of these prefixes hold values that callers
+    # promise never to modify. Such values are shared between readers instead
+    # of being deep copied on every get(); see register_immutable_key_prefix().
+    _IMMUTABLE_KEY_PREFIXES = ()
+
+    # Estimated bytes of deep copy avoided in the current readonly window.
+    _COPY_AVOIDED_BYTES = 0
+
+    @classmethod
+    def register_immutable_key_prefix(cls, prefix):
+        """Opts keys with a given prefix into copy-free reads.
+
+        Values cached under such keys are frozen when put in the
+        request-local cache and then returned to all readers as the very same
+        object: dicts can't be modified, lists become tuples and sets become
+        frozensets. Values holding objects of other types are deep copied on
+        every read, as for any other key.
+
+        Args:
+            prefix: string; a prefix of memcache keys holding immutable values.
+        """
+        if prefix not in cls._IMMUTABLE_KEY_PREFIXES:
+            cls._IMMUTABLE_KEY_PREFIXES += (prefix,)
+
+    @classmethod
+    def unregister_immutable_key_prefix(cls, prefix):
+        cls._IMMUTABLE_KEY_PREFIXES = tuple(
+            item for item in cls._IMMUTABLE_KEY_PREFIXES if item != prefix)
+
+    @classmethod
+    def _is_immutable_key(cls, key):
+        return bool(cls._IMMUTABLE_KEY_PREFIXES) and isinstance(
+            key, basestring) and key.startswith(cls._IMMUTABLE_KEY_PREFIXES)
+
+    @classmethod
+    def _freeze(cls, value):
+        """Returns an immutable equal of value, or None if there is none."""
+        if value is None or isinstance(value, _FROZEN_TYPES):
+            return value
+        if type(value) is dict:
+            items = []
+            for key, item in value.iteritems():
+                frozen = cls._freeze(item)
+                if frozen is None and item is not None:
+                    return None
+                items.append((key, frozen))
+            return _FrozenDict(items)
+        if type(value) in (list, tuple):
+            items = []
+            for item in value:
+                frozen = cls._freeze(item)
+                if frozen is None and item is not None:
+                    return None
+                items.append(frozen)
+            return _FrozenTuple(items)
+        if type(value) is set:
+            return frozenset(value)
+        return None
+
+    @classmethod
+    def _freeze_if_immutable_key(cls, key, value):
+        """Returns the value to keep in the local cache for a given key."""
+        if value is None or not cls._is_immutable_key(key):
+            return value
+        frozen = cls._freeze(value)
+        return value if frozen is None else frozen
+
+    @classmethod
+    def _copy_for_reader(cls, key, value):
+        """Returns a value safe to give to a reader of a given key."""
+        if (value is None or not isinstance(value, _FROZEN_TYPES) or
+            not cls._is_immutable_key(key)):
+            return copy.deepcopy(value)
+        size = sys.getsizeof(value)
+        CACHE_COPY_AVOIDED.inc()
+        CACHE_COPY_AVOIDED_BYTES.inc(increment=size)
+        cls._COPY_AVOIDED_BYTES += size
+        return value
+
     @classmethod
     def _is_same_app_context_if_set(cls):
         if cls._READONLY_APP_CONTEXT is None:
@@ -139,6 +276,7 @@ class MemcacheManager(object):
                 'MemcacheManager.begin_readonly')
             cls._IS_READONLY = True
             cls._LOCAL_CACHE = {}
+            cls._COPY_AVOIDED_BYTES = 0
             cls._fs_begin_readonly()
         cls._READONLY_REENTRY_COUNT += 1
 
@@ -154,7 +292,9 @@ class MemcacheManager(object):
             cls._IS_READONLY = False
             cls._LOCAL_CACHE = None
             cls._READONLY_APP_CONTEXT = None
-            appengine_config.log_appstats_event('MemcacheManager.end_readonly')
+            appengine_config.log_appstats_event(
+                'MemcacheManager.end_readonly',
+                {'copy_avoided_bytes': cls._COPY_AVOIDED_BYTES})
 
     @classmethod
     def clear_readonly_cache(cls):
@@ -197,15 +337,15 @@ class MemcacheManager(object):
     def _local_cache_get_multi(cls, keys, namespace):
         if cls._IS_READONLY:
             assert cls._is_same_app_context_if_set()
-            values = []
+            values = {}
             for key in keys:
                 is_cached, value = cls._local_cache_get(key, namespace)
                 if not is_cached:
-                    return False, []
-                else:
-                    values.append(value)
+                    return False, {}
+                elif value is not None:
+                    values[key] = value
             return True, values
-        return False, []
+        return False, {}
 
     @classmethod
     def _local_cache_put_multi(cls, values, namespace):
@@ -229,15 +369,20 @@ class MemcacheManager(object):
         return cls.get_namespace()
 
     @classmethod
+    @counters.traced('MemcacheManager.get')
     def get(cls, key, namespace=None):
         """Gets an item from memcache if memcache is enabled."""
+        _namespace = cls._get_namespace(namespace)
+        is_prefetched, value = EntityPrefetcher.get_prefetched(key, _namespace)
+        if is_prefetched:
+            return cls._copy_for_reader(key, value)
+
         if not CAN_USE_MEMCACHE.value:
             return None
-        _namespace = cls._get_namespace(namespace)
 
         is_cached, value = cls._local_cache_get(key, _namespace)
         if is_cached:
-            return copy.deepcopy(value)
+            return cls._copy_for_reader(key, value)
 
         value = memcache.get(key, namespace=_namespace)
 
@@ -249,10 +394,16 @@ class MemcacheManager(object):
         else:
             CACHE_MISS.inc(context=key)
 
+        # Memcache unpickles a fresh object on every call; a copy is needed
+        # only if the same object is also kept in the local cache.
+        if not cls._IS_READONLY:
+            return value
+        value = cls._freeze_if_immutable_key(key, value)
         cls._local_cache_put(key, _namespace, value)
-        return copy.deepcopy(value)
+        return cls._copy_for_reader(key, value)
 
     @classmethod
+    @counters.traced('MemcacheManager.get_multi')
     def get_multi(cls, keys, namespace=None):
         """Gets a set of items from memcache if memcache is enabled."""
         if not CAN_USE_MEMCACHE.value:
@@ -262,7 +413,9 @@ class MemcacheManager(object):
 
         is_cached, values = cls._local_cache_get_multi(keys, _namespace)
         if is_cached:
-            return values
+            return dict(
+                (key, cls._copy_for_reader(key, value))
+                for key, value in values.iteritems())
 
         values = memcache.get_multi(keys, namespace=_namespace)
         for key, value in values.items():
@@ -272,14 +425,23 @@ class MemcacheManager(object):
                 logging.info('Cache miss, key: %s. %s', key, Exception())
                 CACHE_MISS.inc(context=key)
 
+        if not cls._IS_READONLY:
+            return values
+        values = dict(
+            (key, cls._freeze_if_immutable_key(key, value))
+            for key, value in values.iteritems())
         cls._local_cache_put_multi(values, _namespace)
-        return values
+        return dict(
+            (key, cls._copy_for_reader(key, value))
+            for key, value in values.iteritems())
 
     @classmethod
+    @counters.traced('MemcacheManager.set')
     def set(cls, key, value, ttl=DEFAULT_CACHE_TTL_SECS, namespace=None):
         """Sets an item in memcache if memcache is enabled."""
         # Ensure subsequent mods to value do not affect the cached copy.
         value = copy.deepcopy(value)
+        EntityPrefetcher.forget([key], cls._get_namespace(namespace))
 
         try:
             if CAN_USE_MEMCACHE.value:
@@ -297,8 +459,38 @@ class MemcacheManager(object):
             return None
 
     @classmethod
+    @counters.traced('MemcacheManager.add')
+    def add(cls, key, value, ttl=DEFAULT_CACHE_TTL_SECS, namespace=None):
+        """Sets an item in memcache if memcache is enabled and lacks the key.
+
+        Returns:
+            True if the item was added; False if memcache is disabled, the key
+            is already in memcache or the add failed.
+        """
+        value = copy.deepcopy(value)
+        EntityPrefetcher.forget([key], cls._get_namespace(namespace))
+
+        try:
+            if CAN_USE_MEMCACHE.value:
+                size = sys.getsizeof(value)
+                if size > MEMCACHE_MAX:
+                    CACHE_PUT_TOO_BIG.inc()
+                else:
+                    CACHE_PUT.inc()
+                    _namespace = cls._get_namespace(namespace)
+                    if memcache.add(key, value, ttl, namespace=_namespace):
+                        cls._local_cache_put(key, _namespace, value)
+                        return True
+        except:  # pylint: disable=bare-except
+            logging.exception(
+                'Failed to add: %s, %s', key, cls._get_namespace(namespace))
+        return False
+
+    @classmethod
+    @counters.traced('MemcacheManager.set_multi')
     def set_multi(cls, mapping, ttl=DEFAULT_CACHE_TTL_SECS, namespace=None):
         """Sets a dict of items in memcache if memcache is enabled."""
+        EntityPrefetcher.forget(mapping.keys(), cls._get_namespace(namespace))
         try:
             if CAN_USE_MEMCACHE.value:
                 if not mapping:
@@ -320,23 +512,28 @@ class MemcacheManager(object):
             return None
 
     @classmethod
+    @counters.traced('MemcacheManager.delete')
     def delete(cls, key, namespace=None):
         """Deletes an item from memcache if memcache is enabled."""
         assert not cls._IS_READONLY
+        EntityPrefetcher.forget([key], cls._get_namespace(namespace))
         if CAN_USE_MEMCACHE.value:
             CACHE_DELETE.inc()
             memcache.delete(key, namespace=cls._get_namespace(namespace))
 
     @classmethod
+    @counters.traced('MemcacheManager.delete_multi')
     def delete_multi(cls, key_list, namespace=None):
         """Deletes a list of items from memcache if memcache is enabled."""
         assert not cls._IS_READONLY
+        EntityPrefetcher.forget(key_list, cls._get_namespace(namespace))
         if CAN_USE_MEMCACHE.value:
             CACHE_DELETE.inc(increment=len(key_list))
             memcache.delete_multi(
                 key_list, namespace=cls._get_namespace(namespace))
 
     @classmethod
+    @counters.traced('MemcacheManager.incr')
     def incr(cls, key, delta, namespace=None):
         """Incr an item in memcache if memcache is enabled."""
         if CAN_USE_MEMCACHE.value:
@@ -345,6 +542,109 @@ class MemcacheManager(object):
                 namespace=cls._get_namespace(namespace), initial_value=0)
 
 
+class EntityPrefetcher(caching.RequestScopedSingleton):
+    """Reads entities a request is going to need with a few batched RPCs.
+
+    Handlers and modules declare the memcache keys of the objects a page
+    will read, together with the datastore keys to load them from when they
+    are not in memcache. All declared keys are then resolved with one
+    memcache get_multi() per namespace and one datastore get for all misses.
+    Until the end of the request, MemcacheManager.get() serves these keys
+    from the prefetched values without any RPC; setting or deleting a key in
+    memcache drops its prefetched value.
+
+    Values are kept exactly as memcache would hold them, so DAOs see
+    NO_OBJECT for missing entities and use their usual code path.
+    """
+
+    def __init__(self):
+        # (namespace, memcache_key) -> db.Key or None; declared, not fetched.
+        self._pending = {}
+        # (namespace, memcache_key) -> value as memcache would hold it.
+        self._values = {}
+
+    @classmethod
+    def _get_current(cls):
+        """Returns the prefetcher of the current request without making one."""
+        # pylint: disable=protected-access
+        return cls._instances().get(cls)
+
+    def add(self, memcache_key, db_key=None, namespace=None):
+        """Declares a memcache key and, optionally, its datastore fallback.
+
+        Args:
+          memcache_key: string; the key the object is kept under in memcache.
+          db_key: db.Key of the entity to load when the object is not in
+              memcache; if None, a miss is left for the regular code path.
+          namespace: memcache namespace; the current namespace if None.
+        """
+        if namespace is None:
+            namespace = MemcacheManager.get_namespace()
+        key = (namespace, memcache_key)
+        if key not in self._values:
+            self._pending[key] = db_key
+
+    def fetch(self):
+        """Resolves declared keys with batched memcache and datastore gets."""
+        pending = self._pending
+        self._pending = {}
+        if not pending:
+            return
+        PREFETCH_ENTITIES.inc(increment=len(pending))
+
+        keys_by_namespace = collections.defaultdict(list)
+        for namespace, memcache_key in pending:
+            keys_by_namespace[namespace].append(memcache_key)
+
+        misses = []
+        for namespace, memcache_keys in keys_by_namespace.iteritems():
+            values = MemcacheManager.get_multi(
+                memcache_keys, namespace=namespace)
+            for memcache_key in memcache_keys:
+                key = (namespace, memcache_key)
+                if values.get(memcache_key) is not None:
+                    self._values[key] = values[memcache_key]
+                elif pending[key] is not None:
+                    misses.append(key)
+
+        if not misses:
+            return
+        PREFETCH_ENTITIES_FROM_DATASTORE.inc(increment=len(misses))
+        entities = db.get([pending[key] for key in misses])
+
+        updates_by_namespace = collections.defaultdict(dict)
+        for (namespace, memcache_key), entity in zip(misses, entities):
+            updates_by_namespace[namespace][memcache_key] = (
+                entity if entity else NO_OBJECT)
+        for namespace, updates in updates_by_namespace.iteritems():
+            MemcacheManager.set_multi(updates, namespace=namespace)
+            for memcache_key, value in updates.iteritems():
+                self._values[(namespace, memcache_key)] = value
+
+    @classmethod
+    def get_prefetched(cls, memcache_key, namespace):
+        """Returns (True, value) of a prefetched key or (False, None)."""
+        prefetcher = cls._get_current()
+        if prefetcher:
+            # pylint: disable=protected-access
+            key = (namespace, memcache_key)
+            if key in prefetcher._values:
+                PREFETCH_HIT.inc()
+                return True, prefetcher._values[key]
+        return False, None
+
+    @classmethod
+    def forget(cls, memcache_keys, namespace):
+        """Drops prefetched values of keys that are being changed."""
+        prefetcher = cls._get_current()
+        if prefetcher:
+            for memcache_key in memcache_keys:
+                key = (namespace, memcache_key)
+                # pylint: disable=protected-access
+                prefetcher._values.pop(key, None)
+                prefetcher._pending.pop(key, None)
+
+
 CAN_AGGREGATE_COUNTERS = ConfigProperty(
     'gcb_can_aggregate_counters', bool,
     'Whether or not to aggregate and record counter values in memcache. '
@@ -767,6 +1067,16 @@ class StudentProfileDAO(object):
             cls._memcache_key(profile.user_id),
             namespace=cls.TARGET_NAMESPACE)
 
+    @classmethod
+    def prefetch_profile_by_user_id(cls, user_id):
+        """Declares a profile the current request is going to load."""
+        EntityPrefetcher.instance().add(
+            cls._memcache_key(user_id),
+            db_key=db.Key.from_path(
+                PersonalProfile.kind(), user_id,
+                namespace=cls.TARGET_NAMESPACE),
+            namespace=cls.TARGET_NAMESPACE)
+
     @classmethod
     def get_profile_by_user_id(cls, user_id):
         """Loads profile given a user_id and returns DTO object."""
@@ -1029,6 +1339,13 @@ class Student(BaseEntity):
     def get_by_email(cls, email):
         return Student.get_by_key_name(email.encode('utf8'))
 
+    @classmethod
+    def prefetch_by_email(cls, email):
+        """Declares a student the current request is going to load."""
+        EntityPrefetcher.instance().add(
+            cls._memcache_key(email),
+            db_key=db.Key.from_path(cls.kind(), email.encode('utf8')))
+
     @classmethod
     def get_enrolled_student_by_email(cls, email):
         """Returns enrolled student or None."""
@@ -1144,12 +1461,67 @@ class EventEntity(BaseEntity):
         event.data = data
         event.put()
 
+    @classmethod
+    def record_many(cls, user, source_data_pairs):
+        """Records new events of a user into a datastore with one put.
+
+        If the put fails, the events are deferred to the task queue, which
+        retries it; each event keeps the recorded_on time it was created with.
+        Event ids are allocated before the first put, so a put that partially
+        succeeded before failing overwrites the same events when retried.
+
+        Args:
+          user: the user who triggered the events.
+          source_data_pairs: a list of (source, data) tuples, one per event.
+        """
+        if not source_data_pairs:
+            return
+        user_id = user.user_id()
+        first_id, _ = db.allocate_ids(
+            db.Key.from_path(cls.kind(), 1), len(source_data_pairs))
+        events = [
+            cls(key=db.Key.from_path(cls.kind(), first_id + index),
+                source=source, user_id=user_id, data=data)
+            for index, (source, data) in enumerate(source_data_pairs)]
+        start = time.time()
+        try:
+            entities_put(events)
+            EVENTS_BATCH_PUT.inc()
+            EVENTS_BATCH_PUT_ROWS.inc(len(events))
+        except Exception, e:  # pylint: disable=broad-except
+            logging.warning(
+                'Failed to write %s events; deferring them: %s',
+                len(events), e)
+            EVENTS_BATCH_PUT_FAILED.inc()
+            deferred.defer(cls._put_deferred, events)
+        finally:
+            EVENTS_BATCH_PUT_MSEC.inc(int((time.time() - start) * 1000))
+
+    @classmethod
+    def _put_deferred(cls, events):
+        entities_put(events)
+
     def for_export(self, transform_fn):
         model = super(EventEntity, self).for_export(transform_fn)
         model.user_id = transform_fn(self.user_id)
         return model
 
 
+EVENTS_BATCH_PUT = PerfCounter(
+    'gcb-models-events-batch-put',
+    'A number of batches of events written to the datastore with one put.')
+EVENTS_BATCH_PUT_ROWS = PerfCounter(
+    'gcb-models-events-batch-put-rows',
+    'A number of events written to the datastore in batches.')
+EVENTS_BATCH_PUT_MSEC = PerfCounter(
+    'gcb-models-events-batch-put-msec',
+    'A total number of milliseconds spent writing batches of events.')
+EVENTS_BATCH_PUT_FAILED = PerfCounter(
+    'gcb-models-events-batch-put-failed',
+    'A number of times a batch of events could not be written to the '
+    'datastore and was handed to the task queue instead.')
+
+
 class StudentAnswersEntity(BaseEntity):
     """Student answers to the assessments."""
 
@@ -1204,6 +1576,13 @@ class StudentPropertyEntity(BaseEntity):
         super(StudentPropertyEntity, self).delete()
         MemcacheManager.delete(self._memcache_key(self.key().name()))
 
+    @classmethod
+    def prefetch(cls, user_id, property_name):
+        """Declares a property the current request is going to load."""
+        key = cls.create_key(user_id, property_name)
+        EntityPrefetcher.instance().add(
+            cls._memcache_key(key), db_key=db.Key.from_path(cls.kind(), key))
+
     @classmethod
     def get(cls, student, property_name):
         """Loads student property."""
@@ -1219,6 +1598,61 @@ class StudentPropertyEntity(BaseEntity):
                 MemcacheManager.set(cls._memcache_key(key), NO_OBJECT)
         return value
 
+    @classmethod
+    def get_multi(cls, user_ids, property_name):
+        """Loads a property of many students; returns a dict keyed by user_id.
+
+        Students lacking the property are mapped to None.
+
+        Args:
+          user_ids: a list of user_id strings.
+          property_name: the name of the property to load.
+        Returns:
+          A dict of user_id to StudentPropertyEntity or None.
+        """
+        keys = [cls.create_key(user_id, property_name) for user_id in user_ids]
+        memcache_keys = [cls._memcache_key(key) for key in keys]
+        memcache_entities = MemcacheManager.get_multi(memcache_keys)
+
+        # fetch missing from datastore
+        datastore_keys = [
+            key for key, memcache_key in zip(keys, memcache_keys)
+            if memcache_key not in memcache_entities]
+        datastore_entities = {}
+        if datastore_keys:
+            datastore_entities = dict(zip(
+                datastore_keys, cls.get_by_key_name(datastore_keys)))
+
+        # weave the results together
+        result = {}
+        memcache_update = {}
+        for user_id, key, memcache_key in zip(user_ids, keys, memcache_keys):
+            if key in datastore_entities:
+                entity = datastore_entities[key]
+                memcache_update[memcache_key] = (
+                    entity if entity else NO_OBJECT)
+            else:
+                entity = memcache_entities[memcache_key]
+                if NO_OBJECT == entity:
+                    entity = None
+            result[user_id] = entity
+
+        # put into memcache
+        if memcache_update:
+            MemcacheManager.set_multi(memcache_update)
+        return result
+
+    @classmethod
+    def put_multi(cls, properties):
+        """Puts many properties with one datastore RPC; updates memcache."""
+        if not properties:
+            return []
+        result = entities_put(properties)
+        MemcacheManager.set_multi(dict(
+            (cls._memcache_key(entity.key().name()), entity)
+            for entity in properties))
+        return result
+
 
 class BaseJsonDao(object):
     """Base DAO class for entities storing their data in a single JSON blob."""
@@ -1229,6 +1663,10 @@ class BaseJsonDao(object):
         def get_entity_by_key(cls, entity_class, key):
             return entity_class.get_by_id(int(key))
 
+        @classmethod
+        def make_db_key(cls, entity_class, key):
+            return db.Key.from_path(entity_class.kind(), int(key))
+
         @classmethod
         def new_entity(cls, entity_class, unused_key):
             return entity_class()  # ID auto-generated when entity is put().
@@ -1239,6 +1677,10 @@ class BaseJsonDao(object):
         def get_entity_by_key(cls, entity_class, key):
             return entity_class.get_by_key_name(key)
 
+        @classmethod
+        def make_db_key(cls, entity_class, key):
+            return db.Key.from_path(entity_class.kind(), key)
+
         @classmethod
         def new_entity(cls, entity_class, key_name):
             return entity_class(key_name=key_name)
@@ -1348,6 +1790,14 @@ class BaseJsonDao(object):
                 MemcacheManager.set(memcache_key, NO_OBJECT)
         return entity
 
+    @classmethod
+    def prefetch(cls, obj_id):
+        """Declares an object the current request is going to load()."""
+        if obj_id:
+            EntityPrefetcher.instance().add(
+                cls._memcache_key(obj_id),
+                db_key=cls.ENTITY_KEY_TYPE.make_db_key(cls.ENTITY, obj_id))
+
     @classmethod
     def load(cls, obj_id):
         entity = cls._load_entity(obj_id)
@@ -16,6 +16,7 @@
 
 __author__ = 'Sean Lip (sll@google.com)'
 
+import collections
 import datetime
 import logging
 import os
@@ -38,6 +39,99 @@ TRACKABLE_COMPONENTS = [
 ]
 
 
+class CourseStructureIndex(object):
+    """Course structure precomputed for progress rollups.
+
+    Rolling up progress needs the lessons and pre/post assessments of a unit
+    and, for a lesson, whether it has an activity and which of its components
+    are trackable. Looking these up on the course walks lists of units and
+    lessons and parses lesson HTML; the index answers them with dict lookups.
+    An index describes one version of a course; it is kept in the course's
+    derived cache and so is shared until the course is changed.
+
+    All ids are accepted as strings or numbers. Component ids need lesson
+    HTML to be parsed, so they are computed on first use and memoized.
+    """
+
+    DERIVED_CACHE_KEY = 'progress:course-structure-index'
+
+    def __init__(self, course):
+        # str(unit_id) -> list of (lesson_id, has_activity) in course order.
+        self._unit_lessons = {}
+        # str(unit_id) -> (pre_assessment_id, post_assessment_id).
+        self._unit_assessments = {}
+        # str(assessment_id) -> unit_id of a unit using it as pre/post.
+        self._parent_unit_ids = {}
+        # (str(unit_id), str(lesson_id)) -> has_activity.
+        self._lesson_has_activity = {}
+        # (str(unit_id), str(lesson_id)) -> list of trackable component ids.
+        self._component_ids = {}
+
+        for unit in course.get_units():
+            unit_key = str(unit.unit_id)
+            lessons = []
+            for lesson in course.get_lessons(unit.unit_id):
+                if not lesson:
+                    continue
+                has_activity = bool(lesson.has_activity)
+                lessons.append((lesson.lesson_id, has_activity))
+                self._lesson_has_activity[
+                    (unit_key, str(lesson.lesson_id))] = has_activity
+            self._unit_lessons[unit_key] = lessons
+
+            pre_assessment_id = getattr(unit, 'pre_assessment', None)
+            post_assessment_id = getattr(unit, 'post_assessment', None)
+            self._unit_assessments[unit_key] = (
+                pre_assessment_id, post_assessment_id)
+            for assessment_id in (pre_assessment_id, post_assessment_id):
+                if assessment_id:
+                    self._parent_unit_ids.setdefault(
+                        str(assessment_id), unit.unit_id)
+
+    @classmethod
+    def get(cls, course):
+        """Returns the index of a course, building it if necessary."""
+        derived_cache = course.get_derived_cache()
+        index = derived_cache.get(cls.DERIVED_CACHE_KEY)
+        if index is None:
+            index = cls(course)
+            derived_cache[cls.DERIVED_CACHE_KEY] = index
+        return index
+
+    def get_lessons(self, unit_id):
+        """Returns a list of (lesson_id, has_activity) of lessons in unit."""
+        return self._unit_lessons.get(str(unit_id), [])
+
+    def get_unit_assessment_ids(self, unit_id):
+        """Returns (pre_assessment_id, post_assessment_id) of a unit."""
+        return self._unit_assessments.get(str(unit_id), (None, None))
+
+    def get_parent_unit_id(self, assessment_id):
+        """Returns id of the unit using an assessment as pre/post; or None."""
+        return self._parent_unit_ids.get(str(assessment_id))
+
+    def has_lesson(self, unit_id, lesson_id):
+        return (str(unit_id), str(lesson_id)) in self._lesson_has_activity
+
+    def lesson_has_activity(self, unit_id, lesson_id):
+        return self._lesson_has_activity.get(
+            (str(unit_id), str(lesson_id)), False)
+
+    def get_component_ids(self, course, unit_id, lesson_id):
+        """Returns a list of ids of trackable components in a lesson."""
+        key = (str(unit_id), str(lesson_id))
+        component_ids = self._component_ids.get(key)
+        if component_ids is None:
+            components = course.get_components(unit_id, lesson_id)
+            component_ids = []
+            for cpt_name in TRACKABLE_COMPONENTS:
+                component_ids += [
+                    cpt['instanceid'] for cpt in components
+                    if cpt.get('cpt_name') == cpt_name and cpt['instanceid']]
+            self._component_ids[key] = component_ids
+        return component_ids
+
+
 class UnitLessonCompletionTracker(object):
     """Tracks student completion for a unit/lesson-based linear course."""
 
@@ -103,12 +197,19 @@ class UnitLessonCompletionTracker(object):
 
     POST_UPDATE_PROGRESS_HOOK = []
 
+    # Max number of progress records read by one datastore get in
+    # get_progress_multi().
+    GET_PROGRESS_MULTI_BATCH_SIZE = 500
+
     def __init__(self, course):
         self._course = course
 
     def _get_course(self):
         return self._course
 
+    def _get_structure_index(self):
+        return CourseStructureIndex.get(self._get_course())
+
     def get_activity_as_python(self, unit_id, lesson_id):
         """Gets the corresponding activity as a Python object."""
         root_name = 'activity'
@@ -175,9 +276,10 @@ class UnitLessonCompletionTracker(object):
 
         # If this assessment is used as a "lesson" within a unit, prepend
         # the unit identifier.
-        parent_unit = self._get_course().get_parent_unit(assessment_id)
-        if parent_unit:
-            assessment_key = '.'.join([self._get_unit_key(parent_unit.unit_id),
+        parent_unit_id = self._get_structure_index().get_parent_unit_id(
+            assessment_id)
+        if parent_unit_id:
+            assessment_key = '.'.join([self._get_unit_key(parent_unit_id),
                                        assessment_key])
         return assessment_key
 
@@ -190,13 +292,8 @@ class UnitLessonCompletionTracker(object):
 
     def get_valid_component_ids(self, unit_id, lesson_id):
         """Returns a list of cpt ids representing trackable components."""
-        components = []
-        for cpt_name in TRACKABLE_COMPONENTS:
-            all_cpts = self._get_course().get_components_with_name(
-                unit_id, lesson_id, cpt_name)
-            components += [
-                cpt['instanceid'] for cpt in all_cpts if cpt['instanceid']]
-        return components
+        return list(self._get_structure_index().get_component_ids(
+            self._get_course(), unit_id, lesson_id))
 
     def get_valid_block_ids(self, unit_id, lesson_id):
         """Returns a list of block ids representing interactive activities."""
@@ -504,8 +601,9 @@ class UnitLessonCompletionTracker(object):
 
         self._set_entity_value(progress, event_key, self.IN_PROGRESS_STATE)
         course = self._get_course()
+        index = self._get_structure_index()
         for unit in course.get_track_matching_student(student):
-            if course.get_parent_unit(unit.unit_id):
+            if index.get_parent_unit_id(unit.unit_id):
                 # Completion of an assessment-as-lesson rolls up to its
                 # containing unit; it is not considered for overall course
                 # completion (except insofar as assessment completion
@@ -540,20 +638,18 @@ class UnitLessonCompletionTracker(object):
         self._set_entity_value(progress, event_key, self.IN_PROGRESS_STATE)
 
         # Check if all lessons in this unit have been completed.
-        lessons = self._get_course().get_lessons(unit_id)
-        for lesson in lessons:
+        index = self._get_structure_index()
+        for lesson_id, _ in index.get_lessons(unit_id):
             if (self.get_lesson_status(
-                    progress,
-                    unit_id, lesson.lesson_id) != self.COMPLETED_STATE):
+                    progress, unit_id, lesson_id) != self.COMPLETED_STATE):
                 return
 
         # Check whether pre/post assessments in this unit have been completed.
-        unit = self._get_course().find_unit_by_id(unit_id)
-        pre_assessment_id = unit.pre_assessment
+        pre_assessment_id, post_assessment_id = (
+            index.get_unit_assessment_ids(unit_id))
         if (pre_assessment_id and
             not self.get_assessment_status(progress, pre_assessment_id)):
             return
-        post_assessment_id = unit.post_assessment
         if (post_assessment_id and
             not self.get_assessment_status(progress, post_assessment_id)):
             return
@@ -580,18 +676,18 @@ class UnitLessonCompletionTracker(object):
         # Record that at least one part of this lesson has been completed.
         self._set_entity_value(progress, event_key, self.IN_PROGRESS_STATE)
 
-        lessons = self._get_course().get_lessons(unit_id)
-        for lesson in lessons:
-            if str(lesson.lesson_id) == lesson_id and lesson:
-                # Is the activity completed?
-                if (lesson.activity and self.get_activity_status(
-                        progress, unit_id, lesson_id) != self.COMPLETED_STATE):
-                    return
-
-                # Are all components of the lesson completed?
-                if (self.get_html_status(
-                        progress, unit_id, lesson_id) != self.COMPLETED_STATE):
-                    return
+        index = self._get_structure_index()
+        if index.has_lesson(unit_id, lesson_id):
+            # Is the activity completed?
+            if (index.lesson_has_activity(unit_id, lesson_id) and
+                self.get_activity_status(
+                    progress, unit_id, lesson_id) != self.COMPLETED_STATE):
+                return
+
+            # Are all components of the lesson completed?
+            if (self.get_html_status(
+                    progress, unit_id, lesson_id) != self.COMPLETED_STATE):
+                return
 
         # Record that all activities in this lesson have been completed.
         self._set_entity_value(progress, event_key, self.COMPLETED_STATE)
@@ -631,7 +727,8 @@ class UnitLessonCompletionTracker(object):
         # Record that at least one block in this activity has been completed.
         self._set_entity_value(progress, event_key, self.IN_PROGRESS_STATE)
 
-        cpt_ids = self.get_valid_component_ids(unit_id, lesson_id)
+        cpt_ids = self._get_structure_index().get_component_ids(
+            self._get_course(), unit_id, lesson_id)
         for cpt_id in cpt_ids:
             if not self.is_component_completed(
                     progress, unit_id, lesson_id, cpt_id):
@@ -649,8 +746,7 @@ class UnitLessonCompletionTracker(object):
         if current_state == state or current_state == self.COMPLETED_STATE:
             return
         self._set_entity_value(progress, event_key, state)
-        progress.updated_on = datetime.datetime.now()
-        progress.put()
+        self._put_progress(progress)
 
     UPDATER_MAPPING = {
         'activity': _update_activity,
@@ -734,37 +830,58 @@ class UnitLessonCompletionTracker(object):
         self._put_event(
             student, 'activity', self._get_activity_key(unit_id, lesson_id))
 
+    def make_html_completed_event(self, student, unit_id, lesson_id):
+        """Returns an event for put_events(), or None if it is not valid."""
+        if not self._get_course().is_valid_unit_lesson_id(unit_id, lesson_id):
+            return None
+        return (student, 'html', self._get_html_key(unit_id, lesson_id))
+
     def put_html_completed(self, student, unit_id, lesson_id):
         """Records that the given student has completed a lesson page."""
-        if not self._get_course().is_valid_unit_lesson_id(unit_id, lesson_id):
-            return
-        self._put_event(
-            student, 'html', self._get_html_key(unit_id, lesson_id))
+        event = self.make_html_completed_event(student, unit_id, lesson_id)
+        if event:
+            self._put_event(*event)
 
-    def put_block_completed(self, student, unit_id, lesson_id, block_id):
-        """Records that the given student has completed an activity block."""
+    def make_block_completed_event(
+        self, student, unit_id, lesson_id, block_id):
+        """Returns an event for put_events(), or None if it is not valid."""
         if not self._get_course().is_valid_unit_lesson_id(unit_id, lesson_id):
-            return
+            return None
         if block_id not in self.get_valid_block_ids(unit_id, lesson_id):
-            return
-        self._put_event(
+            return None
+        return (
             student,
             'block',
             self._get_block_key(unit_id, lesson_id, block_id)
         )
 
-    def put_component_completed(self, student, unit_id, lesson_id, cpt_id):
-        """Records completion of a component in a lesson body."""
+    def put_block_completed(self, student, unit_id, lesson_id, block_id):
+        """Records that the given student has completed an activity block."""
+        event = self.make_block_completed_event(
+            student, unit_id, lesson_id, block_id)
+        if event:
+            self._put_event(*event)
+
+    def make_component_completed_event(
+        self, student, unit_id, lesson_id, cpt_id):
+        """Returns an event for put_events(), or None if it is not valid."""
         if not self._get_course().is_valid_unit_lesson_id(unit_id, lesson_id):
-            return
+            return None
         if cpt_id not in self.get_valid_component_ids(unit_id, lesson_id):
-            return
-        self._put_event(
+            return None
+        return (
             student,
             'component',
             self._get_component_key(unit_id, lesson_id, cpt_id)
         )
 
+    def put_component_completed(self, student, unit_id, lesson_id, cpt_id):
+        """Records completion of a component in a lesson body."""
+        event = self.make_component_completed_event(
+            student, unit_id, lesson_id, cpt_id)
+        if event:
+            self._put_event(*event)
+
     def put_assessment_completed(self, student, assessment_id):
         """Records that the given student has completed the given assessment."""
         if not self._get_course().is_valid_assessment_id(assessment_id):
@@ -812,11 +929,52 @@ class UnitLessonCompletionTracker(object):
         self._update_event(
             student, progress, event_entity, event_key, direct_update=True)
 
+        self._put_progress(progress)
+
+    def _put_progress(self, progress):
+        """Serializes pending changes and saves the progress entity."""
+        self._flush_progress_dict(progress, forget=True)
         progress.updated_on = datetime.datetime.now()
         progress.put()
 
+    def put_events(self, events):
+        """Records many events, loading and saving each progress only once.
+
+        Events are grouped by student and applied in order against a single
+        progress record per student. All modified records are then written
+        with one datastore put.
+
+        Args:
+          events: a list of (student, event_entity, event_key) tuples, as
+              returned by make_html_completed_event() and similar methods.
+        """
+        students = {}
+        events_by_user_id = collections.OrderedDict()
+        for student, event_entity, event_key in events:
+            if (student.is_transient or
+                event_entity not in self.EVENT_CODE_MAPPING):
+                continue
+            students[student.user_id] = student
+            events_by_user_id.setdefault(student.user_id, []).append(
+                (event_entity, event_key))
+        if not events_by_user_id:
+            return
+
+        progress_by_user_id = self.get_or_create_progress_multi(
+            [students[user_id] for user_id in events_by_user_id])
+        now = datetime.datetime.now()
+        for user_id, student_events in events_by_user_id.iteritems():
+            progress = progress_by_user_id[user_id]
+            for event_entity, event_key in student_events:
+                self._update_event(
+                    students[user_id], progress, event_entity, event_key,
+                    direct_update=True)
+            self._flush_progress_dict(progress, forget=True)
+            progress.updated_on = now
+        StudentPropertyEntity.put_multi(progress_by_user_id.values())
+
     def _update_event(self, student, progress, event_entity, event_key,
-                      direct_update=False):
+                      direct_update=False, hook_args=None):
         """Updates statistics for the given event, and for derived events.
 
         Args:
@@ -826,7 +984,13 @@ class UnitLessonCompletionTracker(object):
           event_key: the key for the recorded event
           direct_update: True if this event is being updated explicitly; False
               if it is being auto-updated.
+          hook_args: a list collecting the (event_entity, event_key) of each
+              update in the cascade, to run POST_UPDATE_PROGRESS_HOOK for
+              once the cascade is done; None at the top of the cascade.
         """
+        is_top = hook_args is None
+        if is_top:
+            hook_args = []
         if direct_update or event_entity not in self.UPDATER_MAPPING:
             if event_entity in self.UPDATER_MAPPING:
                 # This is a derived event, so directly mark it as completed.
@@ -853,7 +1017,8 @@ class UnitLessonCompletionTracker(object):
                             student=student,
                             progress=progress,
                             event_entity=event_entity,
-                            event_key=parent_event_key)
+                            event_key=parent_event_key,
+                            hook_args=hook_args)
                 else:
                     # Only update course status when we are at the top of
                     # a containment list
@@ -862,8 +1027,19 @@ class UnitLessonCompletionTracker(object):
             # Or only update course status when we are doing something not
             # in derived events (Unit, typically).
             self._update_course(progress, student)
-        utils.run_hooks(self.POST_UPDATE_PROGRESS_HOOK, self._get_course(),
-                        student, progress, event_entity, event_key)
+        hook_args.append((event_entity, event_key))
+        if not is_top or not self.POST_UPDATE_PROGRESS_HOOK:
+            return
+
+        # Hooks are promised an entity with all the latest changes.  Each
+        # update of the cascade ran its hooks after all updates derived from
+        # it, so all hooks run after the whole cascade, in the same order,
+        # and the progress is serialized once for all of them.
+        self._flush_progress_dict(progress)
+        course = self._get_course()
+        for hook_event_entity, hook_event_key in hook_args:
+            utils.run_hooks(self.POST_UPDATE_PROGRESS_HOOK, course, student,
+                            progress, hook_event_entity, hook_event_key)
 
     def get_course_status(self, progress):
         return self._get_entity_value(progress, self._get_course_key())
@@ -923,6 +1099,28 @@ class UnitLessonCompletionTracker(object):
             progress.put()
         return progress
 
+    @classmethod
+    def get_or_create_progress_multi(cls, students):
+        """Loads progress of many students; returns a dict keyed by user_id.
+
+        Unlike get_or_create_progress(), records that do not exist yet are
+        created, but not saved; the caller is expected to save them.
+
+        Args:
+          students: a list of Student.
+        Returns:
+          A dict of user_id to StudentPropertyEntity.
+        """
+        user_ids = [student.user_id for student in students]
+        progress_by_user_id = StudentPropertyEntity.get_multi(
+            user_ids, cls.PROPERTY_KEY)
+        for student in students:
+            if not progress_by_user_id.get(student.user_id):
+                progress_by_user_id[student.user_id] = (
+                    StudentPropertyEntity.create(
+                        student=student, property_name=cls.PROPERTY_KEY))
+        return progress_by_user_id
+
     def get_course_progress(self, student):
         """Return [NOT_STARTED|IN_PROGRESS|COMPLETED]_STATE for course."""
         progress = self.get_or_create_progress(student)
@@ -933,10 +1131,11 @@ class UnitLessonCompletionTracker(object):
         if student.is_transient:
             return {}
 
-        units = self._get_course().get_units()
         if progress is None:
             progress = self.get_or_create_progress(student)
+        return self._get_unit_progress(self._get_course().get_units(), progress)
 
+    def _get_unit_progress(self, units, progress):
         result = {}
         for unit in units:
             if unit.type == verify.UNIT_TYPE_ASSESSMENT:
@@ -999,21 +1198,74 @@ class UnitLessonCompletionTracker(object):
         if student.is_transient:
             return {}
 
-        lessons = self._get_course().get_lessons(unit_id)
         if progress is None:
             progress = self.get_or_create_progress(student)
+        return self._get_lesson_progress(
+            self._get_structure_index().get_lessons(unit_id), unit_id, progress)
 
+    def _get_lesson_progress(self, lessons, unit_id, progress):
         result = {}
-        for lesson in lessons:
-            result[lesson.lesson_id] = {
+        for lesson_id, has_activity in lessons:
+            result[lesson_id] = {
                 'html': self.get_html_status(
-                    progress, unit_id, lesson.lesson_id) or 0,
+                    progress, unit_id, lesson_id) or 0,
                 'activity': self.get_activity_status(
-                    progress, unit_id, lesson.lesson_id) or 0,
-                'has_activity': lesson.has_activity,
+                    progress, unit_id, lesson_id) or 0,
+                'has_activity': has_activity,
+            }
+        return result
+
+    def get_progress_multi(self, student_ids):
+        """Returns unit and lesson progress of many students.
+
+        Progress records are read directly from datastore, one get per
+        GET_PROGRESS_MULTI_BATCH_SIZE students, and the value of each is
+        parsed once. Unlike get_or_create_progress(), missing records are
+        not created.
+
+        Args:
+          student_ids: a list of user_id strings.
+        Returns:
+          A dict of user_id to a dict with two keys: 'units', a dict of
+          unit_id to unit state as returned by get_unit_progress(), and
+          'lessons', a dict of unit_id to lesson states as returned by
+          get_lesson_progress(), for all units of type unit.
+        """
+        units = self._get_course().get_units()
+        index = self._get_structure_index()
+        unit_lessons = [
+            (unit.unit_id, index.get_lessons(unit.unit_id))
+            for unit in units if unit.type == verify.UNIT_TYPE_UNIT]
+
+        result = {}
+        for user_id, progress in self._load_progress_multi(student_ids):
+            lessons = {}
+            for unit_id, lesson_ids in unit_lessons:
+                lessons[unit_id] = self._get_lesson_progress(
+                    lesson_ids, unit_id, progress)
+            result[user_id] = {
+                'units': self._get_unit_progress(units, progress),
+                'lessons': lessons,
             }
         return result
 
+    @classmethod
+    def _load_progress_multi(cls, student_ids):
+        """Yields (user_id, progress) in batches; progress is blank if new."""
+        student_ids = list(student_ids)
+        for start in xrange(
+                0, len(student_ids), cls.GET_PROGRESS_MULTI_BATCH_SIZE):
+            batch = student_ids[start:start + cls.GET_PROGRESS_MULTI_BATCH_SIZE]
+            key_names = [
+                StudentPropertyEntity.create_key(user_id, cls.PROPERTY_KEY)
+                for user_id in batch]
+            entities = StudentPropertyEntity.get_by_key_name(key_names)
+            for user_id, key_name, entity in zip(batch, key_names, entities):
+                if not entity:
+                    entity = StudentPropertyEntity(
+                        key_name=key_name, name=cls.PROPERTY_KEY)
+                yield user_id, entity
+
     def get_component_progress(self, student, unit_id, lesson_id, cpt_id):
         """Returns the progress status of the given component."""
         if student.is_transient:
@@ -1023,51 +1275,82 @@ class UnitLessonCompletionTracker(object):
         return self.is_component_completed(
             progress, unit_id, lesson_id, cpt_id) or 0
 
+    def _get_progress_dict(self, progress):
+        """Returns a working dict of progress, parsing its JSON value once.
+
+        The dict is kept with the entity for as long as its value stays the
+        same, so a whole cascade of updates shares a single parse. Changes to
+        the dict are written back to the value by _flush_progress_dict().
+
+        Args:
+          progress: the StudentPropertyEntity
+        Returns:
+          A dict of progress values keyed by event key.
+        """
+        # pylint: disable=protected-access
+        parsed = getattr(progress, '_parsed_progress', None)
+        if parsed and parsed[0] is progress.value:
+            return parsed[1]
+        progress_dict = {}
+        if progress.value:
+            progress_dict = transforms.loads(progress.value)
+        progress._parsed_progress = [progress.value, progress_dict, False]
+        return progress_dict
+
+    def _flush_progress_dict(self, progress, forget=False):
+        """Serializes the working dict into the entity value if it changed.
+
+        Args:
+          progress: the StudentPropertyEntity
+          forget: whether to drop the working dict, so it is not stored along
+              with the entity when it is put into memcache
+        """
+        # pylint: disable=protected-access
+        parsed = getattr(progress, '_parsed_progress', None)
+        if not parsed or parsed[0] is not progress.value:
+            return
+        if parsed[2]:
+            progress.value = transforms.dumps(parsed[1])
+            parsed[0] = progress.value
+            parsed[2] = False
+        if forget:
+            del progress._parsed_progress
+
+    def _mark_progress_dict_changed(self, progress):
+        progress._parsed_progress[2] = True  # pylint: disable=protected-access
+
     def _get_entity_value(self, progress, event_key):
-        if not progress.value:
-            return None
-        return transforms.loads(progress.value).get(event_key)
+        return self._get_progress_dict(progress).get(event_key)
 
     def _set_entity_value(self, student_property, key, value):
         """Sets the integer value of a student property.
 
         Note: this method does not commit the change. The calling method should
-        call put() on the StudentPropertyEntity.
+        call _put_progress() on the StudentPropertyEntity.
 
         Args:
           student_property: the StudentPropertyEntity
           key: the student property whose value should be incremented
           value: the value to increment this property by
         """
-        try:
-            progress_dict = transforms.loads(student_property.value)
-        except (AttributeError, TypeError):
-            progress_dict = {}
-
+        progress_dict = self._get_progress_dict(student_property)
         progress_dict[key] = value
-        student_property.value = transforms.dumps(progress_dict)
+        self._mark_progress_dict_changed(student_property)
 
     def _inc(self, student_property, key, value=1):
         """Increments the integer value of a student property.
 
         Note: this method does not commit the change. The calling method should
-        call put() on the StudentPropertyEntity.
+        call _put_progress() on the StudentPropertyEntity.
 
         Args:
           student_property: the StudentPropertyEntity
           key: the student property whose value should be incremented
           value: the value to increment this property by
         """
-        try:
-            progress_dict = transforms.loads(student_property.value)
-        except (AttributeError, TypeError):
-            progress_dict = {}
-
-        if key not in progress_dict:
-            progress_dict[key] = 0
-
-        progress_dict[key] += value
-        student_property.value = transforms.dumps(progress_dict)
+        progress_dict = self._get_progress_dict(student_property)
+        progress_dict[key] = progress_dict.get(key, 0) + value
+        self._mark_progress_dict_changed(student_property)
 
     @classmethod
     def get_elements_from_key(cls, key):
@@ -65,6 +65,7 @@ class Roles(object):
     _REGISTERED_PERMISSIONS = collections.OrderedDict()
 
     memcache_key = 'roles.Roles.users_to_permissions_map'
+    MemcacheManager.register_immutable_key_prefix(memcache_key)
 
     @classmethod
     def is_direct_super_admin(cls):
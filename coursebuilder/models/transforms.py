@@ -533,6 +533,30 @@ class JsonFile(object):
         assert self._file
         return self
 
+    @classmethod
+    def iter_lines(cls, stream):
+        """Yields the rows of JsonFile content in stream as unparsed JSON.
+
+        Unlike iteration, works on any stream of lines, e.g. a member of a zip
+        file, and leaves parsing each row to the caller.
+
+        Args:
+            stream: iterable of the lines of a file written by JsonFile.
+
+        Yields:
+            One JSON string per object passed to write.
+        """
+        # The prefix and suffix are written on lines of their own; rows may
+        # end with the same characters, so only whole lines are skipped.
+        delimiters = frozenset([cls._PREFIX, cls._SUFFIX.strip(), ''])
+        for line in stream:
+            line = line.strip()
+            if line in delimiters:
+                continue
+            if line.endswith(','):
+                line = line[:-1]
+            yield line
+
     def close(self):
         """Closes the file; must close before read."""
         assert self._file
@@ -16,7 +16,9 @@
 
 __author__ = 'Pavel Simakov (psimakov@google.com)'
 
+import collections
 import datetime
+import hashlib
 import os
 import re
 import sys
@@ -24,6 +26,7 @@ import threading
 import unittest
 
 from config import ConfigProperty
+import counters
 from counters import PerfCounter
 from entities import BaseEntity
 from entities import put as entities_put
@@ -48,6 +51,12 @@ _MAX_VFS_SHARD_SIZE = 1000 * 1000
 # Max number of shards for a single VFS cached file.
 _MAX_VFS_NUM_SHARDS = 4
 
+# Number of bytes read at a time from files on local disk by a chunked stream.
+_LOCAL_FILE_CHUNK_SIZE = 256 * 1024
+
+# Max number of files returned by a directory listing.
+_MAX_VFS_LIST_SIZE = 1000
+
 # Global memcache controls.
 CAN_USE_VFS_IN_PROCESS_CACHE = ConfigProperty(
     'gcb_can_use_vfs_in_process_cache', bool, (
@@ -104,6 +113,19 @@ class AbstractFileSystem(object):
         """Returns a stream with the file content, similar to open(...)."""
         return self._impl.get(filename)
 
+    def open_chunked(self, filename):
+        """Returns a ChunkedFileStream with the file content; None if absent.
+
+        Unlike open(), large files are not read into memory at once. Their
+        content is loaded a chunk at a time as the stream is consumed.
+
+        Args:
+            filename: string. The logical name of the file.
+        Returns:
+            A ChunkedFileStream or None.
+        """
+        return self._impl.open_chunked(filename)
+
     def get(self, filename):
         """Returns bytes with the file content, but no metadata."""
         return self.open(filename).read()
@@ -181,6 +203,22 @@ class LocalReadOnlyFileSystem(object):
             return None
         return open(self._logical_to_physical(filename), 'rb')
 
+    def open_chunked(self, filename):
+        if not self.isfile(filename):
+            return None
+        physical_filename = self._logical_to_physical(filename)
+
+        def load_chunk_async(index):
+            def get_result():
+                with open(physical_filename, 'rb') as stream:
+                    stream.seek(index * _LOCAL_FILE_CHUNK_SIZE)
+                    return stream.read(_LOCAL_FILE_CHUNK_SIZE)
+            return get_result
+
+        return ChunkedFileStream(
+            None, os.path.getsize(physical_filename), _LOCAL_FILE_CHUNK_SIZE,
+            load_chunk_async)
+
     def put(self, unused_filename, unused_stream):
         raise Exception('Not implemented.')
 
@@ -206,8 +244,9 @@ class LocalReadOnlyFileSystem(object):
         for dir_name in dir_names:
             physical_dir_names.append(self._logical_to_physical(dir_name))
 
-        return jinja_utils.create_jinja_environment(
-            loader=jinja2.FileSystemLoader(physical_dir_names),
+        return jinja_utils.get_jinja_environment(
+            ('local',) + tuple(physical_dir_names),
+            lambda: jinja2.FileSystemLoader(physical_dir_names),
             autoescape=autoescape)
 
     def is_read_write(self):
@@ -228,10 +267,22 @@ class FileMetadataEntity(BaseEntity):
 
     size = db.IntegerProperty(indexed=False)
 
+    # Hash of the file content, which is stored once per namespace in a blob
+    # shared by all files with the same content. Files written before blobs
+    # were introduced have no hash; their content is keyed by file name.
+    content_hash = db.StringProperty(indexed=False)
+
 
 class FileDataEntity(BaseEntity):
-    """An entity to represent file content; absolute file name is a key."""
+    """An entity to represent file content.
+
+    Content of files with a content_hash is stored as a blob: a head entity
+    keyed by the hash holds the number of files referring to the blob, and
+    data entities keyed by '<hash>:data' and its shards hold the content.
+    Older files have their content stored in entities keyed by file name.
+    """
     data = db.BlobProperty()
+    ref_count = db.IntegerProperty(indexed=False)
 
 
 class FileStreamWrapped(object):
@@ -252,6 +303,68 @@ class FileStreamWrapped(object):
         return self._metadata
 
 
+class ChunkedFileStream(object):
+    """A read-only stream of a file that loads its content a chunk at a time.
+
+    Chunks are loaded by a function that is given a chunk index and starts
+    loading the chunk; it returns a function that waits for and returns the
+    chunk bytes. While one chunk is consumed the next one is being loaded.
+    """
+
+    def __init__(self, metadata, size, chunk_size, load_chunk_async):
+        assert chunk_size > 0
+        self._metadata = metadata
+        self._size = size
+        self._chunk_size = chunk_size
+        self._load_chunk_async = load_chunk_async
+        self._position = 0
+
+    @classmethod
+    def from_data(cls, metadata, data):
+        """Makes a stream of a single chunk of bytes already in memory."""
+        return cls(
+            metadata, len(data), max(len(data), 1),
+            lambda unused_index: lambda: data)
+
+    @property
+    def metadata(self):
+        return self._metadata
+
+    @property
+    def size(self):
+        return self._size
+
+    def iter_chunks(self, start=0, end=None):
+        """Yields the bytes of a range of the file a chunk at a time.
+
+        Args:
+            start: int. The offset of the first byte to return.
+            end: int. The offset past the last byte to return; None for the
+                end of the file.
+        Yields:
+            Strings of bytes; together they hold bytes [start, end).
+        """
+        if end is None or end > self._size:
+            end = self._size
+        if start >= end:
+            return
+        first_index = start // self._chunk_size
+        last_index = (end - 1) // self._chunk_size
+        pending = self._load_chunk_async(first_index)
+        for index in xrange(first_index, last_index + 1):
+            data = pending()
+            if index < last_index:
+                pending = self._load_chunk_async(index + 1)
+            offset = index * self._chunk_size
+            yield data[max(start - offset, 0):end - offset]
+
+    def read(self):
+        """Emulates stream.read(). Returns all bytes and emulates EOF."""
+        data = ''.join(self.iter_chunks(start=self._position))
+        self._position = self._size
+        return data
+
+
 class StringStream(object):
     """A wrapper to pose a string as a UTF-8 byte stream."""
 
@@ -286,14 +399,44 @@ class VirtualFileSystemTemplateLoader(jinja2.BaseLoader):
                 self._dir_names.append(AbstractFileSystem.normpath(dir_name))
 
     def get_source(self, unused_environment, template):
+        filenames = []
         for dir_name in self._dir_names:
             filename = AbstractFileSystem.normpath(
                 os.path.join(dir_name, template))
+            filenames.append(filename)
             stream = self._fs.open(filename)
             if stream:
-                return stream.read().decode('utf-8'), filename, True
+                return (
+                    stream.read().decode('utf-8'), filename,
+                    self._make_uptodate(filenames))
         raise jinja2.TemplateNotFound(template)
 
+    def _make_uptodate(self, filenames):
+        """Makes a function telling if files looked up are still the same.
+
+        The template is up to date as long as the VFS cache holds the same
+        entries for the file it was loaded from, and for the files that were
+        looked up before it and found missing. Any change to these files
+        evicts their cache entries.
+
+        Args:
+          filenames: a list of names of files looked up, in order.
+        Returns:
+          A function returning True if the template is up to date.
+        """
+        entries = [self._fs.get_cache_entry(name) for name in filenames]
+        if not all(found for found, _ in entries):
+            return lambda: False
+
+        def uptodate():
+            for filename, (_, entry) in zip(filenames, entries):
+                found, current_entry = self._fs.get_cache_entry(filename)
+                if not found or current_entry is not entry:
+                    return False
+            return True
+
+        return uptodate
+
     def list_templates(self):
         all_templates = []
         for dir_name in self._dir_names:
@@ -314,11 +457,24 @@ class ProcessScopedVfsCache(caching.ProcessScopedSingleton):
         # pylint: disable=protected-access
         return ProcessScopedVfsCache.instance()._cache.total_size
 
+    @classmethod
+    def get_namespace_stats(cls):
+        """Returns a dict of namespace to a dict of cache stat counts."""
+        # pylint: disable=protected-access
+        return dict(
+            (namespace, dict(stats)) for namespace, stats in
+            ProcessScopedVfsCache.instance()._namespace_stats.iteritems())
+
     def __init__(self):
         self._cache = caching.LRUCache(
             max_size_bytes=MAX_GLOBAL_CACHE_SIZE_BYTES,
             max_item_size_bytes=MAX_GLOBAL_CACHE_ITEM_SIZE_BYTES)
         self._cache.get_entry_size = self._get_entry_size
+        self._namespace_stats = collections.defaultdict(
+            lambda: collections.defaultdict(int))
+
+    def inc_namespace_stat(self, namespace, name):
+        self._namespace_stats[namespace][name] += 1
 
     def _get_entry_size(self, key, value):
         return sys.getsizeof(key) + value.getsizeof() if value else 0
@@ -379,11 +535,56 @@ class CacheFileEntry(caching.AbstractCacheEntry):
         return None
 
 
+class CacheListingEntry(caching.AbstractCacheEntry):
+    """Cache entry representing the names of all files in a namespace."""
+
+    def __init__(self, filenames):
+        self.filenames = frozenset(filenames)
+        self.created_on = datetime.datetime.utcnow()
+
+    def getsizeof(self):
+        return (
+            sys.getsizeof(self.filenames) +
+            sum(sys.getsizeof(filename) for filename in self.filenames) +
+            sys.getsizeof(self.created_on))
+
+    def updated_on(self):
+        return None
+
+
+class NoopVfsCacheConnection(caching.NoopCacheConnection):
+    """Connection to no-op VFS cache that provides no caching."""
+
+    def get_listing(self):
+        return None
+
+    def put_listing(self, unused_filenames):
+        return None
+
+    def delete_listing(self):
+        return None
+
+    def get_entry(self, unused_key):
+        return False, None
+
+
 class VfsCacheConnection(caching.AbstractCacheConnection):
+    """Connection to the in-process cache of files and of their absence.
+
+    Besides files, the cache holds negative entries for files known not to
+    exist, and one listing of the names of all files in the namespace. All
+    of these are kept fresh by apply_updates(): an update of a name evicts
+    its negative entry, and an update of a name not in the listing evicts
+    the listing. As with files, deletions made by other processes are only
+    noticed when entries expire.
+    """
 
     PERSISTENT_ENTITY = FileMetadataEntity
     CACHE_ENTRY = CacheFileEntry
 
+    # Physical file names start with '/', so this key is not a file name.
+    LISTING_KEY = ':listing'
+
     @classmethod
     def init_counters(cls):
         super(VfsCacheConnection, cls).init_counters()
@@ -395,18 +596,324 @@ class VfsCacheConnection(caching.AbstractCacheConnection):
         cls.CACHE_INHERITED = PerfCounter(
             'gcb-models-VfsCacheConnection-cache-inherited',
             'A number of times an object was obtained from the inherited vfs.')
+        cls.CACHE_LISTING_HIT = PerfCounter(
+            'gcb-models-VfsCacheConnection-cache-listing-hit',
+            'A number of times a directory was listed from cache.')
+        cls.CACHE_LISTING_MISS = PerfCounter(
+            'gcb-models-VfsCacheConnection-cache-listing-miss',
+            'A number of times a directory listing was not found in cache.')
+        cls.CACHE_LISTING_EVICT = PerfCounter(
+            'gcb-models-VfsCacheConnection-cache-listing-evict',
+            'A number of times a directory listing was evicted from cache '
+            'because a file was added or deleted.')
 
     @classmethod
     def is_enabled(cls):
         return CAN_USE_VFS_IN_PROCESS_CACHE.value
 
+    @classmethod
+    def new_connection(cls, *args, **kwargs):
+        if not cls.is_enabled():
+            return NoopVfsCacheConnection()
+        return super(VfsCacheConnection, cls).new_connection(*args, **kwargs)
+
     def __init__(self, namespace):
         super(VfsCacheConnection, self).__init__(namespace)
         self.cache = ProcessScopedVfsCache.instance().cache
 
+    def _inc_namespace_stat(self, name):
+        ProcessScopedVfsCache.instance().inc_namespace_stat(
+            self.namespace, name)
+
+    def apply_updates(self, updates):
+        super(VfsCacheConnection, self).apply_updates(updates)
+        _key = self.make_key(self.namespace, self.LISTING_KEY)
+        found, entry = self.cache.get(_key)
+        if not found or not entry:
+            return
+        for key in updates:
+            if key not in entry.filenames:
+                self.CACHE_LISTING_EVICT.inc()
+                self.cache.delete(_key)
+                return
+
+    def get(self, key):
+        found, value = super(VfsCacheConnection, self).get(key)
+        if not found:
+            self._inc_namespace_stat('miss')
+        elif value is None:
+            self._inc_namespace_stat('hit-none')
+        else:
+            self._inc_namespace_stat('hit')
+        return found, value
+
+    def get_entry(self, key):
+        """Returns (found, entry) for the cache entry of a key, if any.
+
+        A new entry is made each time a key is put into the cache, so callers
+        can tell whether a key has changed by comparing entries by identity.
+        Negative entries are None.
+
+        Args:
+          key: a key to look up.
+        Returns:
+          A tuple of a bool telling if the key is cached, and its entry.
+        """
+        found, entry = self.cache.get(self.make_key(self.namespace, key))
+        if found and entry and entry.has_expired():
+            return False, None
+        return found, entry
+
+    def get_listing(self):
+        """Returns a frozenset of names of all files; None if not cached."""
+        _key = self.make_key(self.namespace, self.LISTING_KEY)
+        found, entry = self.cache.get(_key)
+        if found and entry and entry.has_expired():
+            self.CACHE_EXPIRE.inc()
+            self.cache.delete(_key)
+            found = False
+        if not found or not entry:
+            self.CACHE_LISTING_MISS.inc(context=self.namespace)
+            self._inc_namespace_stat('listing-miss')
+            return None
+        self.CACHE_LISTING_HIT.inc(context=self.namespace)
+        self._inc_namespace_stat('listing-hit')
+        return entry.filenames
+
+    def put_listing(self, filenames):
+        self.CACHE_PUT.inc()
+        self.cache.put(
+            self.make_key(self.namespace, self.LISTING_KEY),
+            CacheListingEntry(filenames))
+
+    def delete_listing(self):
+        self.CACHE_DELETE.inc()
+        self.cache.delete(self.make_key(self.namespace, self.LISTING_KEY))
+
 
 VfsCacheConnection.init_counters()
 
+VFS_BLOB_CREATED = PerfCounter(
+    'gcb-models-vfs-blob-created',
+    'A number of times file content was stored as a new blob.')
+VFS_BLOB_REUSED = PerfCounter(
+    'gcb-models-vfs-blob-reused',
+    'A number of times file content was found in an existing blob and was '
+    'not stored again.')
+VFS_BLOB_UNCHANGED = PerfCounter(
+    'gcb-models-vfs-blob-unchanged',
+    'A number of times a file was put with the content it already had.')
+VFS_BLOB_DELETED = PerfCounter(
+    'gcb-models-vfs-blob-deleted',
+    'A number of times a blob was deleted because no file referred to it.')
+
+
+def _hash_content(content):
+    # Hashes don't start with '/', so they never collide with file names.
+    return 'sha256:%s' % hashlib.sha256(content).hexdigest()
+
+
+def _get_file_data_key_names(name, size):
+    # pylint: disable=protected-access
+    return DatastoreBackedFileSystem._generate_file_key_names(name, size)
+
+
+def _get_blob_data_key_names(content_hash, size):
+    return _get_file_data_key_names('%s:data' % content_hash, size)
+
+
+# Most blobs whose counts are updated in one cross-group transaction, which
+# may write at most 25 entity groups.
+_MAX_BLOBS_PER_TRANSACTION = 25
+
+# Most bytes of new blob content written in one transaction; any one blob is
+# written even if larger.
+_MAX_BLOB_BYTES_PER_TRANSACTION = _MAX_VFS_SHARD_SIZE * _MAX_VFS_NUM_SHARDS
+
+
+@db.transactional(xg=True)
+def _update_blob_ref_counts(deltas, sizes, contents):
+    """Changes the numbers of files referring to blobs in one transaction.
+
+    A blob is created when first referred to and deleted with its data when
+    no longer referred to. Its data entities are written or deleted in the
+    same transaction as its head, so a concurrent update of the same blob
+    either sees all of them or none. All heads are read with one get, and
+    written with one put.
+
+    Args:
+        deltas: dict. The change in the number of files referring to each
+            blob, by content hash.
+        sizes: dict. The size of the content of each blob, by content hash.
+        contents: dict. The content of each blob that may be created, by
+            content hash.
+
+    Returns:
+        A list of the PerfCounters to increment for the changes.
+    """
+    content_hashes = sorted(deltas)
+    heads = FileDataEntity.get_by_key_name(content_hashes)
+    puts = []
+    deletes = []
+    counters = []
+    for content_hash, head in zip(content_hashes, heads):
+        delta = deltas[content_hash]
+        size = sizes[content_hash]
+        if not head:
+            if delta <= 0:
+                continue
+            content = contents[content_hash]
+            puts.append(FileDataEntity(key_name=content_hash, ref_count=delta))
+            for index, key_name in enumerate(
+                    _get_blob_data_key_names(content_hash, size)):
+                start_offset = index * _MAX_VFS_SHARD_SIZE
+                end_offset = (index + 1) * _MAX_VFS_SHARD_SIZE
+                puts.append(FileDataEntity(
+                    key_name=key_name,
+                    data=content[start_offset:end_offset]))
+            counters.append(VFS_BLOB_CREATED)
+            continue
+
+        head.ref_count = (head.ref_count or 0) + delta
+        if head.ref_count > 0:
+            puts.append(head)
+            if delta > 0:
+                counters.append(VFS_BLOB_REUSED)
+            continue
+        deletes += [head.key()] + [
+            db.Key.from_path(FileDataEntity.kind(), key_name)
+            for key_name in _get_blob_data_key_names(content_hash, size)]
+        counters.append(VFS_BLOB_DELETED)
+    if puts:
+        entities_put(puts)
+    if deletes:
+        db.delete(deletes)
+    return counters
+
+
+class _BlobChanges(object):
+    """Collects changes to content blobs made by puts and deletes of files.
+
+    Files with the same content in a namespace share one blob; its head
+    entity counts the files referring to it. Counts are read and updated in
+    transactions of up to _MAX_BLOBS_PER_TRANSACTION blobs each; see
+    _update_blob_ref_counts().
+
+    Call add_references() before and drop_references() after the metadata
+    of the files is saved, so that saved metadata never refers to a deleted
+    blob. If saving the metadata fails, call recover() instead.
+    """
+
+    def __init__(self):
+        self._namespace = namespace_manager.get_namespace()
+        self._added = {}  # file name -> content hash of an acquired blob
+        self._dropped = {}  # file name -> content hash of a released blob
+        self._legacy_keys = {}  # file name -> keys of content stored by name
+        self._sizes = {}  # content hash -> content size
+        self._contents = {}  # content hash -> content of an acquired blob
+
+    def release(self, filename, metadata):
+        """Drops the reference of a stored file to its content."""
+        if not metadata.is_saved() or metadata.size is None:
+            return
+        if not metadata.content_hash:
+            self._legacy_keys[filename] = [
+                db.Key.from_path(FileDataEntity.kind(), key_name)
+                for key_name in _get_file_data_key_names(
+                    filename, metadata.size)]
+            return
+        self._dropped[filename] = metadata.content_hash
+        self._sizes[metadata.content_hash] = metadata.size
+
+    def acquire(self, filename, metadata, content):
+        """Points metadata of a file at a blob holding the content."""
+        content_hash = _hash_content(content)
+        if metadata.is_saved() and metadata.content_hash == content_hash:
+            VFS_BLOB_UNCHANGED.inc()
+            return
+        self.release(filename, metadata)
+        metadata.content_hash = content_hash
+        metadata.size = len(content)
+        self._added[filename] = content_hash
+        self._sizes[content_hash] = len(content)
+        self._contents[content_hash] = content
+
+    def _update(self, content_hashes, delta):
+        deltas = collections.defaultdict(int)
+        for content_hash in content_hashes:
+            deltas[content_hash] += delta
+        old_namespace = namespace_manager.get_namespace()
+        try:
+            namespace_manager.set_namespace(self._namespace)
+            batch = {}
+            batch_bytes = 0
+            for content_hash, delta in sorted(deltas.iteritems()):
+                size = self._sizes[content_hash] if delta > 0 else 0
+                if batch and (
+                    len(batch) >= _MAX_BLOBS_PER_TRANSACTION or
+                    batch_bytes + size > _MAX_BLOB_BYTES_PER_TRANSACTION):
+                    self._apply(batch)
+                    batch = {}
+                    batch_bytes = 0
+                batch[content_hash] = delta
+                batch_bytes += size
+            if batch:
+                self._apply(batch)
+        finally:
+            namespace_manager.set_namespace(old_namespace)
+
+    def _apply(self, deltas):
+        for counter in _update_blob_ref_counts(
+                deltas, self._sizes, self._contents):
+            counter.inc()
+
+    def add_references(self):
+        """Counts new references to blobs, creating blobs as needed."""
+        self._update(self._added.values(), 1)
+
+    def drop_references(self, filenames=None):
+        """Uncounts dropped references, deleting blobs no longer referred to.
+
+        Args:
+            filenames: iterable of the names of the files whose references
+                are dropped; all files if None.
+        """
+        if filenames is None:
+            filenames = set(self._dropped) | set(self._legacy_keys)
+        self._update([
+            self._dropped[filename] for filename in filenames
+            if filename in self._dropped], -1)
+        legacy_keys = []
+        for filename in filenames:
+            legacy_keys += self._legacy_keys.get(filename, [])
+        if legacy_keys:
+            db.delete(legacy_keys)
+
+    def recover(self, metadata_list):
+        """Settles the counts after saving metadata_list failed.
+
+        Some of the metadata may have been saved all the same, so it is read
+        back. References added for files whose metadata was not saved are
+        uncounted, and references dropped by files whose metadata was saved
+        are dropped, as if only the saved metadata had been put.
+
+        Args:
+            metadata_list: list of FileMetadataEntity whose put failed.
+        """
+        if db.is_in_transaction():
+            return  # The counts are rolled back with the metadata.
+        if not self._added and not self._dropped and not self._legacy_keys:
+            return
+        saved_list = db.get([metadata.key() for metadata in metadata_list])
+        saved_names = set()
+        for metadata, saved in zip(metadata_list, saved_list):
+            if saved and saved.content_hash == metadata.content_hash:
+                saved_names.add(metadata.key().name())
+        self._update([
+            content_hash for filename, content_hash in self._added.iteritems()
+            if filename not in saved_names], -1)
+        self.drop_references(saved_names)
+
 
 class DatastoreBackedFileSystem(object):
     """A read-write file system backed by a datastore."""
@@ -481,7 +988,9 @@ class DatastoreBackedFileSystem(object):
                     if not hasattr(self._cache, 'connection'):
                         self._cache.connection = (
                             VfsCacheConnection.new_connection(self.ns))
-                    return attr(*args, **kwargs)
+                    with counters.Tracer.span(
+                        'DatastoreBackedFileSystem.' + name):
+                        return attr(*args, **kwargs)
                 finally:
                     namespace_manager.set_namespace(old_namespace)
 
@@ -554,14 +1063,56 @@ class DatastoreBackedFileSystem(object):
 
     def open(self, afilename):
         """Gets a file from a datastore. Raw bytes stream, no encodings."""
+        return self._open(afilename)
+
+    def open_chunked(self, afilename):
+        """Gets a file from a datastore as a ChunkedFileStream.
+
+        Files stored in several shards are not read at once; a shard is
+        loaded from datastore only when the stream reaches it.
+
+        Args:
+            afilename: string. The logical name of the file.
+        Returns:
+            A ChunkedFileStream or None if there is no such file.
+        """
+        stream = self._open(afilename, chunked=True)
+        if stream is None or isinstance(stream, ChunkedFileStream):
+            return stream
+        return ChunkedFileStream.from_data(stream.metadata, stream.read())
+
+    def _make_shard_loader(self, filename, metadata):
+        """Makes a function that starts loading a shard of file data."""
+        keys = [
+            db.Key.from_path(
+                FileDataEntity.kind(), key_name, namespace=self._ns)
+            for key_name in self._get_data_key_names(filename, metadata)]
+
+        def load_shard_async(index):
+            rpc = db.get_async(keys[index])
+
+            def get_result():
+                entity = rpc.get_result()
+                return entity.data if entity else ''
+
+            return get_result
+
+        return load_shard_async
+
+    def _open(self, afilename, chunked=False):
         filename = self._logical_to_physical(afilename)
         found, stream = self.cache.get(filename)
         if found and stream:
             return stream
         if not found:
             metadata = FileMetadataEntity.get_by_key_name(filename)
+            if chunked and metadata and metadata.size > _MAX_VFS_SHARD_SIZE:
+                # Too large for the cache; read it as the stream is consumed.
+                return ChunkedFileStream(
+                    metadata, metadata.size, _MAX_VFS_SHARD_SIZE,
+                    self._make_shard_loader(filename, metadata))
             if metadata:
-                keys = self._generate_file_key_names(filename, metadata.size)
+                keys = self._get_data_key_names(filename, metadata)
                 data_shards = []
                 for data_entity in FileDataEntity.get_by_key_name(keys):
                     data_shards.append(data_entity.data)
@@ -642,6 +1193,14 @@ class DatastoreBackedFileSystem(object):
 
         return key_names
 
+    @classmethod
+    def _get_data_key_names(cls, filename, metadata):
+        """Returns key names of FileDataEntity holding content of a file."""
+        if metadata.content_hash:
+            return _get_blob_data_key_names(
+                metadata.content_hash, metadata.size)
+        return cls._generate_file_key_names(filename, metadata.size)
+
     def non_transactional_put(
         self, filename, content, is_draft=False, metadata_only=False):
         """Non-transactional put; use only when transactions are impossible."""
@@ -650,27 +1209,28 @@ class DatastoreBackedFileSystem(object):
         metadata = FileMetadataEntity.get_by_key_name(filename)
         if not metadata:
             metadata = FileMetadataEntity(key_name=filename)
+            self.cache.delete_listing()
         metadata.updated_on = datetime.datetime.utcnow()
         metadata.is_draft = is_draft
 
+        changes = _BlobChanges()
         if not metadata_only:
             # We operate with raw bytes. The consumer must deal with encoding.
-            metadata.size = len(content)
-
-            # Chunk the data into entites based on max entity size limits
-            # imposed by AppEngine
-            key_names = self._generate_file_key_names(filename, metadata.size)
-            shard_entities = []
-            for index, key_name in enumerate(key_names):
-                data = FileDataEntity(key_name=key_name)
-                start_offset = index * _MAX_VFS_SHARD_SIZE
-                end_offset = (index + 1) * _MAX_VFS_SHARD_SIZE
-                data.data = content[start_offset:end_offset]
-                shard_entities.append(data)
-
-            entities_put(shard_entities)
-
-        metadata.put()
+            # This rejects reserved file names and files that are too large.
+            self._generate_file_key_names(filename, len(content))
+
+            # Content is stored in a blob shared by all files with the same
+            # content, and is chunked into entities based on max entity size
+            # limits imposed by AppEngine.
+            changes.acquire(filename, metadata, content)
+            changes.add_references()
+
+        try:
+            metadata.put()
+        except Exception:
+            changes.recover([metadata])
+            raise
+        changes.drop_references()
         self.cache.delete(filename)
 
     def put_multi_async(self, filedata_list):
@@ -678,12 +1238,15 @@ class DatastoreBackedFileSystem(object):
 
         This method initiates an asynchronous put of a list of file data
         (presented as pairs of the form (filename, data_source)). It is not
-        transactional, and does not block, and instead immediately returns a
-        callback function. When this function is called it will block until
-        the puts are confirmed to have completed. For maximum efficiency it's
-        advisable to defer calling the callback until all other request handling
-        has completed, but in any event, it MUST be called before the request
-        handler can exit successfully.
+        transactional, and does not block on the put of file metadata, and
+        instead returns a callback function once shared content blobs are
+        stored. When this function is called it will block until the puts
+        are confirmed to have completed, and then release blobs the files no
+        longer refer to; if the puts failed, only references of the metadata
+        that was saved are kept. For maximum efficiency it's advisable to defer
+        calling the callback until all other request handling has completed,
+        but in any event, it MUST be called before the request handler can
+        exit successfully.
 
         Args:
             filedata_list: list. A list of tuples. The first entry of each
@@ -695,40 +1258,41 @@ class DatastoreBackedFileSystem(object):
             be called at some point before the request handler exists, in order
             to confirm that the puts have succeeded.
         """
-        filename_list = []
-        data_list = []
         metadata_list = []
+        changes = _BlobChanges()
 
         for filename, stream in filedata_list:
             filename = self._logical_to_physical(filename)
-            filename_list.append(filename)
 
             metadata = FileMetadataEntity.get_by_key_name(filename)
             if not metadata:
                 metadata = FileMetadataEntity(key_name=filename)
+                self.cache.delete_listing()
             metadata_list.append(metadata)
             metadata.updated_on = datetime.datetime.utcnow()
 
             # We operate with raw bytes. The consumer must deal with encoding.
             raw_bytes = stream.read()
+            self._generate_file_key_names(filename, len(raw_bytes))
 
-            metadata.size = len(raw_bytes)
-
-            data = FileDataEntity(key_name=filename)
-            data_list.append(data)
-            data.data = raw_bytes
+            # Files in the list with the same content share a single blob.
+            changes.acquire(filename, metadata, raw_bytes)
 
             # we do call delete here; so this instance will not increment EVICT
             # counter value, but the DELETE value; other instance will not
             # record DELETE, but EVICT when they query for updates
             self.cache.delete(filename)
 
-        data_future = db.put_async(data_list)
+        changes.add_references()
         metadata_future = db.put_async(metadata_list)
 
         def wait_and_finalize():
-            data_future.check_success()
-            metadata_future.check_success()
+            try:
+                metadata_future.check_success()
+            except Exception:
+                changes.recover(metadata_list)
+                raise
+            changes.drop_references()
 
         return wait_and_finalize
 
@@ -737,18 +1301,25 @@ class DatastoreBackedFileSystem(object):
         filename = self._logical_to_physical(filename)
         metadata = FileMetadataEntity.get_by_key_name(filename)
         if metadata:
+            changes = _BlobChanges()
+            changes.release(filename, metadata)
             metadata.delete()
-        data = FileDataEntity(key_name=filename)
-        if data:
-            data.delete()
+            changes.drop_references()
         self.cache.delete(filename)
+        self.cache.delete_listing()
 
     def isfile(self, afilename):
         """Checks file existence by looking up the datastore row."""
         filename = self._logical_to_physical(afilename)
-        metadata = FileMetadataEntity.get_by_key_name(filename)
-        if metadata:
+        found, stream = self.cache.get(filename)
+        if found and stream:
             return True
+        if not found:
+            metadata = FileMetadataEntity.get_by_key_name(filename)
+            if metadata:
+                return True
+            VfsCacheConnection.CACHE_NO_METADATA.inc()
+            self.cache.put(filename, None, None)
         result = False
         if self._inherits_from and self._can_inherit(filename):
             result = self._inherits_from.isfile(afilename)
@@ -768,9 +1339,12 @@ class DatastoreBackedFileSystem(object):
         """
         dir_name = self._logical_to_physical(dir_name)
         result = set()
-        keys = FileMetadataEntity.all(keys_only=True)
-        for key in keys.fetch(1000):
-            filename = key.name()
+        filenames = self.cache.get_listing()
+        if filenames is None:
+            keys = FileMetadataEntity.all(keys_only=True)
+            filenames = [key.name() for key in keys.fetch(_MAX_VFS_LIST_SIZE)]
+            self.cache.put_listing(filenames)
+        for filename in filenames:
             if filename.startswith(dir_name):
                 result.add(self._physical_to_logical(filename))
         if include_inherited and self._inherits_from:
@@ -781,9 +1355,14 @@ class DatastoreBackedFileSystem(object):
                     include_inherited)))
         return sorted(list(result))
 
+    def get_cache_entry(self, afilename):
+        """Returns (found, entry) for a file in the in-process VFS cache."""
+        return self.cache.get_entry(self._logical_to_physical(afilename))
+
     def get_jinja_environ(self, dir_names, autoescape=True):
-        return jinja_utils.create_jinja_environment(
-            loader=VirtualFileSystemTemplateLoader(
+        return jinja_utils.get_jinja_environment(
+            ('vfs', id(self), self._logical_home_folder) + tuple(dir_names),
+            lambda: VirtualFileSystemTemplateLoader(
                 self, self._logical_home_folder, dir_names),
             autoescape=autoescape)
 
@@ -949,6 +1528,56 @@ class VfsTests(unittest.TestCase):
         self.assertFalse(found)
         self.assertEquals(stream, None)
 
+    def _setup_cache_with_listing(self):
+        ProcessScopedVfsCache.clear_all()
+        conn = VfsCacheConnection('ns_test')
+        self.assertIsNone(conn.get_listing())
+        conn.put_listing(['/a.txt', '/b/c.txt'])
+        self.assertEquals(
+            frozenset(['/a.txt', '/b/c.txt']), conn.get_listing())
+        return conn
+
+    def test_updates_of_listed_files_dont_evict_listing(self):
+        conn = self._setup_cache_with_listing()
+        conn.apply_updates({'/a.txt': FileMetadataEntity()})
+        self.assertIsNotNone(conn.get_listing())
+
+    def test_updates_of_new_files_evict_listing(self):
+        conn = self._setup_cache_with_listing()
+        old_evict_count = VfsCacheConnection.CACHE_LISTING_EVICT.value
+        conn.apply_updates({'/d.txt': FileMetadataEntity()})
+        self.assertIsNone(conn.get_listing())
+        self.assertEquals(
+            VfsCacheConnection.CACHE_LISTING_EVICT.value - old_evict_count, 1)
+
+    def test_listing_expires(self):
+        conn = self._setup_cache_with_listing()
+        entry = conn.cache.items.get(
+            conn.make_key('ns_test', VfsCacheConnection.LISTING_KEY))
+        entry.created_on = datetime.datetime.utcnow() - datetime.timedelta(
+            0, CacheListingEntry.CACHE_ENTRY_TTL_SEC + 1)
+        self.assertIsNone(conn.get_listing())
+
+    def test_stats_are_kept_per_namespace(self):
+        ProcessScopedVfsCache.clear_all()
+        conn = VfsCacheConnection('ns_test')
+        other_conn = VfsCacheConnection('ns_other')
+        conn.put('missing.txt', None, None)
+        conn.get('missing.txt')
+        conn.get('unknown.txt')
+        conn.get_listing()
+        other_conn.put_listing([])
+        other_conn.get_listing()
+        self.assertEquals({
+            'ns_test': {'hit-none': 1, 'miss': 1, 'listing-miss': 1},
+            'ns_other': {'listing-hit': 1}},
+            ProcessScopedVfsCache.get_namespace_stats())
+
+    def test_noop_connection_caches_nothing(self):
+        conn = NoopVfsCacheConnection()
+        conn.put_listing(['/a.txt'])
+        self.assertIsNone(conn.get_listing())
+
 
 def run_all_unit_tests():
     """Runs all unit tests in this module."""
@@ -249,6 +249,7 @@ class BaseAdminHandler(ConfigPropertyEditor):
         bind('courses', 'Courses', cls.get_courses)
         bind('settings', 'Site Settings', cls.get_settings)
         bind('perf', 'Metrics', cls.get_perf)
+        bind('traces', 'Request Traces', cls.get_traces)
         bind('deployment', 'Deployment', cls.get_deployment)
 
         if DIRECT_CODE_EXECUTION_UI_ENABLED:
@@ -385,6 +386,33 @@ class BaseAdminHandler(ConfigPropertyEditor):
             perf_counters, 'In-process Performance Counters (local/global)')
         self.render_page(template_values)
 
+    def get_traces(self):
+        """Shows recent traces of requests kept by this instance."""
+        template_values = {}
+        template_values['page_title'] = self.format_title('Request Traces')
+        template_values['page_description'] = messages.TRACES_DESCRIPTION
+
+        content = safe_dom.NodeList()
+        content.append(self.render_dict({
+            sites.TRACE_SAMPLE_EVERY_N_REQUESTS.name: (
+                sites.TRACE_SAMPLE_EVERY_N_REQUESTS),
+            sites.SLOW_REQUEST_LOG_THRESHOLD_MSEC.name: (
+                sites.SLOW_REQUEST_LOG_THRESHOLD_MSEC)}, 'Settings'))
+
+        traces = counters.Tracer.get_recent()
+        content.append(safe_dom.Element('h3').add_text(
+            'Recent Traces (%s)' % len(traces)))
+        for trace in traces:
+            started = datetime.datetime.utcfromtimestamp(
+                trace.root.start_time).strftime('%Y-%m-%d %H:%M:%S UTC')
+            content.append(safe_dom.Element('h4').add_text(
+                '%s at %s: %.0f ms' % (
+                    trace.name, started, trace.duration_msec)))
+            content.append(safe_dom.Element('pre').add_text(trace.to_text()))
+
+        template_values['main_content'] = content
+        self.render_page(template_values)
+
     def _make_routes_dom(self, parent_element, routes, caption):
         """Renders routes as DOM."""
         if routes:
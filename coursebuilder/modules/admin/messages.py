@@ -40,5 +40,11 @@ before uploading it to Google App Engine.
 METRICS_DESCRIPTION = assemble_sanitized_message(
     None, 'https://code.google.com/p/course-builder/wiki/AdminPage')
 
+TRACES_DESCRIPTION = assemble_sanitized_message("""
+Recent traces of requests served by this application instance: sampled
+requests and requests slower than the slow request threshold. Sibling steps
+with the same name are shown on one line with their count and total time.
+""", None)
+
 SETTINGS_DESCRIPTION = assemble_sanitized_message(
     None, 'https://code.google.com/p/course-builder/wiki/AdminPage')
@@ -181,6 +181,19 @@ class AnswersAggregator(student_aggregate.AbstractStudentAggregationComponent):
                     assessment['min_score'] = min_score
         return {'assessments': assessments}
 
+    @classmethod
+    def merge_aggregate(cls, course, student, static_params, previous,
+                        event_items):
+        # Scores are recomputed over all submissions, so only the
+        # submissions themselves are kept from the earlier aggregate.
+        items = [{
+            'unit_id': assessment['unit_id'],
+            'lesson_id': assessment.get('lesson_id'),
+            'submissions': assessment['submissions'],
+            } for assessment in previous.get('assessments', [])]
+        return cls.produce_aggregate(
+            course, student, static_params, items + event_items)
+
     @classmethod
     def get_schema(cls):
         answer = schema_fields.FieldRegistry('answer')
@@ -42,6 +42,15 @@ from modules.dashboard import dto_editor
 
 from google.appengine.ext import db
 
+try:
+    import numpy
+except ImportError:
+    # numpy is provided by the App Engine runtime (see app.yaml); elsewhere
+    # the cluster distances are computed in pure Python.
+    if appengine_config.PRODUCTION_MODE:
+        raise
+    numpy = None
+
 
 DIM_TYPE_UNIT = 'u'
 DIM_TYPE_LESSON = 'l'
@@ -770,7 +779,159 @@ class StudentVectorGenerator(jobs.MapReduceJob):
         return 0
 
 
-def hamming_distance(vector, student_vector):
+def encode_cluster_ranges(clusters):
+    """Encodes the ranges of ClusterEntities against a shared dimension index.
+
+    Every distinct (type, id) pair found in the clusters gets one position in
+    the dimension index, so a StudentVector can be looked up once and then
+    compared against all clusters. Only the bounded dimensions of a cluster
+    are kept: a dimension without sides contains every value.
+
+    Params:
+        clusters: a list of dictionaries with the keys 'id' and 'vector',
+            where the vector is the vector field of a ClusterEntity.
+
+    Returns:
+        A dictionary that can be passed as a mapper parameter:
+            'dimensions': a list of [type, id] pairs, the dimension index.
+            'cluster_ids': the ids of the clusters in the original order.
+            'ranges': for each cluster a list of [index, low, high], where
+                index is the position of the dimension in 'dimensions' and
+                low or high are None if that side of the range is open.
+    """
+    dimension_index = {}
+    dimensions = []
+    ranges = []
+    for cluster in clusters:
+        cluster_ranges = []
+        for dim in cluster['vector']:
+            has_low = _has_left_side(dim)
+            has_high = _has_right_side(dim)
+            if not (has_low or has_high):
+                continue
+            key = (dim[DIM_TYPE], str(dim[DIM_ID]))
+            index = dimension_index.get(key)
+            if index is None:
+                index = len(dimensions)
+                dimension_index[key] = index
+                dimensions.append(list(key))
+            cluster_ranges.append([
+                index,
+                dim[DIM_LOW] if has_low else None,
+                dim[DIM_HIGH] if has_high else None])
+        ranges.append(cluster_ranges)
+    return {
+        'dimensions': dimensions,
+        'cluster_ids': [cluster['id'] for cluster in clusters],
+        'ranges': ranges,
+    }
+
+
+def encode_student_vector(dimensions, student_vector):
+    """Returns the values of a StudentVector in the order of dimensions.
+
+    The student vector is scanned only once. As in
+    StudentVector.get_dimension_value, the first matching dimension wins and
+    missing or empty values are taken as 0.
+
+    Params:
+        dimensions: the list of [type, id] pairs of encode_cluster_ranges.
+        student_vector: the vector field of a StudentVector instance.
+    """
+    values = {}
+    for dim in student_vector:
+        values.setdefault((dim[DIM_TYPE], str(dim[DIM_ID])), dim[DIM_VALUE])
+    return [values.get((type_, id_)) or 0 for type_, id_ in dimensions]
+
+
+def _range_distance(cluster_ranges, values, max_distance=None):
+    """Counts the values outside of the ranges, stops after max_distance."""
+    distance = 0
+    for index, low, high in cluster_ranges:
+        value = values[index]
+        if ((low is not None and low > value) or
+            (high is not None and high < value)):
+            distance += 1
+            if max_distance is not None and distance > max_distance:
+                break
+    return distance
+
+
+class _ClusterRangeArrays(object):
+    """The ranges of encode_cluster_ranges as flat numpy arrays.
+
+    Every bounded dimension of every cluster is one row: the row of the
+    cluster, the position of the dimension and the low and high limits, with
+    -inf or inf for an open side.
+    """
+
+    _cached = None
+
+    def __init__(self, encoded_clusters):
+        self.encoded_clusters = encoded_clusters
+        rows = [(row, index,
+                 -numpy.inf if low is None else low,
+                 numpy.inf if high is None else high)
+                for row, cluster_ranges in enumerate(encoded_clusters['ranges'])
+                for index, low, high in cluster_ranges]
+        self.num_clusters = len(encoded_clusters['ranges'])
+        self.cluster_rows = numpy.array(
+            [row[0] for row in rows], dtype=numpy.intp)
+        self.indexes = numpy.array([row[1] for row in rows], dtype=numpy.intp)
+        self.low = numpy.array([row[2] for row in rows], dtype=float)
+        self.high = numpy.array([row[3] for row in rows], dtype=float)
+
+    @classmethod
+    def get(cls, encoded_clusters):
+        """Returns the arrays, built once for the same mapper parameters."""
+        if (cls._cached is None or
+            cls._cached.encoded_clusters is not encoded_clusters):
+            cls._cached = cls(encoded_clusters)
+        return cls._cached
+
+    def distances(self, values):
+        """Returns the distance to every cluster, in the order of clusters."""
+        if not len(self.cluster_rows):
+            return numpy.zeros(self.num_clusters, dtype=int)
+        values = numpy.array(values, dtype=float)[self.indexes]
+        outside = (self.low > values) | (self.high < values)
+        # Weighting every row keeps bincount away from empty input, which
+        # older versions of numpy reject.
+        return numpy.bincount(
+            self.cluster_rows, weights=outside.astype(float),
+            minlength=self.num_clusters)
+
+
+def cluster_distances(encoded_clusters, values, max_distance):
+    """Returns the distances from one student to all the encoded clusters.
+
+    When numpy is available all the distances are computed at once, otherwise
+    each cluster stops being checked once it is further than max_distance.
+
+    Params:
+        encoded_clusters: the output of encode_cluster_ranges.
+        values: the output of encode_student_vector for the same dimensions.
+        max_distance: clusters further than this distance are discarded.
+
+    Returns:
+        A list of (cluster_id, distance) for the clusters with a distance not
+        greater than max_distance, in the order of the clusters.
+    """
+    if numpy is not None:
+        distances = _ClusterRangeArrays.get(encoded_clusters).distances(values)
+        return [(cluster_id, int(distance)) for cluster_id, distance in zip(
+                    encoded_clusters['cluster_ids'], distances)
+                if distance <= max_distance]
+    result = []
+    for cluster_id, cluster_ranges in zip(
+            encoded_clusters['cluster_ids'], encoded_clusters['ranges']):
+        distance = _range_distance(cluster_ranges, values, max_distance)
+        if distance <= max_distance:
+            result.append((cluster_id, distance))
+    return result
+
+
+def hamming_distance(vector, student_vector, max_distance=None):
     """Return the hamming distance between a ClusterEntity and a StudentVector.
 
     The hamming distance between an ClusterEntity and a StudentVector is the
@@ -782,27 +943,12 @@ def hamming_distance(vector, student_vector):
     Params:
         vector: the vector field of a ClusterEntity instance.
         student_vector: the vector field of a StudentVector instance.
+        max_distance: if given, the calculation stops once the distance is
+            greater than this value and max_distance + 1 is returned.
     """
-    # TODO(milit): As we are discarding all distances greater than
-    # ClusteringGenerator.MAX_DISTANCE, add it as a parameter so we stop
-    # calculating the distance once this limit is reached.
-    def fits_left_side(dim, value):
-        """_has_left_side(dim) -> dim[DIM_LOW] <= value"""
-        return not _has_left_side(dim) or dim[DIM_LOW] <= value
-
-    def fits_right_side(dim, value):
-        """_has_right_side(dim) -> dim[DIM_HIGH] >= value"""
-        return not _has_right_side(dim) or dim[DIM_HIGH] >= value
-
-    distance = 0
-    for dim in vector:
-        value = StudentVector.get_dimension_value(student_vector,
-                                                  dim[DIM_ID], dim[DIM_TYPE])
-        if not value:
-            value = 0
-        if not fits_left_side(dim, value) or not fits_right_side(dim, value):
-            distance += 1
-    return distance
+    encoded = encode_cluster_ranges([{'id': None, 'vector': vector}])
+    values = encode_student_vector(encoded['dimensions'], student_vector)
+    return _range_distance(encoded['ranges'][0], values, max_distance)
 
 
 class ClusteringGenerator(jobs.MapReduceJob):
@@ -836,7 +982,7 @@ class ClusteringGenerator(jobs.MapReduceJob):
         clusters = [{'id': cluster.id, 'vector': cluster.vector}
                     for cluster in ClusterDAO.get_all()]
         return {
-            'clusters': clusters,
+            'clusters': encode_cluster_ranges(clusters),
             'max_distance': getattr(self, 'MAX_DISTANCE', 2)
         }
 
@@ -850,7 +996,8 @@ class ClusteringGenerator(jobs.MapReduceJob):
         Yields:
             Pairs (key, value). There are two types of keys:
                 1.  A cluster id: the value is a tuple (student_id, distance).
-                2.  A pair of clusters ids: the value is a 3-uple
+                2.  A pair of clusters ids joined by ':', as in '1:2': the
+                    value is a 3-uple
                     (student_id, distance1, distance2)
                     distance1 is the distance from the student vector to the
                     cluster with the first id of the tuple and distance2 is
@@ -863,21 +1010,20 @@ class ClusteringGenerator(jobs.MapReduceJob):
         student = StudentVector.get_by_key_name(item.user_id)
         if student:
             mapper_params = context.get().mapreduce_spec.mapper.params
-            max_distance = mapper_params['max_distance']
-            clusters = {}
-            item_vector = transforms.loads(student.vector)
-            for cluster in mapper_params['clusters']:
-                distance = hamming_distance(cluster['vector'], item_vector)
-                if distance > max_distance:
-                    continue
-                for cluster2_id, distance2 in clusters.items():
-                    key = transforms.dumps((cluster2_id, cluster['id']))
-                    value = (item.user_id, distance, distance2)
-                    yield (key, transforms.dumps(value))
-                clusters[cluster['id']] = distance
-                to_yield = (item.user_id, distance)
-                yield(cluster['id'], transforms.dumps(to_yield))
-            clusters = transforms.dumps(clusters)
+            encoded_clusters = mapper_params['clusters']
+            values = encode_student_vector(
+                encoded_clusters['dimensions'],
+                transforms.loads(student.vector))
+            distances = cluster_distances(
+                encoded_clusters, values, mapper_params['max_distance'])
+            # The values are JSON lists; the user id is encoded only once.
+            user_id = transforms.dumps(item.user_id)
+            for index, (cluster_id, distance) in enumerate(distances):
+                for cluster2_id, distance2 in distances[:index]:
+                    key = '%s:%s' % (cluster2_id, cluster_id)
+                    yield (key, '[%s, %d, %d]' % (user_id, distance, distance2))
+                yield (cluster_id, '[%s, %d]' % (user_id, distance))
+            clusters = transforms.dumps(dict(distances))
             StudentClusters(key_name=item.user_id, clusters=clusters).put()
         yield ('student_count', 1)
 
@@ -906,10 +1052,11 @@ class ClusteringGenerator(jobs.MapReduceJob):
     @staticmethod
     def reduce(item_id, values):
         """
-        This function can take two types of item_id (as json string).
-            A number: the values are 2-uples (student_id, distance) and is
-            used to calculate a count statistic.
-            A list: the item_id holds the IDs of two clusters and the value
+        This function can take three types of item_id.
+            A number (as json string): the values are 2-uples (student_id,
+            distance) and is used to calculate a count statistic.
+            Two ids joined by ':': the item_id holds the IDs of two
+            clusters and the value
             corresponds to 3-uple (student_id, distance1, distance2). The
             value is used to calculate an intersection stats.
             A string 'student_count': The values is going to be a list of
@@ -929,7 +1076,11 @@ class ClusteringGenerator(jobs.MapReduceJob):
         if item_id == 'student_count':
             yield (item_id, sum(int(value) for value in values))
         else:
-            item_id = transforms.loads(item_id)
+            if ':' in item_id:
+                item_id = [transforms.loads(cluster_id)
+                           for cluster_id in item_id.split(':')]
+            else:
+                item_id = transforms.loads(item_id)
             distances = collections.defaultdict(lambda: 0)
             if isinstance(item_id, list):
                 stat_name = 'intersection'
@@ -47,15 +47,27 @@ class LocationAggregator(student_aggregate.AbstractStudentAggregationComponent):
 
     @classmethod
     def produce_aggregate(cls, course, student, static_params, event_items):
+        return cls.merge_aggregate(
+            course, student, static_params, {}, event_items)
+
+    @classmethod
+    def merge_aggregate(cls, course, student, static_params, previous,
+                        event_items):
         locations = collections.defaultdict(int)
+        for item in previous.get('location_frequencies', []):
+            location = tuple(item.get(name) or None
+                             for name in ('country', 'region', 'city'))
+            locations[location] += item['count']
         for location in event_items:
-            locations[tuple(location)] += 1
+            locations[tuple(x or None for x in location)] += 1
+        total = sum(locations.itervalues())
 
         ret = []
         for location, count in locations.iteritems():
             country, region, city = location
             item = {
-                'frequency': float(count) / len(event_items),
+                'frequency': float(count) / total,
+                'count': count,
                 }
             if country:
                 item['country'] = country
@@ -91,6 +103,10 @@ class LocationAggregator(student_aggregate.AbstractStudentAggregationComponent):
             'location in responses from this user.  The sum of all the '
             'frequency values should add up to 1.0.  The most-frequent '
             'location is listed first in the array.'))
+        location_frequency.add_property(schema_fields.SchemaField(
+            'count', 'Count', 'integer', optional=True,
+            description='The number of responses from this user that '
+            'were from this location.'))
         return schema_fields.FieldArray(
           'location_frequencies', 'Location Frequencies',
           item_type=location_frequency,
@@ -125,15 +141,25 @@ class LocaleAggregator(student_aggregate.AbstractStudentAggregationComponent):
 
     @classmethod
     def produce_aggregate(cls, course, student, static_params, event_items):
+        return cls.merge_aggregate(
+            course, student, static_params, {}, event_items)
+
+    @classmethod
+    def merge_aggregate(cls, course, student, static_params, previous,
+                        event_items):
         locales = collections.defaultdict(int)
+        for item in previous.get('locale_frequencies', []):
+            locales[item['locale']] += item['count']
         for locale in event_items:
             locales[locale] += 1
+        total = sum(locales.itervalues())
 
         ret = []
         for locale, count in locales.iteritems():
             ret.append({
                 'locale': locale,
-                'frequency': float(count) / len(event_items)
+                'frequency': float(count) / total,
+                'count': count,
                 })
         return {'locale_frequencies': ret}
 
@@ -156,6 +182,10 @@ class LocaleAggregator(student_aggregate.AbstractStudentAggregationComponent):
             'locale in responses from this user.  The sum of all the '
             'frequency values should add up to 1.0.  The most-frequent '
             'locale is listed first in the array.'))
+        locale_frequency.add_property(schema_fields.SchemaField(
+            'count', 'Count', 'integer', optional=True,
+            description='The number of responses from this user that '
+            'were in this locale.'))
         return schema_fields.FieldArray(
             'locale_frequencies', 'Locale Frequencies',
             item_type=locale_frequency,
@@ -266,6 +266,19 @@ class PageEventAggregator(
         page_views.sort(key=lambda v: v['start'])
         return {'page_views': page_views}
 
+    @classmethod
+    def merge_aggregate(cls, course, student, static_value, previous,
+                        event_items):
+        # Page views are regrouped over all activities, since new events may
+        # close a view that was still open in the earlier aggregate.
+        sub_list = []
+        for view in previous.get('page_views', []):
+            for activity in view['activities']:
+                sub_list.append([view['name'], view.get('item_id'),
+                                 activity['timestamp'], activity['action']])
+        return cls.produce_aggregate(
+            course, student, static_value, [sub_list] + event_items)
+
     @classmethod
     def get_schema(cls):
         activity = schema_fields.FieldRegistry('activity')
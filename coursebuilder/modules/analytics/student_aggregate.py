@@ -17,6 +17,7 @@
 __author__ = ['Michael Gainer (mgainer@google.com)']
 
 import collections
+import datetime
 import logging
 import zlib
 
@@ -25,6 +26,7 @@ from mapreduce import context
 from common import schema_fields
 from common import utils as common_utils
 from controllers import sites
+from models import config
 from models import courses
 from models import data_sources
 from models import entities
@@ -35,6 +37,27 @@ from models import transforms
 from google.appengine.api import datastore_types
 from google.appengine.ext import db
 
+UNIX_EPOCH = datetime.datetime(year=1970, month=1, day=1)
+
+CAN_AGGREGATE_INCREMENTALLY = config.ConfigProperty(
+    'gcb_can_aggregate_student_events_incrementally', bool, (
+        'Whether or not the student aggregate job only processes events '
+        'recorded since its last successful run and merges them into the '
+        'existing aggregates.  This is used only if every registered '
+        'aggregation component supports merging; otherwise all events are '
+        'processed on each run.'), default_value=False)
+
+EVENT_WRITE_LAG_SECS = config.ConfigProperty(
+    'gcb_student_aggregate_event_write_lag_secs', int, (
+        'When the student aggregate job runs incrementally, it only '
+        'aggregates events recorded more than this many seconds before it '
+        'started; later events are left to the next run.  Events are stamped '
+        'when they are received, but may be written to the datastore later, '
+        'e.g. when a failed write is retried from the task queue.  An event '
+        'written later than this after it was recorded is not aggregated '
+        'incrementally.'), default_value=60 * 60)
+
+
 class AbstractStudentAggregationComponent(object):
     """Allows modules to contribute to map/reduce on EventEntity by Student.
 
@@ -132,6 +155,31 @@ class AbstractStudentAggregationComponent(object):
         """
         raise NotImplementedError()
 
+    # pylint: disable=unused-argument
+    def merge_aggregate(self, course, student, static_params, previous,
+                        event_items):
+        """Fold items from new events into an earlier aggregate.
+
+        Optional.  When the aggregate job runs incrementally, it maps only
+        the events recorded since its last successful run.  For a Student
+        that already has an aggregate, this function is then called instead
+        of produce_aggregate() with the items produced by process_event()
+        for the new events only.  Incremental runs are done only if every
+        registered component implements this function.
+
+        Args:
+          course: The Course in which the student and the events are found.
+          student: the Student for which the events occurred.
+          static_params: the value from build_static_params(), if any.
+          previous: the dict this component produced for the Student in
+              an earlier run.
+          event_items: a list of the items produced by process_event()
+              for events recorded since that run.
+        Returns:
+          A dict corresponding to the declared schema.
+        """
+        raise NotImplementedError()
+
     def get_schema(self):
         """Provide the partial schema for results produced.
 
@@ -154,12 +202,47 @@ class StudentAggregateEntity(entities.BaseEntity):
     to provide the aggregated student data as a feed to the data pump."""
 
     data = db.BlobProperty()
+    # Events recorded up to this time, in microseconds since the epoch, are
+    # included in data.  See StudentAggregateWatermarkEntity.
+    recorded_on_usec = db.IntegerProperty(indexed=False)
 
     @classmethod
     def safe_key(cls, db_key, transform_fn):
         return db.Key.from_path(cls.kind(), transform_fn(db_key.id_or_name()))
 
 
+class StudentAggregateWatermarkEntity(entities.BaseEntity):
+    """Records which events the student aggregates have been built from.
+
+    Times are in microseconds since the epoch, compared with
+    EventEntity.recorded_on.  Each run of StudentAggregateGenerator maps the
+    events recorded after the committed watermark, if it runs incrementally,
+    and up to its own start time, less EVENT_WRITE_LAG_SECS if it runs
+    incrementally, which becomes the pending watermark.  The
+    pending watermark is committed by the next run if the job with
+    pending_sequence_num completed successfully.  There is one instance per
+    course, keyed by KEY_NAME.
+    """
+
+    KEY_NAME = 'student_aggregate'
+
+    committed_usec = db.IntegerProperty(indexed=False)
+    pending_usec = db.IntegerProperty(indexed=False)
+    pending_sequence_num = db.IntegerProperty(indexed=False)
+
+
+def _to_usec(timestamp):
+    delta = timestamp - UNIX_EPOCH
+    return (delta.days * 24 * 3600 + delta.seconds) * 1000000 + (
+        delta.microseconds)
+
+
+def _can_merge(component):
+    merge_aggregate = getattr(component.merge_aggregate, '__func__', None)
+    return merge_aggregate is not (
+        AbstractStudentAggregationComponent.merge_aggregate.__func__)
+
+
 class StudentAggregateGenerator(jobs.MapReduceJob):
     """M/R job to aggregate data by student using registered plug-ins.
 
@@ -169,8 +252,18 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
     insulated from one another, and are permitted to fail individually without
     compromising the results contributed for a Student by other plugins.
 
+    If CAN_AGGREGATE_INCREMENTALLY is set, the job only aggregates events
+    recorded since its last successful run, and merges them into existing
+    aggregates; see StudentAggregateWatermarkEntity.  Students without new
+    events keep their aggregates as they are.  Events recorded within
+    EVENT_WRITE_LAG_SECS of the start of a run are left to the next run.
+
+    Mapped values are lists of (component name, recorded_on, JSON-encoded
+    item) tuples.  Values for the same Student are concatenated by combine().
     """
 
+    INTERMEDIATE_VALUE_CODEC = jobs.MarshalValueCodec
+
     @staticmethod
     def get_description():
         return 'student_aggregate'
@@ -179,13 +272,43 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
     def entity_class():
         return models.EventEntity
 
+    def _get_committed_watermark(self):
+        """Returns the watermark of the last successful run, if any."""
+        watermark = StudentAggregateWatermarkEntity.get_by_key_name(
+            StudentAggregateWatermarkEntity.KEY_NAME)
+        if not watermark:
+            return None
+        job = self.load()
+        if (job and job.status_code == jobs.STATUS_CODE_COMPLETED and
+            job.sequence_num == watermark.pending_sequence_num):
+            return watermark.pending_usec
+        return watermark.committed_usec
+
+    def _is_incremental(self):
+        return CAN_AGGREGATE_INCREMENTALLY.value and all(
+            _can_merge(component) for component in
+            StudentAggregateComponentRegistry.get_components())
+
     def build_additional_mapper_params(self, app_context):
         schemas = {}
         schema_names = {}
+        committed_usec = self._get_committed_watermark()
+        is_incremental = self._is_incremental()
+        max_usec = _to_usec(datetime.datetime.utcnow())
+        if is_incremental:
+            # Leave events that may still be being written to the next run;
+            # the next run starts where this one ends.
+            max_usec -= EVENT_WRITE_LAG_SECS.value * 1000000
+            if committed_usec is not None:
+                max_usec = max(max_usec, committed_usec)
         ret = {
             'course_namespace': app_context.get_namespace_name(),
             'schemas': schemas,
             'schema_names': schema_names,
+            'committed_usec': committed_usec,
+            'min_recorded_on_usec': (
+                committed_usec if is_incremental else None),
+            'max_recorded_on_usec': max_usec,
             }
         for component in StudentAggregateComponentRegistry.get_components():
             component_name = component.get_name()
@@ -201,12 +324,29 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
             schemas[component_name] = schema.get_json_schema_dict()
         return ret
 
+    def non_transactional_submit(self):
+        sequence_num = super(
+            StudentAggregateGenerator, self).non_transactional_submit()
+        if sequence_num >= 0:
+            StudentAggregateWatermarkEntity(
+                key_name=StudentAggregateWatermarkEntity.KEY_NAME,
+                committed_usec=self.mapper_params['committed_usec'],
+                pending_usec=self.mapper_params['max_recorded_on_usec'],
+                pending_sequence_num=sequence_num).put()
+        return sequence_num
+
     @staticmethod
     def map(event):
+        params = context.get().mapreduce_spec.mapper.params
+        recorded_on_usec = _to_usec(event.recorded_on)
+        min_usec = params.get('min_recorded_on_usec')
+        if recorded_on_usec > params['max_recorded_on_usec'] or (
+            min_usec is not None and recorded_on_usec <= min_usec):
+            return
+        items = []
         for component in (StudentAggregateComponentRegistry.
                           get_components_for_event_source(event.source)):
             component_name = component.get_name()
-            params = context.get().mapreduce_spec.mapper.params
             static_data = params.get(component_name)
             value = None
             try:
@@ -218,8 +358,19 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
                                  'component handler %s failed: %s',
                                  component_name, str(ex))
             if value:
-                value_str = '%s:%s' % (component_name, transforms.dumps(value))
-                yield event.user_id, value_str
+                items.append((component_name, recorded_on_usec,
+                              transforms.dumps(value)))
+        if items:
+            yield event.user_id, items
+
+    @staticmethod
+    def combine(unused_key, values, previously_combined_outputs=None):
+        items = []
+        for value in values:
+            items += value
+        for value in previously_combined_outputs or []:
+            items += value
+        yield items
 
     @staticmethod
     def reduce(user_id, values):
@@ -242,24 +393,47 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
         app_context = sites.get_course_index().get_app_context_for_namespace(ns)
         course = courses.Course(None, app_context=app_context)
 
+        # When only new events were mapped, they are merged into the earlier
+        # aggregate.  Events it already includes, e.g. because a run failed
+        # after writing it, are skipped.
+        previous_aggregate = {}
+        min_usec = params.get('min_recorded_on_usec')
+        if min_usec is not None:
+            previous = StudentAggregateEntity.get_by_key_name(user_id)
+            if previous:
+                previous_aggregate = transforms.loads(
+                    zlib.decompress(previous.data))
+                min_usec = max(min_usec, previous.recorded_on_usec or 0)
+
         # Bundle items together into lists by collection name
         event_items = collections.defaultdict(list)
         for value in values:
-            component_name, payload = value.split(':', 1)
-            event_items[component_name].append(transforms.loads(payload))
+            for component_name, recorded_on_usec, payload in value:
+                if min_usec is None or recorded_on_usec > min_usec:
+                    event_items[component_name].append(
+                        transforms.loads(payload))
+
+        # Components that fail below keep their earlier values, if any.
+        aggregate = dict(previous_aggregate)
 
         # Build up per-Student aggregate by calling each component.  Note that
         # we call each component whether or not its mapper produced any
         # output.
-        aggregate = {}
         for component in StudentAggregateComponentRegistry.get_components():
             component_name = component.get_name()
             static_value = params.get(component_name)
+            schema_name = params['schema_names'][component_name]
             value = {}
             try:
-                value = component.produce_aggregate(
-                    course, student, static_value,
-                    event_items.get(component_name, []))
+                if schema_name in previous_aggregate:
+                    value = component.merge_aggregate(
+                        course, student, static_value,
+                        {schema_name: previous_aggregate[schema_name]},
+                        event_items.get(component_name, []))
+                else:
+                    value = component.produce_aggregate(
+                        course, student, static_value,
+                        event_items.get(component_name, []))
                 if not value:
                     continue
             # pylint: disable=broad-except
@@ -270,7 +444,6 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
                                  component_name, str(ex))
                 continue
 
-            schema_name = params['schema_names'][component_name]
             if schema_name not in value:
                 logging.critical(
                     'Student aggregation reduce handler %s produced '
@@ -306,7 +479,9 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
                 'Aggregated compressed student data is over %d bytes; '
                 'cannot store this in one field; ignoring this record!')
         else:
-            StudentAggregateEntity(key_name=user_id, data=data).put()
+            StudentAggregateEntity(
+                key_name=user_id, data=data,
+                recorded_on_usec=params['max_recorded_on_usec']).put()
 
 
 class StudentAggregateComponentRegistry(
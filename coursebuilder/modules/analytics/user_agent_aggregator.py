@@ -45,15 +45,25 @@ class UserAgentAggregator(
 
     @classmethod
     def produce_aggregate(cls, course, student, static_params, event_items):
+        return cls.merge_aggregate(
+            course, student, static_params, {}, event_items)
+
+    @classmethod
+    def merge_aggregate(cls, course, student, static_params, previous,
+                        event_items):
         user_agents = collections.defaultdict(int)
+        for item in previous.get('user_agent_frequencies', []):
+            user_agents[item['user_agent']] += item['count']
         for user_agent in event_items:
             user_agents[user_agent] += 1
+        total = sum(user_agents.itervalues())
 
         ret = []
         for user_agent, count in user_agents.iteritems():
             ret.append({
                 'user_agent': user_agent,
-                'frequency': float(count) / len(event_items),
+                'frequency': float(count) / total,
+                'count': count,
                 })
         return {'user_agent_frequencies': ret}
 
@@ -71,6 +81,10 @@ class UserAgentAggregator(
             'user_agent in responses from this user.  The sum of all the '
             'frequency values should add up to 1.0.  The most-frequent '
             'user_agent is listed first in the array.'))
+        user_agent_frequency.add_property(schema_fields.SchemaField(
+            'count', 'Count', 'integer', optional=True,
+            description='The number of responses from this user that '
+            'reported this User-Agent.'))
         return schema_fields.FieldArray(
           'user_agent_frequencies', 'User Agent Frequencies',
           item_type=user_agent_frequency,
@@ -33,6 +33,8 @@ ACTION_ID_TO_NAME = {
     3: 'buffering',
     5: 'video cued'
 }
+ACTION_NAME_TO_ID = {
+    name: action_id for action_id, name in ACTION_ID_TO_NAME.iteritems()}
 
 
 class YouTubeEventAggregator(
@@ -97,6 +99,20 @@ class YouTubeEventAggregator(
 
         return {'youtube': youtube_interactions}
 
+    @classmethod
+    def merge_aggregate(cls, course, student, static_params, previous,
+                        event_items):
+        # Interactions are regrouped over all events, since new events may
+        # continue the last interaction in the earlier aggregate.
+        items = []
+        for interaction in previous.get('youtube', []):
+            for event in interaction['events']:
+                action = ACTION_NAME_TO_ID.get(event['action'], event['action'])
+                items.append((interaction['video_id'], event['position'],
+                              action, event['timestamp']))
+        return cls.produce_aggregate(
+            course, student, static_params, items + event_items)
+
     @classmethod
     def get_schema(cls):
         youtube_event = schema_fields.FieldRegistry('event')
@@ -446,6 +446,11 @@ class CertificateAggregator(
                           unused_event_items):
         return {'earned_certificate': student_is_qualified(student, course)}
 
+    @classmethod
+    def merge_aggregate(cls, course, student, unused_static_params,
+                        unused_previous, unused_event_items):
+        return {'earned_certificate': student_is_qualified(student, course)}
+
     @classmethod
     def get_schema(cls):
         return schema_fields.SchemaField(
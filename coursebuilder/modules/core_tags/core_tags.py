@@ -126,6 +126,10 @@ class GoogleDoc(CoreTag):
     def name(cls):
         return 'Google Doc'
 
+    @classmethod
+    def get_fragment_cache_key(cls):
+        return ''
+
     def render(self, node, unused_handler):
         height = node.attrib.get('height') or '300'
         link = node.attrib.get('link')
@@ -420,6 +424,10 @@ class GoogleSpreadsheet(CoreTag):
     def name(cls):
         return 'Google Spreadsheet'
 
+    @classmethod
+    def get_fragment_cache_key(cls):
+        return ''
+
     def render(self, node, unused_handler):
         height = node.attrib.get('height') or '300'
         link = node.attrib.get('link')
@@ -463,6 +471,10 @@ class YouTube(CoreTag):
     def name(cls):
         return 'YouTube Video'
 
+    @classmethod
+    def get_fragment_cache_key(cls):
+        return 'tracking=%s' % utils.CAN_PERSIST_TAG_EVENTS.value
+
     def render(self, node, unused_handler):
         video_id = node.attrib.get('videoid')
         if utils.CAN_PERSIST_TAG_EVENTS.value:
@@ -516,6 +528,10 @@ class Html5Video(CoreTag):
     def name(cls):
         return 'HTML5 Video'
 
+    @classmethod
+    def get_fragment_cache_key(cls):
+        return 'tracking=%s' % utils.CAN_PERSIST_TAG_EVENTS.value
+
     def render(self, node, unused_handler):
         if utils.CAN_PERSIST_TAG_EVENTS.value:
             tracking_text = (
@@ -619,6 +635,10 @@ class GoogleGroup(CoreTag):
 
 class IFrame(CoreTag):
 
+    @classmethod
+    def get_fragment_cache_key(cls):
+        return ''
+
     def render(self, node, unused_handler):
         src = node.attrib.get('src')
         title = node.attrib.get('title')
@@ -728,6 +748,10 @@ class Markdown(tags.ContextAwareTag, CoreTag):
     def get_icon_url(self):
         return self.create_icon_url('markdown.png')
 
+    @classmethod
+    def get_fragment_cache_key(cls):
+        return ''
+
     def render(self, node, context):
         # The markdown is "text" type in the schema and so is presented in the
         # tag's body.
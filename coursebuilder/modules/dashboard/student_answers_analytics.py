@@ -16,7 +16,6 @@
 
 __author__ = 'Mike Gainer (mgainer@google.com)'
 
-import ast
 import datetime
 
 from mapreduce import context
@@ -51,6 +50,8 @@ class QuestionAnswersEntity(entities.BaseEntity):
 class RawAnswersGenerator(jobs.MapReduceJob):
     """Extract answers from all event types into QuestionAnswersEntity table."""
 
+    INTERMEDIATE_VALUE_CODEC = jobs.MarshalValueCodec
+
     @staticmethod
     def get_description():
         return 'raw question answers'
@@ -123,13 +124,22 @@ class RawAnswersGenerator(jobs.MapReduceJob):
 
         yield (event.user_id, [list(answer) for answer in answers])
 
+    @staticmethod
+    def combine(unused_key, answers_lists, previously_combined_outputs=None):
+        answers = []
+        for data in answers_lists:
+            answers += data
+        for data in previously_combined_outputs or []:
+            answers += data
+        yield answers
+
     @staticmethod
     def reduce(key, answers_lists):
         """Does not produce output to Job.  Instead, stores values to DB."""
 
         answers = []
         for data in answers_lists:
-            answers += ast.literal_eval(data)
+            answers += data
         data = transforms.dumps(answers)
         QuestionAnswersEntity(key_name=key, data=data).put()
 
@@ -485,6 +495,13 @@ class OrderedQuestionsDataSource(data_sources.SynchronousQuery):
 
 
 class StudentAnswersStatsGenerator(jobs.MapReduceJob):
+    """Counts the answers given to each question.
+
+    Mapped values are lists of (answers, score, count) tuples; combine()
+    adds up the counts of identical answers with identical scores.
+    """
+
+    INTERMEDIATE_VALUE_CODEC = jobs.MarshalValueCodec
 
     @staticmethod
     def get_description():
@@ -536,13 +553,34 @@ class StudentAnswersStatsGenerator(jobs.MapReduceJob):
                     timestamp=0):
                     yield (StudentAnswersStatsGenerator.build_key(
                         unit_id, answer.sequence, answer.question_id,
-                        answer.question_type), (answer.answers, answer.score))
+                        answer.question_type),
+                           [(answer.answers, answer.score, 1)])
             # TODO(mgainer): Emit warning counter here if we don't grok
             # the response type.  We will need to cope with Oppia and
             # XBlocks responses.  Do that in a follow-on CL.
 
     @staticmethod
-    def reduce(key, answers_and_score_list):
+    def _count_answers(answers_and_score_lists):
+        counts = {}
+        for answers_and_score_list in answers_and_score_lists:
+            for answers, score, count in answers_and_score_list:
+                # Multiple-choice answers are lists; make them hashable.
+                if isinstance(answers, list):
+                    answers = tuple(answers)
+                counts.setdefault((answers, score), 0)
+                counts[(answers, score)] += count
+        return [(answers, score, count)
+                for (answers, score), count in counts.iteritems()]
+
+    @staticmethod
+    def combine(unused_key, answers_and_score_lists,
+                previously_combined_outputs=None):
+        yield StudentAnswersStatsGenerator._count_answers(
+            list(answers_and_score_lists) +
+            list(previously_combined_outputs or []))
+
+    @staticmethod
+    def reduce(key, answers_and_score_lists):
         correct_answers = {}
         incorrect_answers = {}
         unit_id, sequence, question_id, question_type = (
@@ -550,17 +588,18 @@ class StudentAnswersStatsGenerator(jobs.MapReduceJob):
         unit_id = int(unit_id)
         question_id = long(question_id)
 
-        for packed_data in answers_and_score_list:
-            answers, score = ast.literal_eval(packed_data)
+        for answers, score, count in (
+            StudentAnswersStatsGenerator._count_answers(
+                answers_and_score_lists)):
             if question_type == 'SaQuestion':
                 if score > 0:
                     # Note: 'answers' only contains one item (not a list) for
                     # SaQuestion.
                     correct_answers.setdefault(answers, 0)
-                    correct_answers[answers] += 1
+                    correct_answers[answers] += count
                 else:
                     incorrect_answers.setdefault(answers, 0)
-                    incorrect_answers[answers] += 1
+                    incorrect_answers[answers] += count
             elif question_type == 'McQuestion':
                 # For multiple-choice questions, we only get one overall score
                 # for the question as a whole.  This means that some choices
@@ -571,7 +610,7 @@ class StudentAnswersStatsGenerator(jobs.MapReduceJob):
                 # call all of the answers 'correct'.
                 for sub_answer in answers:
                     correct_answers.setdefault(sub_answer, 0)
-                    correct_answers[sub_answer] += 1
+                    correct_answers[sub_answer] += count
 
         def build_reduce_dict(unit_id, sequence, question_id, is_valid,
                               answer, count):
@@ -44,6 +44,10 @@ class MathTag(tags.ContextAwareTag):
     def vendor(cls):
         return 'gcb'
 
+    @classmethod
+    def get_fragment_cache_key(cls):
+        return ''
+
     def render(self, node, context):
         math_script = cElementTree.XML('<script/>')
 
@@ -50,6 +50,7 @@ ALL_TEST_CLASSES = {
     'tests.functional.controllers_review.PeerReviewControllerTest': 7,
     'tests.functional.controllers_review.PeerReviewDashboardAdminTest': 1,
     'tests.functional.controllers_review.PeerReviewDashboardStudentTest': 2,
+    'tests.functional.controllers_zip_bundles.ZipBundleTest': 5,
     'tests.functional.i18n.I18NCourseSettingsTests': 7,
     'tests.functional.i18n.I18NMultipleChoiceQuestionTests': 6,
     'tests.functional.model_analytics.AnalyticsTabsWithNoJobs': 8,
@@ -57,7 +58,7 @@ ALL_TEST_CLASSES = {
     'tests.functional.model_analytics.MapReduceSimpleTest': 1,
     'tests.functional.model_analytics.ProgressAnalyticsTest': 8,
     'tests.functional.model_analytics.QuestionAnalyticsTest': 3,
-    'tests.functional.model_courses.CourseCachingTest': 5,
+    'tests.functional.model_courses.CourseCachingTest': 8,
     'tests.functional.model_data_sources.PaginatedTableTest': 17,
     'tests.functional.model_data_sources.PiiExportTest': 4,
     'tests.functional.model_entities.BaseEntityTestCase': 3,
@@ -67,7 +68,9 @@ ALL_TEST_CLASSES = {
     'tests.functional.model_models.BaseJsonDaoTestCase': 1,
     'tests.functional.model_models.ContentChunkTestCase': 15,
     'tests.functional.model_models.EventEntityTestCase': 1,
-    'tests.functional.model_models.MemcacheManagerTestCase': 4,
+    'tests.functional.model_models.EventEntityRecordManyTest': 2,
+    'tests.functional.model_models.EntityPrefetcherTestCase': 4,
+    'tests.functional.model_models.MemcacheManagerTestCase': 8,
     'tests.functional.model_models.PersonalProfileTestCase': 1,
     'tests.functional.model_models.QuestionDAOTestCase': 3,
     'tests.functional.model_models.StudentAnswersEntityTestCase': 1,
@@ -79,11 +82,18 @@ ALL_TEST_CLASSES = {
     'tests.functional.model_student_work.SubmissionTest': 3,
     'tests.functional.model_utils.QueryMapperTest': 4,
     'tests.functional.model_vfs.VfsLargeFileSupportTest': 6,
+    'tests.functional.model_vfs.VfsChunkedReadTest': 6,
+    'tests.functional.model_vfs.VfsContentDedupTest': 8,
+    'tests.functional.model_vfs.VfsJinjaEnvironmentPoolTest': 5,
+    'tests.functional.model_vfs.VfsNegativeAndListingCacheTest': 3,
     'tests.functional.module_config_test.ManipulateAppYamlFileTest': 8,
     'tests.functional.module_config_test.ModuleIncorporationTest': 8,
     'tests.functional.module_config_test.ModuleManifestTest': 7,
     'tests.functional.modules_admin.AdminDashboardTabTests': 4,
+    'tests.functional.modules_admin.RequestTracesTabTests': 3,
     'tests.functional.modules_analytics.StudentAggregateTest': 6,
+    'tests.functional.modules_analytics.LocalMapReduceTest': 2,
+    'tests.functional.modules_analytics.IncrementalStudentAggregateTest': 3,
     'tests.functional.modules_balancer.ExternalTaskTest': 3,
     'tests.functional.modules_balancer.ManagerTest': 10,
     'tests.functional.modules_balancer.ProjectRestHandlerTest': 5,
@@ -96,6 +106,7 @@ ALL_TEST_CLASSES = {
     'tests.functional.modules_core_tags.GoogleDriveTagRendererTest': 6,
     'tests.functional.modules_core_tags.RuntimeTest': 13,
     'tests.functional.modules_core_tags.TagsInclude': 8,
+    'tests.functional.modules_core_tags.TagsFragmentCache': 4,
     'tests.functional.modules_core_tags.TagsMarkdown': 1,
     'tests.functional.modules_courses.AccessDraftsTestCase': 2,
     'tests.functional.modules_dashboard.CourseOutlineTestCase': 1,
@@ -176,6 +187,12 @@ ALL_TEST_CLASSES = {
     'tests.functional.modules_usage_reporting.MessagingTests': 8,
     'tests.functional.modules_usage_reporting.UsageReportingTests': 3,
     'tests.functional.progress_percent.ProgressPercent': 4,
+    'tests.functional.progress_tracker.ProgressDictParsingTest': 5,
+    'tests.functional.progress_tracker.BatchedProgressEventsTest': 3,
+    'tests.functional.progress_tracker.EventsBatchHandlerTest': 4,
+    'tests.functional.progress_tracker.CourseStructureIndexTest': 4,
+    'tests.functional.progress_tracker.GetProgressMultiTest': 2,
+    'tests.functional.progress_tracker.CourseOutlineTest': 3,
     'tests.functional.review_module.ManagerTest': 55,
     'tests.functional.review_peer.ReviewStepTest': 3,
     'tests.functional.review_peer.ReviewSummaryTest': 5,
@@ -195,9 +212,9 @@ ALL_TEST_CLASSES = {
     'tests.functional.test_classes.CourseUrlRewritingTest': 44,
     'tests.functional.test_classes.DatastoreBackedCustomCourseTest': 6,
     'tests.functional.test_classes.DatastoreBackedSampleCourseTest': 44,
-    'tests.functional.test_classes.EtlMainTestCase': 42,
+    'tests.functional.test_classes.EtlMainTestCase': 45,
     'tests.functional.test_classes.EtlRemoteEnvironmentTestCase': 0,
-    'tests.functional.test_classes.InfrastructureTest': 21,
+    'tests.functional.test_classes.InfrastructureTest': 25,
     'tests.functional.test_classes.I18NTest': 2,
     'tests.functional.test_classes.LessonComponentsTest': 2,
     'tests.functional.test_classes.MemcacheTest': 65,
@@ -207,7 +224,7 @@ ALL_TEST_CLASSES = {
     'tests.functional.test_classes.StudentAspectTest': 19,
     'tests.functional.test_classes.StudentUnifiedProfileTest': 19,
     'tests.functional.test_classes.TransformsEntitySchema': 1,
-    'tests.functional.test_classes.TransformsJsonFileTestCase': 3,
+    'tests.functional.test_classes.TransformsJsonFileTestCase': 4,
     'tests.functional.test_classes.VirtualFileSystemTest': 44,
     'tests.functional.test_classes.ImportActivityTests': 7,
     'tests.functional.test_classes.ImportAssessmentTests': 3,
@@ -235,9 +252,19 @@ ALL_TEST_CLASSES = {
     'tests.unit.common_tags.CustomTagTests': 13,
     'tests.unit.common_utils.CommonUnitTests': 11,
     'tests.unit.common_utils.ZipAwareOpenTests': 2,
+    'tests.unit.controllers_sites_routing.RoutingBenchmark': 1,
+    'tests.unit.controllers_sites_routing.RoutingTrieTests': 2,
     'tests.unit.javascript_tests.AllJavaScriptTests': 9,
     'tests.unit.models_analytics.AnalyticsTests': 5,
+    'tests.unit.models_counters.TracerTests': 7,
     'tests.unit.models_courses.WorkflowValidationTests': 13,
+    'tests.unit.models_courses_serialization'
+        '.CachedCourse13SerializationBenchmark': 1,
+    'tests.unit.models_courses_serialization'
+        '.CachedCourse13SerializationTests': 6,
+    'tests.unit.models_jobs.IntermediateValueCodecTests': 3,
+    'tests.unit.models_jobs.MarshalValueCodecTests': 4,
+    'tests.unit.models_jobs.ShuffleBytesBenchmark': 1,
     'tests.unit.models_transforms.JsonToDictTests': 13,
     'tests.unit.models_transforms.JsonParsingTests': 3,
     'tests.unit.models_transforms.StringValueConversionTests': 2,
@@ -0,0 +1,116 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for serving files from zip bundles."""
+
+import gzip
+import mimetypes
+import os
+import StringIO
+import zipfile
+
+import webapp2
+import webtest
+
+from controllers import sites
+from tests.functional import actions
+
+SCRIPT = 'var a = 1;\n' * 100
+STYLE = '.a { background: url(img/a.png); }\n'
+
+
+class ZipBundleTest(actions.TestBase):
+    """Checks files are served from indexed and cached zip bundles."""
+
+    def setUp(self):
+        super(ZipBundleTest, self).setUp()
+        zipfilename = os.path.join(self.test_tempdir, 'bundle.zip')
+        zip_file = zipfile.ZipFile(zipfilename, 'w', zipfile.ZIP_DEFLATED)
+        try:
+            zip_file.writestr('js/a.js', SCRIPT)
+            zip_file.writestr('css/a.css', STYLE)
+            zip_file.writestr('css/b.css', STYLE)
+        finally:
+            zip_file.close()
+
+        self.zip_app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/zip/(.*)', sites.make_zip_handler(zipfilename)),
+            ('/combo', sites.make_css_combo_zip_handler(
+                zipfilename, '/zip/')),
+            ('/missing/(.*)', sites.make_zip_handler(
+                os.path.join(self.test_tempdir, 'missing.zip')))]))
+
+    def test_file_is_read_from_zip_once(self):
+        misses = sites.ZIP_BUNDLE_CACHE_MISS.value
+        hits = sites.ZIP_BUNDLE_CACHE_HIT.value
+        for _ in xrange(3):
+            response = self.zip_app.get('/zip/js/a.js')
+            self.assertEquals(SCRIPT, response.body)
+            self.assertEquals(
+                mimetypes.guess_type('a.js')[0],
+                response.headers['Content-Type'])
+        self.assertEquals(misses + 1, sites.ZIP_BUNDLE_CACHE_MISS.value)
+        self.assertEquals(hits + 2, sites.ZIP_BUNDLE_CACHE_HIT.value)
+
+    def test_missing_files_and_bundles(self):
+        response = self.zip_app.get('/zip/js/b.js', expect_errors=True)
+        self.assertEquals(404, response.status_int)
+        response = self.zip_app.get('/missing/js/a.js', expect_errors=True)
+        self.assertEquals(404, response.status_int)
+
+    def test_repeat_fetch_is_not_modified(self):
+        response = self.zip_app.get('/zip/js/a.js')
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        self.assertIn('public', response.headers['Cache-Control'])
+
+        response = self.zip_app.get(
+            '/zip/js/a.js', headers={'If-None-Match': etag})
+        self.assertEquals(304, response.status_int)
+        self.assertEquals('', response.body)
+
+        response = self.zip_app.get(
+            '/zip/js/a.js', headers={'If-Modified-Since': last_modified})
+        self.assertEquals(304, response.status_int)
+
+        response = self.zip_app.get(
+            '/zip/js/a.js', headers={'If-None-Match': '"other"'})
+        self.assertEquals(200, response.status_int)
+        self.assertEquals(SCRIPT, response.body)
+
+    def test_file_is_gzipped_if_client_accepts_it(self):
+        response = self.zip_app.get(
+            '/zip/js/a.js', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEquals('gzip', response.headers['Content-Encoding'])
+        self.assertEquals('Accept-Encoding', response.headers['Vary'])
+        self.assertEquals(SCRIPT, gzip.GzipFile(
+            fileobj=StringIO.StringIO(response.body)).read())
+
+        response = self.zip_app.get('/zip/css/a.css')
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_combined_files_are_cached_by_query(self):
+        misses = sites.ZIP_BUNDLE_CACHE_MISS.value
+        expected = (
+            '.a { background: url(/zip/css/img/a.png); }\n' * 2)
+        for _ in xrange(2):
+            response = self.zip_app.get('/combo?css/a.css&css/b.css')
+            self.assertEquals(expected, response.body)
+            self.assertEquals('text/css', response.headers['Content-Type'])
+        self.assertEquals(misses + 1, sites.ZIP_BUNDLE_CACHE_MISS.value)
+
+        response = self.zip_app.get(
+            '/combo?css/a.css&css/b.css',
+            headers={'If-None-Match': response.headers['ETag']})
+        self.assertEquals(304, response.status_int)
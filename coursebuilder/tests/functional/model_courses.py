@@ -104,9 +104,10 @@ class CourseCachingTest(actions.TestBase):
         # Destroy the contents of the course from VFS, so that we are
         # absolutely certain that if the next course load succeeds, it has
         # come from the memcache version, rather than VFS.
-        file_key_names = vfs.DatastoreBackedFileSystem._generate_file_key_names(
-            '/data/course.json', vfs._MAX_VFS_SHARD_SIZE + 1)
         with common_utils.Namespace(self.NAMESPACE):
+            file_key_names = vfs.DatastoreBackedFileSystem._get_data_key_names(
+                '/data/course.json',
+                vfs.FileMetadataEntity.get_by_key_name('/data/course.json'))
             shard_0 = vfs.FileDataEntity.get_by_key_name(file_key_names[0])
             shard_0.delete()
             shard_1 = vfs.FileDataEntity.get_by_key_name(file_key_names[1])
@@ -184,3 +185,61 @@ class CourseCachingTest(actions.TestBase):
             memcache_keys[0:1],
             memcache_values.keys(),
             'Only shard zero should be present in memcache.')
+
+    def test_course_is_served_from_process_cache_while_stamp_unchanged(self):
+        unit = self._add_large_unit(num_lessons=3)
+        memcache_keys = courses.CachedCourse13._make_keys()
+
+        # Load course from VFS to put it into memcache, then once more to
+        # put it into the in-process cache.
+        courses.Course(handler=None, app_context=self.app_context)
+        courses.Course(handler=None, app_context=self.app_context)
+
+        # Remove the shards from memcache; the version stamp is still there,
+        # so the next load must come from the in-process cache.
+        models.MemcacheManager.delete_multi(memcache_keys, self.NAMESPACE)
+        hits = courses.COURSE_PROCESS_CACHE_HIT.value
+        course = courses.Course(handler=None, app_context=self.app_context)
+        self.assertEquals(hits + 1, courses.COURSE_PROCESS_CACHE_HIT.value)
+        self.assertEquals(3, len(course.get_lessons(unit.unit_id)))
+
+        # Changes to the loaded objects do not leak into the cached copy.
+        course.get_lessons(unit.unit_id)[0].title = 'Modified'
+        course.find_unit_by_id(unit.unit_id).properties['a'] = 'b'
+        course = courses.Course(handler=None, app_context=self.app_context)
+        self.assertNotEquals(
+            'Modified', course.get_lessons(unit.unit_id)[0].title)
+        self.assertNotIn(
+            'a', course.find_unit_by_id(unit.unit_id).properties)
+
+    def test_process_cache_is_refilled_after_stamp_eviction(self):
+        unit = self._add_large_unit(num_lessons=1)
+        courses.Course(handler=None, app_context=self.app_context)
+        courses.Course(handler=None, app_context=self.app_context)
+
+        # Memcache drops the version stamp on its own. The in-process copy
+        # is stale now, but the next load puts back a fresh stamp, so the
+        # one after it is served from the in-process cache again.
+        models.MemcacheManager.delete(
+            courses.CachedCourse13._make_version_stamp_key(), self.NAMESPACE)
+        hits = courses.COURSE_PROCESS_CACHE_HIT.value
+        misses = courses.COURSE_PROCESS_CACHE_MISS.value
+        courses.Course(handler=None, app_context=self.app_context)
+        self.assertEquals(hits, courses.COURSE_PROCESS_CACHE_HIT.value)
+        self.assertEquals(misses + 1, courses.COURSE_PROCESS_CACHE_MISS.value)
+
+        course = courses.Course(handler=None, app_context=self.app_context)
+        self.assertEquals(hits + 1, courses.COURSE_PROCESS_CACHE_HIT.value)
+        self.assertEquals(1, len(course.get_lessons(unit.unit_id)))
+
+    def test_course_save_invalidates_process_cache(self):
+        unit = self._add_large_unit(num_lessons=1)
+        courses.Course(handler=None, app_context=self.app_context)
+        courses.Course(handler=None, app_context=self.app_context)
+
+        course = courses.Course(handler=None, app_context=self.app_context)
+        course.add_lesson(course.find_unit_by_id(unit.unit_id))
+        course.save()
+
+        course = courses.Course(handler=None, app_context=self.app_context)
+        self.assertEquals(2, len(course.get_lessons(unit.unit_id)))
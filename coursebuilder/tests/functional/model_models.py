@@ -18,8 +18,12 @@ __author__ = [
     'johncox@google.com (John Cox)',
 ]
 
+import collections
 import datetime
 
+from common import caching
+from common import utils as common_utils
+from controllers import sites
 from models import config
 from models import entities
 from models import models
@@ -27,6 +31,8 @@ from models import services
 from modules.notifications import notifications
 from tests.functional import actions
 
+from google.appengine.api import memcache
+from google.appengine.api import users
 from google.appengine.ext import db
 
 
@@ -43,6 +49,45 @@ class EventEntityTestCase(actions.ExportTestBase):
         self.assertEqual(key, models.EventEntity.safe_key(key, self.transform))
 
 
+class EventEntityRecordManyTest(actions.TestBase):
+
+    def _record(self, count):
+        models.EventEntity.record_many(
+            users.User(email='user@example.com', _user_id='1'),
+            [('source', '{}')] * count)
+
+    def test_events_are_written_with_one_put(self):
+        batches = models.EVENTS_BATCH_PUT.value
+        rows = models.EVENTS_BATCH_PUT_ROWS.value
+        db_puts = entities.DB_PUT.value
+        self._record(3)
+        self.assertEquals(3, models.EventEntity.all().count())
+        self.assertEquals(batches + 1, models.EVENTS_BATCH_PUT.value)
+        self.assertEquals(rows + 3, models.EVENTS_BATCH_PUT_ROWS.value)
+        self.assertEquals(db_puts + 3, entities.DB_PUT.value)
+
+    def test_failed_put_is_deferred(self):
+        deferred_calls = []
+        self.swap(
+            models.deferred, 'defer',
+            lambda func, *args: deferred_calls.append((func, args)))
+        original_put = models.db.put
+
+        def failing_put(events):
+            # Some of the events are written before the put fails.
+            original_put(events[:2])
+            raise db.Timeout()
+
+        self.swap(models.db, 'put', failing_put)
+        self._record(3)
+        self.assertEquals(1, len(deferred_calls))
+
+        self.swap(models.db, 'put', original_put)
+        func, args = deferred_calls[0]
+        func(*args)
+        self.assertEquals(3, models.EventEntity.all().count())
+
+
 class ContentChunkTestCase(actions.ExportTestBase):
     """Tests ContentChunkEntity|DAO|DTO."""
 
@@ -338,6 +383,167 @@ class MemcacheManagerTestCase(actions.TestBase):
         data = models.MemcacheManager.get_multi(['a', 'b', 'c'])
         self.assertEquals(0, len(data.keys()))
 
+    def test_get_multi_from_local_cache_returns_dict(self):
+        models.MemcacheManager.set('a', 'A')
+        models.MemcacheManager.set('b', 'B')
+        models.MemcacheManager.begin_readonly()
+        try:
+            models.MemcacheManager.get_multi(['a', 'b'])
+
+            def no_memcache_rpc(*unused_args, **unused_kwargs):
+                raise AssertionError('Expected to read from local cache.')
+
+            self.swap(memcache, 'get_multi', no_memcache_rpc)
+            hits = models.CACHE_HIT_LOCAL.value
+            data = models.MemcacheManager.get_multi(['a', 'b'])
+            self.assertEquals({'a': 'A', 'b': 'B'}, data)
+            self.assertEquals(hits + 2, models.CACHE_HIT_LOCAL.value)
+        finally:
+            models.MemcacheManager.end_readonly()
+
+    def test_mutable_values_are_copied_in_readonly(self):
+        models.MemcacheManager.set('mutable:a', {'a': ['A']})
+        models.MemcacheManager.begin_readonly()
+        try:
+            first = models.MemcacheManager.get('mutable:a')
+            first['a'].append('B')
+            second = models.MemcacheManager.get('mutable:a')
+            self.assertEquals({'a': ['A']}, second)
+            self.assertIsNot(first, second)
+        finally:
+            models.MemcacheManager.end_readonly()
+
+    def test_immutable_values_are_shared_in_readonly(self):
+        models.MemcacheManager.register_immutable_key_prefix('frozen:')
+        try:
+            models.MemcacheManager.set('frozen:a', {'a': ['A']})
+            models.MemcacheManager.begin_readonly()
+            try:
+                avoided = models.CACHE_COPY_AVOIDED.value
+                first = models.MemcacheManager.get('frozen:a')
+                second = models.MemcacheManager.get('frozen:a')
+                multi = models.MemcacheManager.get_multi(['frozen:a'])
+                self.assertEquals({'a': ('A',)}, first)
+                self.assertIs(first, second)
+                self.assertIs(first, multi['frozen:a'])
+                self.assertEquals(
+                    avoided + 3, models.CACHE_COPY_AVOIDED.value)
+                self.assertTrue(models.MemcacheManager._COPY_AVOIDED_BYTES)
+                with self.assertRaises(TypeError):
+                    first['b'] = 'B'
+                with self.assertRaises(AttributeError):
+                    first['a'].append('B')
+                self.assertEquals(
+                    {'a': ('A',)}, models.MemcacheManager.get('frozen:a'))
+            finally:
+                models.MemcacheManager.end_readonly()
+        finally:
+            models.MemcacheManager.unregister_immutable_key_prefix('frozen:')
+
+    def test_immutable_values_of_other_types_are_copied(self):
+        models.MemcacheManager.register_immutable_key_prefix('frozen:')
+        try:
+            models.MemcacheManager.set(
+                'frozen:a', {'a': collections.OrderedDict(a='A')})
+            models.MemcacheManager.begin_readonly()
+            try:
+                first = models.MemcacheManager.get('frozen:a')
+                first['a']['b'] = 'B'
+                second = models.MemcacheManager.get('frozen:a')
+                self.assertEquals({'a': {'a': 'A'}}, second)
+                self.assertIsNot(first, second)
+            finally:
+                models.MemcacheManager.end_readonly()
+        finally:
+            models.MemcacheManager.unregister_immutable_key_prefix('frozen:')
+
+
+class EntityPrefetcherTestCase(actions.TestBase):
+
+    def setUp(self):
+        super(EntityPrefetcherTestCase, self).setUp()
+        config.Registry.test_overrides = {models.CAN_USE_MEMCACHE.name: True}
+        self.email = 'prefetch@example.com'
+        self.user_id = 'prefetch-user'
+        models.Student(
+            key_name=self.email, user_id=self.user_id, is_enrolled=True).put()
+        models.StudentPropertyEntity(
+            key_name=models.StudentPropertyEntity.create_key(
+                self.user_id, 'progress'), value='{}').put()
+        memcache.flush_all()
+
+    def tearDown(self):
+        caching.RequestScopedSingleton.clear_all()
+        config.Registry.test_overrides = {}
+        super(EntityPrefetcherTestCase, self).tearDown()
+
+    def _prefetch(self):
+        models.Student.prefetch_by_email(self.email)
+        models.StudentProfileDAO.prefetch_profile_by_user_id(self.user_id)
+        models.StudentPropertyEntity.prefetch(self.user_id, 'progress')
+        models.EntityPrefetcher.instance().fetch()
+
+    def _load(self):
+        student = models.Student.get_enrolled_student_by_email(self.email)
+        profile = models.StudentProfileDAO.get_profile_by_user_id(self.user_id)
+        progress = models.StudentPropertyEntity.get(student, 'progress')
+        return student, profile, progress
+
+    def test_declared_entities_are_read_with_one_datastore_get(self):
+        self.assertTrue(models.CAN_USE_MEMCACHE.value)
+        sites.RequestRpcCounter.begin()
+        try:
+            self._prefetch()
+            student, profile, progress = self._load()
+        finally:
+            counts = sites.RequestRpcCounter.end()
+        self.assertEquals(1, counts.get('datastore_v3.Get'))
+        self.assertEquals(self.user_id, student.user_id)
+        self.assertIsNone(profile)
+        self.assertEquals('{}', progress.value)
+
+        # Prefetched objects were also put into memcache for later requests.
+        caching.RequestScopedSingleton.clear_all()
+        sites.RequestRpcCounter.begin()
+        try:
+            self._load()
+        finally:
+            counts = sites.RequestRpcCounter.end()
+        self.assertIsNone(counts.get('datastore_v3.Get'))
+
+    def test_readers_get_copies(self):
+        self._prefetch()
+        student = models.Student.get_enrolled_student_by_email(self.email)
+        student.name = 'Changed'
+        self.assertIsNone(
+            models.Student.get_enrolled_student_by_email(self.email).name)
+
+    def test_changed_entity_is_not_served_from_prefetched(self):
+        self._prefetch()
+        hits = models.PREFETCH_HIT.value
+        student = models.Student.get_enrolled_student_by_email(self.email)
+        self.assertEquals(hits + 1, models.PREFETCH_HIT.value)
+        student.name = 'Changed'
+        student.put()
+        self.assertEquals(
+            'Changed',
+            models.Student.get_enrolled_student_by_email(self.email).name)
+        self.assertEquals(hits + 1, models.PREFETCH_HIT.value)
+
+    def test_page_is_served_from_prefetched_entities(self):
+        course_name = 'prefetch'
+        actions.simple_add_course(course_name, 'admin@example.com', 'Title')
+        actions.login(self.email)
+        actions.register(self, self.email, course_name)
+
+        entities_before = models.PREFETCH_ENTITIES.value
+        hits_before = models.PREFETCH_HIT.value
+        rpcs_before = sites.RPC_CALLS.value
+        self.get('/%s/course' % course_name)
+        self.assertLess(entities_before, models.PREFETCH_ENTITIES.value)
+        self.assertLess(hits_before, models.PREFETCH_HIT.value)
+        self.assertLess(rpcs_before, sites.RPC_CALLS.value)
+
 
 class TestEntity(entities.BaseEntity):
     data = db.TextProperty(indexed=False)
@@ -23,12 +23,18 @@ import random
 import StringIO
 import tempfile
 
+import appengine_config
+from common import caching
+from common import jinja_utils
 from common import utils as common_utils
+from models import config
 from models import vfs
 from models import courses
 from tests.functional import actions
 from tools.etl import etl
 
+from google.appengine.ext import db
+
 LOREM_IPSUM = """
 Lorem ipsum dolor sit amet, consectetur adipiscing elit. Pellentesque nisl
 libero, interdum vel lectus eget, lacinia vestibulum eros. Maecenas posuere
@@ -49,6 +55,12 @@ pharetra, diam ac iaculis sed.
 """ * 10
 
 
+def _get_data_key_names(filename):
+    metadata = vfs.FileMetadataEntity.get_by_key_name(filename)
+    return vfs.DatastoreBackedFileSystem._get_data_key_names(
+        filename, metadata)
+
+
 class VfsLargeFileSupportTest(actions.TestBase):
 
     COURSE_NAME = 'test_course'
@@ -88,12 +100,12 @@ class VfsLargeFileSupportTest(actions.TestBase):
             self.assertEquals(lesson.objectives, LOREM_IPSUM)
 
         # Verify that sharded items exist with appropriate sizes.
-        file_key_names = vfs.DatastoreBackedFileSystem._generate_file_key_names(
-            '/data/course.json', serialized_length)
-        self.assertEquals(
-            2, len(file_key_names),
-            'Verify attempting to store a too-large file makes multiple shards')
         with common_utils.Namespace(self.NAMESPACE):
+            file_key_names = _get_data_key_names('/data/course.json')
+            self.assertEquals(
+                2, len(file_key_names),
+                'Verify attempting to store a too-large file makes multiple '
+                'shards')
             shard_0 = vfs.FileDataEntity.get_by_key_name(file_key_names[0])
             self.assertEquals(vfs._MAX_VFS_SHARD_SIZE, len(shard_0.data))
 
@@ -156,13 +168,12 @@ class VfsLargeFileSupportTest(actions.TestBase):
         self.assertEquals(orig_data, actual)
 
         # Verify that sharded items exist with appropriate sizes.
-        file_key_names = vfs.DatastoreBackedFileSystem._generate_file_key_names(
-            filename, vfs._MAX_VFS_SHARD_SIZE + 1)
-        self.assertEquals(
-            2, len(file_key_names),
-            'Verify attempting to store a too-large file makes multiple shards')
-
         with common_utils.Namespace(namespace):
+            file_key_names = _get_data_key_names(filename)
+            self.assertEquals(
+                2, len(file_key_names),
+                'Verify attempting to store a too-large file makes multiple '
+                'shards')
             shard_0 = vfs.FileDataEntity.get_by_key_name(file_key_names[0])
             self.assertEquals(vfs._MAX_VFS_SHARD_SIZE, len(shard_0.data))
 
@@ -199,3 +210,376 @@ class VfsLargeFileSupportTest(actions.TestBase):
         # from AppEngine about cross-group transaction having too many
         # entities involved.
         self.course.save()
+
+
+class _CallCounter(object):
+    """Wraps a function and counts calls to it."""
+
+    def __init__(self, func):
+        self.func = func
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+        return self.func(*args, **kwargs)
+
+
+class VfsNegativeAndListingCacheTest(actions.TestBase):
+
+    NAMESPACE = 'ns_foo'
+
+    def setUp(self):
+        super(VfsNegativeAndListingCacheTest, self).setUp()
+        vfs.ProcessScopedVfsCache.clear_all()
+        self.fs = vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+        self.gets = _CallCounter(vfs.FileMetadataEntity.get_by_key_name)
+        self.queries = _CallCounter(vfs.FileMetadataEntity.all)
+        self.swap(vfs.FileMetadataEntity, 'get_by_key_name', self.gets)
+        self.swap(vfs.FileMetadataEntity, 'all', self.queries)
+
+    def test_missing_file_is_looked_up_once(self):
+        self.assertFalse(self.fs.isfile('/missing.txt'))
+        self.assertFalse(self.fs.isfile('/missing.txt'))
+        self.assertIsNone(self.fs.open('/missing.txt'))
+        self.assertEquals(1, self.gets.count)
+        stats = vfs.ProcessScopedVfsCache.get_namespace_stats()
+        self.assertEquals(2, stats[self.NAMESPACE]['hit-none'])
+
+    def test_put_clears_negative_entry(self):
+        self.assertFalse(self.fs.isfile('/new.txt'))
+        self.fs.put('/new.txt', StringIO.StringIO('file contents'))
+        self.assertTrue(self.fs.isfile('/new.txt'))
+        self.assertEquals('file contents', self.fs.get('/new.txt').read())
+
+    def test_listing_is_cached_until_files_are_added_or_deleted(self):
+        self.fs.put('/a/one.txt', StringIO.StringIO('one'))
+        self.assertEquals(['/a/one.txt'], self.fs.list('/a'))
+        self.assertEquals([], self.fs.list('/b'))
+        self.assertEquals(1, self.queries.count)
+
+        # Changing an existing file does not change the listing.
+        self.fs.put('/a/one.txt', StringIO.StringIO('one again'))
+        self.assertEquals(['/a/one.txt'], self.fs.list('/a'))
+        self.assertEquals(1, self.queries.count)
+
+        self.fs.put('/a/two.txt', StringIO.StringIO('two'))
+        self.assertEquals(['/a/one.txt', '/a/two.txt'], self.fs.list('/a'))
+        self.assertEquals(2, self.queries.count)
+
+        self.fs.delete('/a/one.txt')
+        self.assertEquals(['/a/two.txt'], self.fs.list('/a'))
+        self.assertEquals(3, self.queries.count)
+
+
+class VfsChunkedReadTest(actions.TestBase):
+
+    COURSE_NAME = 'test_course'
+    ADMIN_EMAIL = 'admin@foo.com'
+    NAMESPACE = 'ns_%s' % COURSE_NAME
+    ASSET_PATH = 'assets/img/data.bin'
+
+    def setUp(self):
+        super(VfsChunkedReadTest, self).setUp()
+        self.app_context = actions.simple_add_course(
+            self.COURSE_NAME, self.ADMIN_EMAIL, 'Test Course')
+        r = random.Random()
+        r.seed(0)
+        self.data = ''.join(
+            [chr(r.randrange(256))
+             for x in xrange(int(vfs._MAX_VFS_SHARD_SIZE * 2.5))])
+        self.filename = os.path.join(
+            self.app_context.get_home(), self.ASSET_PATH)
+        self.app_context.fs.put(self.filename, StringIO.StringIO(self.data))
+        self.shard_gets = _CallCounter(vfs.db.get_async)
+        self.swap(vfs.db, 'get_async', self.shard_gets)
+
+    def test_shards_are_loaded_as_stream_is_read(self):
+        stream = self.app_context.fs.open_chunked(self.filename)
+        self.assertEquals(len(self.data), stream.size)
+        self.assertEquals(0, self.shard_gets.count)
+
+        chunks = stream.iter_chunks()
+        self.assertEquals(self.data[:vfs._MAX_VFS_SHARD_SIZE], next(chunks))
+        self.assertEquals(2, self.shard_gets.count)  # One is prefetched.
+        self.assertEquals(
+            self.data[vfs._MAX_VFS_SHARD_SIZE:], ''.join(chunks))
+        self.assertEquals(3, self.shard_gets.count)
+
+    def test_range_reads_only_shards_it_spans(self):
+        stream = self.app_context.fs.open_chunked(self.filename)
+        start = vfs._MAX_VFS_SHARD_SIZE + 10
+        end = vfs._MAX_VFS_SHARD_SIZE * 2 - 10
+        self.assertEquals(
+            self.data[start:end], ''.join(stream.iter_chunks(start, end)))
+        self.assertEquals(1, self.shard_gets.count)
+
+    def test_read_returns_all_bytes(self):
+        stream = self.app_context.fs.open_chunked(self.filename)
+        self.assertEquals(self.data, stream.read())
+        self.assertEquals('', stream.read())
+        self.assertEquals(self.data, self.app_context.fs.get(self.filename))
+
+    def test_small_files_are_read_at_once(self):
+        small_filename = os.path.join(
+            self.app_context.get_home(), 'assets/img/small.txt')
+        self.app_context.fs.put(
+            small_filename, StringIO.StringIO('small file'))
+        stream = self.app_context.fs.open_chunked(small_filename)
+        self.assertEquals('small file', stream.read())
+        self.assertEquals(0, self.shard_gets.count)
+        self.assertIsNone(self.app_context.fs.open_chunked(
+            os.path.join(self.app_context.get_home(), 'assets/img/no.txt')))
+
+    def test_asset_handler_serves_whole_file(self):
+        response = self.get('/%s/%s' % (self.COURSE_NAME, self.ASSET_PATH))
+        self.assertEquals(200, response.status_int)
+        self.assertEquals('bytes', response.headers['Accept-Ranges'])
+        self.assertEquals(self.data, response.body)
+
+    def test_asset_handler_serves_byte_ranges(self):
+        url = '/%s/%s' % (self.COURSE_NAME, self.ASSET_PATH)
+        size = len(self.data)
+        for range_header, start, end in [
+                ('bytes=0-99', 0, 100),
+                ('bytes=%s-' % (size - 5), size - 5, size),
+                ('bytes=-10', size - 10, size),
+                ('bytes=999990-1000009', 999990, 1000010)]:
+            response = self.get(url, headers={'Range': range_header})
+            self.assertEquals(206, response.status_int)
+            self.assertEquals(
+                'bytes %s-%s/%s' % (start, end - 1, size),
+                response.headers['Content-Range'])
+            self.assertEquals(self.data[start:end], response.body)
+
+        response = self.get(url, headers={'Range': 'bytes=0-1,5-6'})
+        self.assertEquals(200, response.status_int)
+        self.assertEquals(size, len(response.body))
+
+        response = self.get(
+            url, headers={'Range': 'bytes=%s-' % size}, expect_errors=True)
+        self.assertEquals(416, response.status_int)
+        self.assertEquals(
+            'bytes */%s' % size, response.headers['Content-Range'])
+
+
+class VfsContentDedupTest(actions.TestBase):
+
+    NAMESPACE = 'ns_dedup'
+
+    def setUp(self):
+        super(VfsContentDedupTest, self).setUp()
+        self.fs = vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+
+    def _put(self, filename, content):
+        self.fs.put(filename, StringIO.StringIO(content))
+
+    def _get_blob_head(self, content):
+        with common_utils.Namespace(self.NAMESPACE):
+            return vfs.FileDataEntity.get_by_key_name(
+                vfs._hash_content(content))
+
+    def _count_data_entities(self):
+        with common_utils.Namespace(self.NAMESPACE):
+            return vfs.FileDataEntity.all().count()
+
+    def test_files_with_same_content_share_blob(self):
+        self._put('/a.txt', 'same content')
+        self._put('/b.txt', 'same content')
+        self.assertEquals(2, self._get_blob_head('same content').ref_count)
+        self.assertEquals(2, self._count_data_entities())  # Head and data.
+        self.assertEquals('same content', self.fs.get('/a.txt').read())
+        self.assertEquals('same content', self.fs.get('/b.txt').read())
+
+        self.fs.put_multi_async([
+            ('/c.txt', StringIO.StringIO('same content')),
+            ('/d.txt', StringIO.StringIO('same content'))])()
+        self.assertEquals(4, self._get_blob_head('same content').ref_count)
+        self.assertEquals(2, self._count_data_entities())
+
+    def test_unchanged_content_is_not_written(self):
+        self._put('/a.txt', 'content')
+        unchanged = vfs.VFS_BLOB_UNCHANGED.value
+        entities_put = _CallCounter(vfs.entities_put)
+        self.swap(vfs, 'entities_put', entities_put)
+        self._put('/a.txt', 'content')
+        self.assertEquals(0, entities_put.count)
+        self.assertEquals(unchanged + 1, vfs.VFS_BLOB_UNCHANGED.value)
+        self.assertEquals(1, self._get_blob_head('content').ref_count)
+
+    def test_blob_is_deleted_when_no_longer_referenced(self):
+        self._put('/a.txt', 'old')
+        self._put('/b.txt', 'old')
+        self._put('/a.txt', 'new')
+        self.assertEquals(1, self._get_blob_head('old').ref_count)
+        self.assertEquals(1, self._get_blob_head('new').ref_count)
+
+        self.fs.delete('/b.txt')
+        self.assertIsNone(self._get_blob_head('old'))
+        self.assertEquals(2, self._count_data_entities())
+        self.assertEquals('new', self.fs.get('/a.txt').read())
+
+        self.fs.delete('/a.txt')
+        self.assertEquals(0, self._count_data_entities())
+
+    def test_concurrent_changes_to_blob_are_all_counted(self):
+        self._put('/a.txt', 'content')
+        with common_utils.Namespace(self.NAMESPACE):
+            # Changes are collected by concurrent requests before any of them
+            # is applied, so none of them sees the others.
+            adding = vfs._BlobChanges()
+            adding.acquire(
+                '/b.txt', vfs.FileMetadataEntity(key_name='/b.txt'),
+                'content')
+            also_adding = vfs._BlobChanges()
+            also_adding.acquire(
+                '/c.txt', vfs.FileMetadataEntity(key_name='/c.txt'),
+                'content')
+            dropping = vfs._BlobChanges()
+            dropping.release(
+                '/a.txt', vfs.FileMetadataEntity.get_by_key_name('/a.txt'))
+
+            adding.add_references()
+            dropping.drop_references()
+            also_adding.add_references()
+        self.assertEquals(2, self._get_blob_head('content').ref_count)
+        self.assertEquals(2, self._count_data_entities())
+
+    def test_ref_counts_are_updated_in_transactions(self):
+        in_transaction = []
+
+        def put(entities):
+            in_transaction.append(db.is_in_transaction())
+            return entities_put(entities)
+
+        entities_put = vfs.entities_put
+        self.swap(vfs, 'entities_put', put)
+        self.fs.non_transactional_put('/a.txt', 'content')
+        self.fs.put_multi_async([('/b.txt', StringIO.StringIO('content'))])()
+        self.assertEquals([True, True], in_transaction)
+        self.assertEquals(2, self._get_blob_head('content').ref_count)
+
+    def test_ref_counts_are_updated_in_batches(self):
+        update = _CallCounter(vfs._update_blob_ref_counts)
+        self.swap(vfs, '_update_blob_ref_counts', update)
+        self.fs.put_multi_async([
+            ('/%s.txt' % index, StringIO.StringIO('content %s' % index))
+            for index in xrange(vfs._MAX_BLOBS_PER_TRANSACTION + 1)])()
+        self.assertEquals(2, update.count)
+        self.assertEquals(1, self._get_blob_head('content 0').ref_count)
+        self.assertEquals(
+            2 * (vfs._MAX_BLOBS_PER_TRANSACTION + 1),
+            self._count_data_entities())
+
+    def _fail_metadata_put(self, num_saved):
+        put_async = db.put_async
+
+        class _FailedPut(object):
+
+            def check_success(self):
+                raise db.Timeout()
+
+        def failing_put_async(models, **kwargs):
+            if (not isinstance(models, list) or
+                not isinstance(models[0], vfs.FileMetadataEntity)):
+                return put_async(models, **kwargs)
+            # Only some of the metadata is saved before the put fails.
+            put_async(models[:num_saved]).get_result()
+            return _FailedPut()
+
+        self.swap(db, 'put_async', failing_put_async)
+
+    def test_ref_counts_are_recovered_when_metadata_put_fails(self):
+        self._put('/a.txt', 'old')
+        self._put('/b.txt', 'old')
+        self._fail_metadata_put(1)
+        with self.assertRaises(db.Timeout):
+            self.fs.put_multi_async([
+                ('/a.txt', StringIO.StringIO('saved')),
+                ('/b.txt', StringIO.StringIO('not saved')),
+                ('/c.txt', StringIO.StringIO('not saved'))])()
+
+        self.assertEquals('saved', self.fs.get('/a.txt').read())
+        self.assertEquals('old', self.fs.get('/b.txt').read())
+        self.assertEquals(1, self._get_blob_head('saved').ref_count)
+        self.assertEquals(1, self._get_blob_head('old').ref_count)
+        self.assertIsNone(self._get_blob_head('not saved'))
+        self.assertEquals(4, self._count_data_entities())
+
+    def test_content_stored_by_file_name_is_migrated(self):
+        with common_utils.Namespace(self.NAMESPACE):
+            vfs.FileMetadataEntity(key_name='/a.txt', size=6).put()
+            vfs.FileDataEntity(key_name='/a.txt', data='legacy').put()
+        self.assertEquals('legacy', self.fs.get('/a.txt').read())
+
+        self._put('/a.txt', 'current')
+        self.assertEquals('current', self.fs.get('/a.txt').read())
+        with common_utils.Namespace(self.NAMESPACE):
+            self.assertIsNone(vfs.FileDataEntity.get_by_key_name('/a.txt'))
+        self.assertEquals(2, self._count_data_entities())
+
+
+class VfsJinjaEnvironmentPoolTest(actions.TestBase):
+
+    NAMESPACE = 'ns_foo'
+
+    def setUp(self):
+        super(VfsJinjaEnvironmentPoolTest, self).setUp()
+        caching.ProcessScopedSingleton.clear_all()
+        self.fs = vfs.AbstractFileSystem(
+            vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/'))
+        self._put('/views/page.html', 'Hello, {{ name }}!')
+
+    def tearDown(self):
+        config.Registry.test_overrides = {}
+        super(VfsJinjaEnvironmentPoolTest, self).tearDown()
+
+    def _put(self, filename, content):
+        self.fs.put(filename, StringIO.StringIO(content))
+
+    def _get_template(self, name='page.html', dirs=None):
+        return self.fs.get_jinja_environ(
+            dirs or ['/views']).get_template(name)
+
+    def test_environment_and_template_are_reused(self):
+        misses = jinja_utils.JINJA_ENVIRONMENT_POOL_MISS.value
+        template = self._get_template()
+        self.assertIs(template, self._get_template())
+        self.assertIs(
+            self.fs.get_jinja_environ(['/views']),
+            self.fs.get_jinja_environ(['/views']))
+        self.assertEquals(
+            misses + 1, jinja_utils.JINJA_ENVIRONMENT_POOL_MISS.value)
+        self.assertEquals('Hello, Alice!', template.render({'name': 'Alice'}))
+
+    def test_template_is_reloaded_when_file_changes(self):
+        self.assertEquals(
+            'Hello, Alice!', self._get_template().render({'name': 'Alice'}))
+        self._put('/views/page.html', 'Bye, {{ name }}!')
+        self.assertEquals(
+            'Bye, Alice!', self._get_template().render({'name': 'Alice'}))
+
+    def test_template_is_reloaded_when_earlier_dir_gets_file(self):
+        dirs = ['/custom', '/views']
+        self.assertEquals(
+            'Hello, Bob!',
+            self._get_template(dirs=dirs).render({'name': 'Bob'}))
+        self._put('/custom/page.html', 'Hi, {{ name }}!')
+        self.assertEquals(
+            'Hi, Bob!', self._get_template(dirs=dirs).render({'name': 'Bob'}))
+
+    def test_environments_are_not_pooled_when_cache_is_disabled(self):
+        config.Registry.test_overrides[
+            jinja_utils.CAN_USE_JINJA2_TEMPLATE_CACHE.name] = False
+        self.assertIsNot(
+            self.fs.get_jinja_environ(['/views']),
+            self.fs.get_jinja_environ(['/views']))
+        self.assertEquals(
+            'Hello, Eve!', self._get_template().render({'name': 'Eve'}))
+
+    def test_local_templates_are_reused(self):
+        fs = vfs.AbstractFileSystem(vfs.LocalReadOnlyFileSystem(
+            '/', appengine_config.BUNDLE_ROOT))
+        template = fs.get_jinja_environ(['/views']).get_template('base.html')
+        self.assertIs(
+            template,
+            fs.get_jinja_environ(['/views']).get_template('base.html'))
@@ -17,6 +17,8 @@
 __author__ = 'John Orr (jorr@google.com)'
 
 from controllers import sites
+from models import config
+from models import counters
 from models import courses
 from tests.functional import actions
 
@@ -75,3 +77,59 @@ class AdminDashboardTabTests(actions.TestBase):
         self.assertEqual(
             'Site Admin',
             self.get_nav_bar(dom).find('.//a[@class="selected"]').text)
+
+
+class RequestTracesTabTests(actions.TestBase):
+
+    ADMIN_EMAIL = 'admin@foo.com'
+    COURSE_NAME = 'traces_tab_test_course'
+
+    def setUp(self):
+        super(RequestTracesTabTests, self).setUp()
+        actions.simple_add_course(
+            self.COURSE_NAME, self.ADMIN_EMAIL, 'Traces Course')
+        counters.Tracer.clear_recent()
+
+    def tearDown(self):
+        counters.Tracer.clear_recent()
+        config.Registry.test_overrides = {}
+        super(RequestTracesTabTests, self).tearDown()
+
+    def test_sampled_request_is_shown(self):
+        config.Registry.test_overrides[
+            sites.TRACE_SAMPLE_EVERY_N_REQUESTS.name] = 1
+        actions.login(self.ADMIN_EMAIL, is_admin=True)
+        self.get('/%s/course' % self.COURSE_NAME)
+
+        traces = counters.Tracer.get_recent()
+        self.assertEquals(
+            'GET /%s/course' % self.COURSE_NAME, traces[0].name)
+        text = traces[0].to_text()
+        self.assertIn('MemcacheManager.get', text)
+        self.assertIn('CourseHandler.get_template', text)
+        self.assertIn('BaseHandler.render_template', text)
+
+        response = self.get('/admin/global?tab=traces')
+        self.assertIn('GET /%s/course' % self.COURSE_NAME, response.body)
+
+    def test_requests_are_not_traced_by_default(self):
+        traced = sites.TRACED_REQUESTS.value
+        self.get('/%s/course' % self.COURSE_NAME)
+        self.assertEquals(traced, sites.TRACED_REQUESTS.value)
+        self.assertEquals([], counters.Tracer.get_recent())
+
+    def test_slow_request_is_logged(self):
+        config.Registry.test_overrides[
+            sites.SLOW_REQUEST_LOG_THRESHOLD_MSEC.name] = 1
+        self.swap(counters.RequestTrace, 'duration_msec', 5000)
+        warnings = []
+        self.swap(
+            sites.logging, 'warning',
+            lambda msg, *args: warnings.append(msg % args))
+        slow = sites.SLOW_REQUESTS.value
+        self.get('/%s/course' % self.COURSE_NAME)
+        self.assertEquals(slow + 1, sites.SLOW_REQUESTS.value)
+        self.assertEquals(1, len(counters.Tracer.get_recent()))
+        self.assertTrue(any(
+            warning.startswith('Slow request took 5000 ms')
+            for warning in warnings))
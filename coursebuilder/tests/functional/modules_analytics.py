@@ -17,6 +17,8 @@
 __author__ = 'Mike Gainer (mgainer@google.com)'
 
 import appengine_config
+import contextlib
+import datetime
 import json
 import os
 import pprint
@@ -34,8 +36,10 @@ from modules.analytics import clustering
 from modules.analytics import student_aggregate
 from tests.functional import actions
 from tools.etl import etl
+from tools.etl import local_mapreduce
 
 from google.appengine.api import namespace_manager
+from google.appengine.ext import db
 
 
 # Note to those extending this set of tests in the future:
@@ -290,6 +294,176 @@ class StudentAggregateTest(AbstractModulesAnalyticsTest):
         self.assertEqual(expected, actual['youtube'])
 
 
+class IncrementalStudentAggregateTest(AbstractModulesAnalyticsTest):
+
+    @contextlib.contextmanager
+    def _incremental(self, write_lag_secs=0):
+        with actions.OverriddenConfig(
+            student_aggregate.CAN_AGGREGATE_INCREMENTALLY.name, True):
+            with actions.OverriddenConfig(
+                student_aggregate.EVENT_WRITE_LAG_SECS.name, write_lag_secs):
+                yield
+
+    def _copy_events_as_new(self, sources, recorded_on=None):
+        with common_utils.Namespace('ns_' + self.COURSE_NAME):
+            old_events = [event for event in models.EventEntity.all()
+                          if event.source in sources]
+            db.put([models.EventEntity(
+                source=event.source, user_id=event.user_id, data=event.data,
+                recorded_on=recorded_on or datetime.datetime.utcnow())
+                    for event in old_events])
+
+    def _get_watermark(self):
+        with common_utils.Namespace('ns_' + self.COURSE_NAME):
+            return (
+                student_aggregate.StudentAggregateWatermarkEntity
+                .get_by_key_name(
+                    student_aggregate.StudentAggregateWatermarkEntity
+                    .KEY_NAME))
+
+    def _sort_lists(self, aggregate):
+        for value in aggregate.itervalues():
+            if isinstance(value, list):
+                value.sort(key=transforms.dumps)
+        return aggregate
+
+    def test_incremental_run_matches_full_run(self):
+        self.load_course('simple_questions')
+        self.load_datastore('location_locale')
+        with self._incremental():
+
+            # No earlier run, so all events are aggregated.
+            self.run_aggregator_job()
+            first = self.get_aggregated_data_by_email('foo@bar.com')
+            self.assertIsNone(self._get_watermark().committed_usec)
+
+            # No new events; aggregates are left alone.
+            self.run_aggregator_job()
+            self.assertEqual(
+                first, self.get_aggregated_data_by_email('foo@bar.com'))
+            watermark = self._get_watermark()
+            self.assertIsNotNone(watermark.committed_usec)
+            self.assertGreater(
+                watermark.pending_usec, watermark.committed_usec)
+
+            # Only the new events are merged into the aggregates.
+            self._copy_events_as_new(['enter-page', 'exit-page'])
+            self.run_aggregator_job()
+            incremental = self.get_aggregated_data_by_email('foo@bar.com')
+
+        self.assertEqual(
+            [2, 2, 4, 8],
+            sorted(item['count']
+                   for item in incremental['location_frequencies']))
+
+        # Aggregating everything again gives the same result.
+        self.run_aggregator_job()
+        full = self.get_aggregated_data_by_email('foo@bar.com')
+        self.assertEqual(self._sort_lists(full), self._sort_lists(incremental))
+
+    def test_events_already_merged_are_not_counted_again(self):
+        self.load_course('simple_questions')
+        self.load_datastore('location_locale')
+        with self._incremental():
+            self.run_aggregator_job()
+            self.run_aggregator_job()
+            self._copy_events_as_new(['enter-page', 'exit-page'])
+            self.run_aggregator_job()
+            expected = self.get_aggregated_data_by_email('foo@bar.com')
+
+            # Pretend the last run failed after writing the aggregates; the
+            # next run maps the same events again, but must skip them.
+            with common_utils.Namespace('ns_' + self.COURSE_NAME):
+                watermark = self._get_watermark()
+                watermark.pending_sequence_num = -1
+                watermark.put()
+            self.run_aggregator_job()
+            self.assertEqual(
+                expected, self.get_aggregated_data_by_email('foo@bar.com'))
+
+    def test_events_written_late_are_merged_by_next_run(self):
+        self.load_course('simple_questions')
+        self.load_datastore('location_locale')
+        with self._incremental(write_lag_secs=60):
+            self.run_aggregator_job()
+            self.run_aggregator_job()
+
+        # Events recorded before the last run started, but only written
+        # after it, e.g. by a retried put, are left to the next run.
+        recorded_on = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=30)
+        self.assertLess(self._get_watermark().pending_usec,
+                        student_aggregate._to_usec(recorded_on))
+        self._copy_events_as_new(['enter-page', 'exit-page'], recorded_on)
+        with self._incremental():
+            self.run_aggregator_job()
+        incremental = self.get_aggregated_data_by_email('foo@bar.com')
+        self.assertEqual(
+            [2, 2, 4, 8],
+            sorted(item['count']
+                   for item in incremental['location_frequencies']))
+
+
+class EventSourceCounter(jobs.AbstractCountingMapReduceJob):
+
+    @staticmethod
+    def get_description():
+        return 'event sources'
+
+    @staticmethod
+    def entity_class():
+        return models.EventEntity
+
+    @staticmethod
+    def map(event):
+        yield event.source, 1
+
+
+class LocalMapReduceTest(AbstractModulesAnalyticsTest):
+    """Tests running jobs over a datastore download with local processes."""
+
+    def _get_event_lines(self, path):
+        return local_mapreduce.iter_archive_lines(
+            os.path.join(self._get_data_path(path), 'datastore'),
+            models.EventEntity.kind())
+
+    def _run_locally(self, job, path, **kwargs):
+        with common_utils.Namespace('ns_' + self.COURSE_NAME):
+            return local_mapreduce.LocalMapReduce(
+                job, local_mapreduce.build_mapper_params(
+                    job, self.app_context), **kwargs).run(
+                        self._get_event_lines(path))
+
+    def test_counts_match_events_in_archive(self):
+        expected = {}
+        for line in self._get_event_lines('page_views'):
+            source = transforms.loads(line)['source']
+            expected[source] = expected.get(source, 0) + 1
+
+        # Small chunks and buffers make workers spill and combine many runs.
+        results = self._run_locally(
+            EventSourceCounter(self.app_context), 'page_views',
+            num_workers=2, num_partitions=3, chunk_size=4,
+            max_buffered_values=3)
+        self.assertEqual(expected, dict(results))
+        self.assertEqual(len(expected), len(results))
+
+    def test_student_aggregate_matches_pipeline(self):
+        self.load_course('simple_questions')
+        self.load_datastore('multiple')
+        self.run_aggregator_job()
+        expected = self.get_aggregated_data_by_email('foo@bar.com')
+        with common_utils.Namespace('ns_' + self.COURSE_NAME):
+            db.delete(student_aggregate.StudentAggregateEntity.all(
+                keys_only=True).fetch(1000))
+
+        self._run_locally(
+            student_aggregate.StudentAggregateGenerator(self.app_context),
+            'multiple', chunk_size=2, max_buffered_values=2)
+        self.assertEqual(
+            expected, self.get_aggregated_data_by_email('foo@bar.com'))
+
+
 class ClusteringTabTests(actions.TestBase):
     """Test for the clustering subtab of analytics tab."""
     COURSE_NAME = 'clustering_course'
@@ -1575,6 +1749,55 @@ class ClusteringGeneratorTests(actions.TestBase):
         ]
         self._check_hamming(cluster_vector, [], 1)
 
+    def test_hamming_max_distance(self):
+        """The calculation stops once the distance exceeds the maximum."""
+        cluster_vector = [
+            {clustering.DIM_TYPE: clustering.DIM_TYPE_UNIT,
+             clustering.DIM_ID: str(i),
+             clustering.DIM_HIGH: 7,
+             clustering.DIM_LOW: 3} for i in range(5)]
+        self.assertEqual(5, clustering.hamming_distance(cluster_vector, []))
+        self.assertEqual(3, clustering.hamming_distance(
+            cluster_vector, [], max_distance=2))
+
+    def test_cluster_distances(self):
+        """Distances to all clusters match the distance to each cluster."""
+        clusters = []
+        for cluster_id in range(4):
+            vector = []
+            for dim_id in range(cluster_id + 2):
+                vector.append({
+                    clustering.DIM_TYPE: clustering.DIM_TYPE_QUESTION,
+                    clustering.DIM_ID: str(dim_id),
+                    clustering.DIM_LOW: dim_id if dim_id % 2 else None,
+                    clustering.DIM_HIGH: dim_id + cluster_id})
+            vector.append({
+                clustering.DIM_TYPE: clustering.DIM_TYPE_UNIT,
+                clustering.DIM_ID: '1',
+                clustering.DIM_LOW: None,
+                clustering.DIM_HIGH: ''})
+            clusters.append({'id': cluster_id, 'vector': vector})
+        encoded = clustering.encode_cluster_ranges(clusters)
+        self.assertEqual(5, len(encoded['dimensions']))
+
+        max_distance = 1
+        for student_value in range(8):
+            student_vector = [
+                {clustering.DIM_TYPE: clustering.DIM_TYPE_QUESTION,
+                 clustering.DIM_ID: dim_id,
+                 clustering.DIM_VALUE: student_value + dim_id % 3}
+                for dim_id in range(5)]
+            expected = []
+            for cluster in clusters:
+                distance = clustering.hamming_distance(
+                    cluster['vector'], student_vector)
+                if distance <= max_distance:
+                    expected.append((cluster['id'], distance))
+            values = clustering.encode_student_vector(
+                encoded['dimensions'], student_vector)
+            self.assertEqual(expected, clustering.cluster_distances(
+                encoded, values, max_distance))
+
 
 class TestClusterStatisticsDataSource(actions.TestBase):
 
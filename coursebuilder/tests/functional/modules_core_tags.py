@@ -20,7 +20,9 @@ import os
 import StringIO
 
 import appengine_config
+from common import tags
 from controllers import sites
+from controllers import utils
 from models import config
 from models import courses
 from models import models
@@ -574,3 +576,73 @@ class TagsInclude(actions.TestBase):
             self._expect_content(content, response)
         finally:
             self.context.fs.delete(sub_path)
+
+
+class TagsFragmentCache(actions.TestBase):
+
+    def setUp(self):
+        super(TagsFragmentCache, self).setUp()
+
+        self.context = actions.simple_add_course(COURSE_NAME, ADMIN_EMAIL,
+                                                 COURSE_TITLE)
+        self.course = courses.Course(None, self.context)
+        self.unit = self.course.add_unit()
+        self.unit.title = 'The Unit'
+        self.unit.now_available = True
+        self.lesson = self.course.add_lesson(self.unit)
+        self.lesson.title = 'The Lesson'
+        self.lesson.now_available = True
+        self.lesson.objectives = (
+            '<p>Watch this</p>'
+            '<gcb-youtube videoid="Kdg2drcUjYI" instanceid="BHpNAOMuLdMn">'
+            '</gcb-youtube>')
+        self.course.save()
+
+    def tearDown(self):
+        config.Registry.test_overrides = {}
+        super(TagsFragmentCache, self).tearDown()
+
+    def _get_counts(self):
+        return (
+            tags.FRAGMENT_CACHE_HIT.value, tags.FRAGMENT_CACHE_PUT.value,
+            tags.FRAGMENT_CACHE_NOT_CACHEABLE.value)
+
+    def test_fragment_is_rendered_once(self):
+        _, puts, _ = self._get_counts()
+        response = self.get(LESSON_URL)
+        self.assertIn('youtube.com/embed/Kdg2drcUjYI', response.body)
+        self.assertLess(puts, tags.FRAGMENT_CACHE_PUT.value)
+
+        hits, puts, _ = self._get_counts()
+        response = self.get(LESSON_URL)
+        self.assertIn('youtube.com/embed/Kdg2drcUjYI', response.body)
+        self.assertLess(hits, tags.FRAGMENT_CACHE_HIT.value)
+        self.assertEquals(puts, tags.FRAGMENT_CACHE_PUT.value)
+
+    def test_fragment_is_rendered_again_if_tag_config_changes(self):
+        response = self.get(LESSON_URL)
+        self.assertNotIn('youtube_video.js', response.body)
+
+        config.Registry.test_overrides[
+            utils.CAN_PERSIST_TAG_EVENTS.name] = True
+        response = self.get(LESSON_URL)
+        self.assertIn('youtube_video.js', response.body)
+
+    def test_fragment_is_not_cached_if_disabled(self):
+        config.Registry.test_overrides[
+            tags.CAN_USE_FRAGMENT_CACHE.name] = False
+        hits, puts, _ = self._get_counts()
+        self.get(LESSON_URL)
+        self.get(LESSON_URL)
+        self.assertEquals((hits, puts), self._get_counts()[:2])
+
+    def test_fragment_with_uncacheable_tag_is_not_cached(self):
+        self.lesson.objectives += GCB_INCLUDE % 'no_such_file.html'
+        self.course.save()
+        _, _, not_cacheable = self._get_counts()
+        self.get(LESSON_URL)
+        response = self.get(LESSON_URL)
+        self.assertIn('youtube.com/embed/Kdg2drcUjYI', response.body)
+        self.assertIn('Invalid HTML tag: no_such_file.html', response.body)
+        self.assertLessEqual(
+            not_cacheable + 2, tags.FRAGMENT_CACHE_NOT_CACHEABLE.value)
@@ -0,0 +1,557 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests and benchmarks for UnitLessonCompletionTracker updates."""
+
+import logging
+import time
+
+from common import crypto
+from common import tags
+from common.utils import Namespace
+from controllers import lessons
+from controllers import utils
+from models import config
+from models import courses
+from models import models
+from models import progress
+from models import transforms
+from modules.skill_map import skill_map
+from tests.functional import actions
+
+COURSE_NAME = 'progress_tracker'
+NAMESPACE = 'ns_%s' % COURSE_NAME
+ADMIN_EMAIL = 'admin@foo.com'
+STUDENT_EMAIL = 'student@foo.com'
+
+NUM_UNITS = 10
+NUM_LESSONS_PER_UNIT = 20
+
+
+class _CallCounter(object):
+    """Wraps a function and counts calls to it."""
+
+    def __init__(self, func):
+        self.func = func
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+        return self.func(*args, **kwargs)
+
+
+class _CountingTransforms(object):
+    """Stands in for the transforms module, counting JSON parses and dumps."""
+
+    def __init__(self):
+        self.loads = _CallCounter(transforms.loads)
+        self.dumps = _CallCounter(transforms.dumps)
+
+    def __getattr__(self, name):
+        return getattr(transforms, name)
+
+
+class ProgressTrackerTestBase(actions.TestBase):
+    """Sets up a 200-lesson course and a registered student."""
+
+    def setUp(self):
+        super(ProgressTrackerTestBase, self).setUp()
+        context = actions.simple_add_course(
+            COURSE_NAME, ADMIN_EMAIL, 'Progress Tracker')
+        self.context = context
+        self.course = courses.Course(None, context)
+        self.units = []
+        for unit_index in xrange(NUM_UNITS):
+            unit = self.course.add_unit()
+            unit.title = 'Unit %s' % unit_index
+            unit.now_available = True
+            for lesson_index in xrange(NUM_LESSONS_PER_UNIT):
+                lesson = self.course.add_lesson(unit)
+                lesson.title = 'Lesson %s' % lesson_index
+                lesson.objectives = 'body of lesson'
+                lesson.now_available = True
+            self.units.append(unit)
+        self.course.save()
+
+        actions.login(STUDENT_EMAIL)
+        actions.register(self, STUDENT_EMAIL, COURSE_NAME)
+        with Namespace(NAMESPACE):
+            self.course = courses.Course(None, context)
+            self.tracker = self.course.get_progress_tracker()
+            self.student = models.Student.get_by_email(STUDENT_EMAIL)
+
+    def _all_unit_lesson_ids(self):
+        for unit in self.units:
+            for lesson in self.course.get_lessons(unit.unit_id):
+                yield unit.unit_id, lesson.lesson_id
+
+
+class ProgressDictParsingTest(ProgressTrackerTestBase):
+
+    def setUp(self):
+        super(ProgressDictParsingTest, self).setUp()
+        counting_transforms = _CountingTransforms()
+        self.loads = counting_transforms.loads
+        self.dumps = counting_transforms.dumps
+        self.swap(progress, 'transforms', counting_transforms)
+
+        # Measure with the hooks of the shipped modules registered; they
+        # parse and serialize progress of their own, which is not counted.
+        hooks = progress.UnitLessonCompletionTracker.POST_UPDATE_PROGRESS_HOOK
+        if skill_map.post_update_progress not in hooks:
+            self.swap(
+                progress.UnitLessonCompletionTracker,
+                'POST_UPDATE_PROGRESS_HOOK',
+                hooks + [skill_map.post_update_progress])
+
+    def test_event_cascade_parses_and_serializes_once(self):
+        with Namespace(NAMESPACE):
+            unit_id, lesson_id = next(self._all_unit_lesson_ids())
+            self.tracker.put_html_completed(self.student, unit_id, lesson_id)
+            self.assertLessEqual(self.loads.count, 1)
+            self.assertEquals(1, self.dumps.count)
+
+            progress_entity = self.tracker.get_or_create_progress(self.student)
+            self.assertEquals(
+                self.tracker.COMPLETED_STATE,
+                self.tracker.get_lesson_status(
+                    progress_entity, unit_id, lesson_id))
+            self.assertEquals(
+                self.tracker.IN_PROGRESS_STATE,
+                self.tracker.get_unit_status(progress_entity, unit_id))
+
+    def test_hooks_run_after_cascade_on_serialized_progress(self):
+        hook_calls = []
+
+        def hook(unused_course, unused_student, progress_entity,
+                 event_entity, unused_event_key):
+            hook_calls.append(
+                (event_entity, transforms.loads(progress_entity.value)))
+
+        self.swap(
+            progress.UnitLessonCompletionTracker,
+            'POST_UPDATE_PROGRESS_HOOK', [hook])
+        with Namespace(NAMESPACE):
+            unit_id, lesson_id = next(self._all_unit_lesson_ids())
+            self.tracker.put_html_completed(self.student, unit_id, lesson_id)
+            unit_key = self.tracker._get_unit_key(unit_id)
+        self.assertEquals(1, self.dumps.count)
+        self.assertTrue(hook_calls)
+        for _, progress_dict in hook_calls:
+            self.assertEquals(
+                self.tracker.IN_PROGRESS_STATE, progress_dict[unit_key])
+
+    def test_external_change_of_value_is_noticed(self):
+        with Namespace(NAMESPACE):
+            progress_entity = self.tracker.get_or_create_progress(self.student)
+            self.assertIsNone(
+                self.tracker.get_course_status(progress_entity))
+            progress_entity.value = transforms.dumps({'r.0': 2})
+            self.assertEquals(
+                2, self.tracker.get_course_status(progress_entity))
+
+    def test_progress_put_into_memcache_has_no_working_dict(self):
+        config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name] = True
+        try:
+            with Namespace(NAMESPACE):
+                unit_id, lesson_id = next(self._all_unit_lesson_ids())
+                self.tracker.put_html_completed(
+                    self.student, unit_id, lesson_id)
+                progress_entity = models.MemcacheManager.get(
+                    models.StudentPropertyEntity._memcache_key(
+                        models.StudentPropertyEntity.create_key(
+                            self.student.user_id,
+                            self.tracker.PROPERTY_KEY)))
+                self.assertIsNotNone(progress_entity)
+                self.assertFalse(
+                    hasattr(progress_entity, '_parsed_progress'))
+        finally:
+            del config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name]
+
+    def test_benchmark_events_on_200_lesson_course(self):
+        with Namespace(NAMESPACE):
+            num_events = 0
+            start = time.time()
+            for unit_id, lesson_id in self._all_unit_lesson_ids():
+                self.tracker.put_html_completed(
+                    self.student, unit_id, lesson_id)
+                num_events += 1
+            elapsed = time.time() - start
+
+            logging.info(
+                'Recorded %s events on a %s-lesson course in %.3fs; '
+                '%.2fms, %.2f JSON parses and %.2f JSON serializations '
+                'per event.', num_events, num_events, elapsed,
+                1000.0 * elapsed / num_events,
+                float(self.loads.count) / num_events,
+                float(self.dumps.count) / num_events)
+            self.assertLessEqual(self.loads.count, num_events)
+            self.assertEquals(num_events, self.dumps.count)
+
+            progress_entity = self.tracker.get_or_create_progress(self.student)
+            self.assertEquals(
+                self.tracker.COMPLETED_STATE,
+                self.tracker.get_course_status(progress_entity))
+
+
+class TwoStudentsTestBase(ProgressTrackerTestBase):
+    """Adds a second registered student."""
+
+    OTHER_STUDENT_EMAIL = 'other_student@foo.com'
+
+    def setUp(self):
+        super(TwoStudentsTestBase, self).setUp()
+        actions.logout()
+        actions.login(self.OTHER_STUDENT_EMAIL)
+        actions.register(self, self.OTHER_STUDENT_EMAIL, COURSE_NAME)
+        with Namespace(NAMESPACE):
+            self.other_student = models.Student.get_by_email(
+                self.OTHER_STUDENT_EMAIL)
+
+    def _make_events(self, students):
+        events = []
+        for unit_id, lesson_id in list(self._all_unit_lesson_ids())[:25]:
+            for student in students:
+                events.append(self.tracker.make_html_completed_event(
+                    student, unit_id, lesson_id))
+        return events
+
+    def _get_progress_dict(self, student):
+        with Namespace(NAMESPACE):
+            return transforms.loads(
+                self.tracker.get_or_create_progress(student).value)
+
+
+class BatchedProgressEventsTest(TwoStudentsTestBase):
+
+    def test_put_events_matches_individual_puts(self):
+        with Namespace(NAMESPACE):
+            for _, event_entity, event_key in self._make_events(
+                    [self.student]):
+                self.tracker._put_event(self.student, event_entity, event_key)
+            self.tracker.put_events(self._make_events([self.other_student]))
+        self.assertEquals(
+            self._get_progress_dict(self.student),
+            self._get_progress_dict(self.other_student))
+
+    def test_put_events_writes_all_students_with_one_put(self):
+        puts = _CallCounter(models.entities_put)
+        self.swap(models, 'entities_put', puts)
+        with Namespace(NAMESPACE):
+            self.tracker.put_events(
+                self._make_events([self.student, self.other_student]))
+        self.assertEquals(1, puts.count)
+
+        for student in [self.student, self.other_student]:
+            progress_dict = self._get_progress_dict(student)
+            self.assertEquals(
+                self.tracker.COMPLETED_STATE,
+                progress_dict[self.tracker._get_unit_key(
+                    self.units[0].unit_id)])
+            self.assertEquals(
+                self.tracker.IN_PROGRESS_STATE,
+                progress_dict[self.tracker._get_unit_key(
+                    self.units[1].unit_id)])
+
+    def test_put_events_ignores_invalid_events(self):
+        self.assertIsNone(self.tracker.make_html_completed_event(
+            self.student, 'bad_unit', 'bad_lesson'))
+        puts = _CallCounter(models.entities_put)
+        self.swap(models, 'entities_put', puts)
+        with Namespace(NAMESPACE):
+            self.tracker.put_events([
+                (self.student, 'no_such_entity', 'u.1'),
+            ])
+        self.assertEquals(0, puts.count)
+
+
+class EventsBatchHandlerTest(ProgressTrackerTestBase):
+
+    def setUp(self):
+        super(EventsBatchHandlerTest, self).setUp()
+        config.Registry.test_overrides[
+            utils.CAN_PERSIST_ACTIVITY_EVENTS.name] = True
+        self.url = '/%s/rest/events/batch' % COURSE_NAME
+
+    def tearDown(self):
+        config.Registry.test_overrides = {}
+        super(EventsBatchHandlerTest, self).tearDown()
+
+    def _make_request(self, events, xsrf_token=None):
+        if xsrf_token is None:
+            xsrf_token = crypto.XsrfTokenManager.create_xsrf_token(
+                'event-post')
+        return {'request': transforms.dumps({
+            'xsrf_token': xsrf_token, 'events': events})}
+
+    def _make_lesson_event(self, unit_id, lesson_id):
+        return {
+            'source': 'attempt-lesson',
+            'payload': transforms.dumps({
+                'location':
+                    'http://localhost:8081/%s/unit?unit=%s&lesson=%s' % (
+                        COURSE_NAME, unit_id, lesson_id)})}
+
+    def test_batch_is_recorded_with_one_put(self):
+        batches = models.EVENTS_BATCH_PUT.value
+        put_events = _CallCounter(self.tracker.put_events)
+        self.swap(
+            progress.UnitLessonCompletionTracker, 'put_events',
+            lambda unused_self, events: put_events(events))
+
+        unit_lesson_ids = list(self._all_unit_lesson_ids())[:3]
+        response = self.post(self.url, self._make_request([
+            self._make_lesson_event(unit_id, lesson_id)
+            for unit_id, lesson_id in unit_lesson_ids]))
+        self.assertEquals(200, response.status_int)
+        self.assertFalse(response.body)
+        self.assertEquals(batches + 1, models.EVENTS_BATCH_PUT.value)
+        self.assertEquals(1, put_events.count)
+
+        with Namespace(NAMESPACE):
+            events = models.EventEntity.all().fetch(10)
+            self.assertEquals(3, len(events))
+            for event in events:
+                self.assertEquals('attempt-lesson', event.source)
+                self.assertEquals(self.student.user_id, event.user_id)
+                self.assertIn('loc', transforms.loads(event.data))
+
+            progress_entity = self.tracker.get_or_create_progress(self.student)
+            for unit_id, lesson_id in unit_lesson_ids:
+                self.assertEquals(
+                    self.tracker.COMPLETED_STATE,
+                    self.tracker.get_lesson_status(
+                        progress_entity, unit_id, lesson_id))
+
+    def test_batch_requires_xsrf_token(self):
+        batches = lessons.COURSE_EVENT_BATCHES_RECEIVED.value
+        response = self.post(self.url, self._make_request(
+            [self._make_lesson_event(1, 2)], xsrf_token='bad'))
+        self.assertIn('"status": 403', response.body)
+        self.assertEquals(
+            batches, lessons.COURSE_EVENT_BATCHES_RECEIVED.value)
+        with Namespace(NAMESPACE):
+            self.assertEquals(0, models.EventEntity.all().count())
+
+    def test_too_large_batch_is_rejected(self):
+        response = self.post(self.url, self._make_request(
+            [self._make_lesson_event(1, 2)] * (
+                lessons.MAX_EVENTS_PER_BATCH + 1)))
+        self.assertIn('"status": 400', response.body)
+        with Namespace(NAMESPACE):
+            self.assertEquals(0, models.EventEntity.all().count())
+
+    def test_events_without_string_source_and_payload_are_rejected(self):
+        for event in [
+            {'source': 'attempt-lesson'}, {'payload': '{}'},
+            {'source': 'attempt-lesson', 'payload': {}},
+            {'source': None, 'payload': '{}'}]:
+            response = self.post(self.url, self._make_request(
+                [self._make_lesson_event(1, 2), event]))
+            self.assertIn('"status": 400', response.body)
+        with Namespace(NAMESPACE):
+            self.assertEquals(0, models.EventEntity.all().count())
+
+
+class CourseStructureIndexTest(ProgressTrackerTestBase):
+
+    def test_lesson_html_is_parsed_once_per_lesson(self):
+        parses = _CallCounter(tags.get_components_from_html)
+        self.swap(tags, 'get_components_from_html', parses)
+        with Namespace(NAMESPACE):
+            unit_id, lesson_id = next(self._all_unit_lesson_ids())
+            for _ in xrange(3):
+                self.tracker.put_html_completed(
+                    self.student, unit_id, lesson_id)
+        self.assertEquals(1, parses.count)
+
+    def test_index_matches_course(self):
+        with Namespace(NAMESPACE):
+            index = progress.CourseStructureIndex.get(self.course)
+            self.assertIs(
+                index, progress.CourseStructureIndex.get(self.course))
+            for unit in self.units:
+                self.assertEquals(
+                    [(lesson.lesson_id, lesson.has_activity)
+                     for lesson in self.course.get_lessons(unit.unit_id)],
+                    index.get_lessons(str(unit.unit_id)))
+                self.assertEquals(
+                    (None, None), index.get_unit_assessment_ids(unit.unit_id))
+
+    def test_index_is_rebuilt_when_course_is_saved(self):
+        with Namespace(NAMESPACE):
+            course = courses.Course(None, self.context)
+            index = progress.CourseStructureIndex.get(course)
+            unit_id = self.units[0].unit_id
+            self.assertEquals(
+                NUM_LESSONS_PER_UNIT, len(index.get_lessons(unit_id)))
+
+            assessment = course.add_assessment()
+            unit = course.find_unit_by_id(unit_id)
+            unit.pre_assessment = assessment.unit_id
+            course.add_lesson(unit)
+            self.assertIsNot(index, progress.CourseStructureIndex.get(course))
+            course.save()
+
+            index = progress.CourseStructureIndex.get(course)
+            self.assertEquals(
+                NUM_LESSONS_PER_UNIT + 1, len(index.get_lessons(unit_id)))
+            self.assertEquals(
+                (assessment.unit_id, None),
+                index.get_unit_assessment_ids(unit_id))
+            self.assertEquals(
+                unit_id, index.get_parent_unit_id(str(assessment.unit_id)))
+
+    def test_index_is_shared_by_courses_loaded_from_process_cache(self):
+        config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name] = True
+        try:
+            with Namespace(NAMESPACE):
+                loaded = [courses.Course(None, self.context)
+                          for _ in xrange(3)]
+                self.assertIs(
+                    progress.CourseStructureIndex.get(loaded[1]),
+                    progress.CourseStructureIndex.get(loaded[2]))
+        finally:
+            del config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name]
+
+
+class _OutlineHandler(object):
+    """Just enough of a handler to build a course outline."""
+
+    def __init__(self, course):
+        self.course = course
+        self.template_value = {}
+
+    def get_course(self):
+        return self.course
+
+    def get_progress_tracker(self):
+        return self.course.get_progress_tracker()
+
+    def get_track_matching_student(self, student):
+        return self.course.get_track_matching_student(student)
+
+
+class CourseOutlineTest(ProgressTrackerTestBase):
+
+    def setUp(self):
+        super(CourseOutlineTest, self).setUp()
+        with Namespace(NAMESPACE):
+            course = courses.Course(None, self.context)
+            unit = course.find_unit_by_id(self.units[0].unit_id)
+            self.pre_assessment = course.add_assessment()
+            self.post_assessment = course.add_assessment()
+            unit.pre_assessment = self.pre_assessment.unit_id
+            unit.post_assessment = self.post_assessment.unit_id
+            course.save()
+
+            self.course = courses.Course(None, self.context)
+            self.tracker = self.course.get_progress_tracker()
+            unit_id, lesson_id = next(self._all_unit_lesson_ids())
+            self.tracker.put_html_completed(self.student, unit_id, lesson_id)
+
+    def test_outline_matches_course(self):
+        with Namespace(NAMESPACE):
+            handler = _OutlineHandler(self.course)
+            lessons.add_course_outline_to_template(handler, self.student)
+            outline = handler.template_value['course_outline']
+
+            self.assertEquals(
+                [unit.unit_id for unit in self.units],
+                [item[0].unit_id for item in outline])
+            for unit, unit_lessons, lesson_progress, pre, post in outline:
+                self.assertEquals(
+                    self.course.get_lessons(unit.unit_id), unit_lessons)
+                self.assertEquals(
+                    self.tracker.get_lesson_progress(
+                        self.student, unit.unit_id), lesson_progress)
+                if unit.unit_id == self.units[0].unit_id:
+                    self.assertEquals(
+                        self.pre_assessment.unit_id, pre.unit_id)
+                    self.assertEquals(
+                        self.post_assessment.unit_id, post.unit_id)
+                else:
+                    self.assertIsNone(pre)
+                    self.assertIsNone(post)
+
+            self.assertEquals(
+                self.tracker.IN_PROGRESS_STATE,
+                handler.template_value['course_progress'])
+            self.assertEquals(
+                self.tracker.get_unit_progress(self.student),
+                handler.template_value['unit_progress'])
+
+    def test_progress_is_loaded_once(self):
+        loads = _CallCounter(models.StudentPropertyEntity.get)
+        self.swap(models.StudentPropertyEntity, 'get', loads)
+        with Namespace(NAMESPACE):
+            handler = _OutlineHandler(self.course)
+            lessons.add_course_outline_to_template(handler, self.student)
+        self.assertEquals(1, loads.count)
+
+    def test_transient_student_gets_outline_without_progress(self):
+        with Namespace(NAMESPACE):
+            handler = _OutlineHandler(self.course)
+            lessons.add_course_outline_to_template(
+                handler, utils.TRANSIENT_STUDENT)
+            outline = handler.template_value['course_outline']
+            self.assertEquals(NUM_UNITS, len(outline))
+            self.assertEquals(
+                [None] * NUM_UNITS, [item[2] for item in outline])
+            self.assertEquals({}, handler.template_value['unit_progress'])
+            self.assertNotIn('course_progress', handler.template_value)
+
+
+class GetProgressMultiTest(TwoStudentsTestBase):
+
+    def test_matches_per_student_reads(self):
+        with Namespace(NAMESPACE):
+            self.tracker.put_events(self._make_events([self.student]))
+            result = self.tracker.get_progress_multi(
+                [self.student.user_id, self.other_student.user_id])
+
+            for student in [self.student, self.other_student]:
+                student_progress = result[student.user_id]
+                self.assertEquals(
+                    self.tracker.get_unit_progress(student),
+                    student_progress['units'])
+                self.assertEquals(NUM_UNITS, len(student_progress['lessons']))
+                for unit in self.units:
+                    self.assertEquals(
+                        self.tracker.get_lesson_progress(
+                            student, unit.unit_id),
+                        student_progress['lessons'][unit.unit_id])
+
+            self.assertEquals(
+                self.tracker.COMPLETED_STATE,
+                result[self.student.user_id]['units'][self.units[0].unit_id])
+
+    def test_reads_in_batches_without_creating_records(self):
+        gets = _CallCounter(models.StudentPropertyEntity.get_by_key_name)
+        self.swap(models.StudentPropertyEntity, 'get_by_key_name', gets)
+        self.swap(
+            progress.UnitLessonCompletionTracker,
+            'GET_PROGRESS_MULTI_BATCH_SIZE', 2)
+        student_ids = ['no_such_student_%s' % i for i in xrange(4)] + [
+            self.student.user_id]
+        with Namespace(NAMESPACE):
+            result = self.tracker.get_progress_multi(student_ids)
+            self.assertEquals(3, gets.count)
+            self.assertEquals(set(student_ids), set(result.keys()))
+            self.assertEquals(
+                0, result['no_such_student_0']['units'][self.units[0].unit_id])
+            self.assertIsNone(models.StudentPropertyEntity.get_by_key_name(
+                models.StudentPropertyEntity.create_key(
+                    'no_such_student_0',
+                    self.tracker.PROPERTY_KEY)))
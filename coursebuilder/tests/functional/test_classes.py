@@ -1136,6 +1136,89 @@ class InfrastructureTest(actions.TestBase):
         finally:
             namespace_manager.set_namespace(old_namespace)
 
+    def _count_full_reloads(self):
+        counter = {'calls': 0}
+        # pylint: disable=protected-access
+        load_from_db = config.Registry._load_from_db.im_func
+
+        def _load_from_db(cls):
+            counter['calls'] += 1
+            load_from_db(cls)
+
+        self.swap(config.Registry, '_load_from_db', classmethod(_load_from_db))
+        return counter
+
+    def test_config_change_by_other_instance_reloads_changed_only(self):
+        prop = config.ConfigProperty(
+            'gcb_prop_versioned', config.TYPE_STR, '', default_value='foo')
+        config.Registry.get_overrides(force_update=True)
+        counter = self._count_full_reloads()
+
+        # Nothing changed; nothing is reloaded.
+        config.Registry.last_version_check_time = 0
+        self.assertEqual('foo', prop.value)
+
+        # Change the property the way other instance does: it persists the
+        # entity and bumps the version, but does not tell our registry.
+        entity = config.ConfigPropertyEntity(key_name=prop.name)
+        entity.value = 'bar'
+        entity.is_draft = False
+        db.put(entity)
+        config.Registry._bump_version(prop.name)  # pylint: disable=W0212
+        config.Registry.last_version_check_time = 0
+        self.assertEqual('bar', prop.value)
+
+        db.delete(entity)
+        config.Registry._bump_version(prop.name)  # pylint: disable=W0212
+        config.Registry.last_version_check_time = 0
+        self.assertEqual('foo', prop.value)
+        self.assertEqual(0, counter['calls'])
+
+    def test_config_change_to_invalid_value_drops_override(self):
+        prop = config.ConfigProperty(
+            'gcb_prop_versioned', int, '', default_value=1)
+        entity = config.ConfigPropertyEntity(key_name=prop.name)
+        entity.value = '2'
+        entity.is_draft = False
+        db.put(entity)
+        config.Registry.get_overrides(force_update=True)
+        self.assertEqual(2, prop.value)
+
+        entity.value = 'not a number'
+        db.put(entity)
+        config.Registry._bump_version(prop.name)  # pylint: disable=W0212
+        config.Registry.last_version_check_time = 0
+        self.assertEqual(1, prop.value)
+
+    def test_config_reloads_all_if_changes_are_unknown(self):
+        prop = config.ConfigProperty(
+            'gcb_prop_versioned', config.TYPE_STR, '', default_value='foo')
+        config.Registry.get_overrides(force_update=True)
+        counter = self._count_full_reloads()
+
+        entity = config.ConfigPropertyEntity(key_name=prop.name)
+        entity.value = 'bar'
+        entity.is_draft = False
+        db.put(entity)
+        memcache.flush_all()
+        memcache.incr(config.VERSION_MEMCACHE_KEY, initial_value=1000)
+
+        config.Registry.last_version_check_time = 0
+        self.assertEqual('bar', prop.value)
+        self.assertEqual(1, counter['calls'])
+
+    def test_config_delete_is_applied_locally(self):
+        prop = config.ConfigProperty(
+            'gcb_prop_versioned', config.TYPE_STR, '', default_value='foo')
+        entity = config.ConfigPropertyEntity(key_name=prop.name)
+        entity.value = 'bar'
+        entity.is_draft = False
+        entity.put()
+        self.assertEqual('bar', prop.value)
+
+        entity.delete()
+        self.assertEqual('foo', prop.value)
+
 
 class AdminAspectTest(actions.TestBase):
     """Test site from the Admin perspective."""
@@ -3787,6 +3870,14 @@ class EtlTestEntityIllegal(entities.BaseEntity):
     thingy = student_work.KeyProperty()
 
 
+class EtlTestEntityTagged(entities.BaseEntity):
+    tags = db.StringListProperty(indexed=False)
+
+
+class _UploadInterruptedError(Exception):
+    pass
+
+
 class EtlMainTestCase(testing.EtlTestBase, DatastoreBackedCourseTest):
     """Tests tools/etl/etl.py's main()."""
 
@@ -4568,6 +4659,18 @@ class EtlMainTestCase(testing.EtlTestBase, DatastoreBackedCourseTest):
         self.assertIn('All 2 entities already uploaded; skipping',
                       self.get_log())
 
+    def _interrupt_upload_after_batches(self, upload_batch, num_batches):
+        calls = []
+
+        def interrupted_upload_batch(entity_class, *args, **kwargs):
+            if entity_class == EtlTestEntityPii:
+                calls.append(entity_class)
+                if len(calls) > num_batches:
+                    raise _UploadInterruptedError()
+            return upload_batch(entity_class, *args, **kwargs)
+
+        self.swap(etl, '_upload_batch', interrupted_upload_batch)
+
     def test_upload_resumption_with_batch_quantity(self):
         sites.setup_courses(self.raw)
         with Namespace(self.namespace):
@@ -4576,37 +4679,91 @@ class EtlMainTestCase(testing.EtlTestBase, DatastoreBackedCourseTest):
             db.put(batch_one)
             db.put(batch_two)
         self._download_archive()
+        upload_batch = etl._upload_batch
 
-        # Simulate 1st batch having partially succeeded, 2nd batch not at all.
+        # Simulate 1st batch having partially succeeded, and no progress
+        # having been recorded; all entities are checked.
         self._clear_datastore()
         with Namespace(self.namespace):
             db.put([x for x in batch_one if x.score % 2])
-        self._upload_archive(['--resume'])
+        self._interrupt_upload_after_batches(upload_batch, 1)
+        with self.assertRaises(_UploadInterruptedError):
+            self._upload_archive(['--resume'])
         self.assertIn('Resuming upload at item number 0 of 40.',
                       self.get_log())
 
-        # Simulate 1st batch having fully succeeded, 2nd batch not at all.
-        self._clear_datastore()
+        # Simulate 2nd batch having partially succeeded; the 1st batch is
+        # skipped as recorded.
         with Namespace(self.namespace):
-            db.put(batch_one)
+            db.put([x for x in batch_two if x.score % 2])
+        self.swap(etl, '_upload_batch', upload_batch)
         self._upload_archive(['--resume'])
         self.assertIn('Resuming upload at item number 20 of 40.',
                       self.get_log())
-
-        # Simulate 1st batch having fully succeeded, 2nd batch partial
-        self._clear_datastore()
         with Namespace(self.namespace):
-            db.put(batch_one)
-            db.put([x for x in batch_one if x.score % 2])
-        self._upload_archive(['--resume'])
-        self.assertIn('Resuming upload at item number 20 of 40.',
-                      self.get_log())
+            self.assertEquals(40, EtlTestEntityPii.all().count())
 
         # Upload again; everything should be seen to be present.
         self._upload_archive(['--resume'])
         self.assertIn('All 40 entities already uploaded; skipping',
                       self.get_log())
 
+    def test_upload_resumption_ignores_progress_for_other_archive(self):
+        sites.setup_courses(self.raw)
+        with Namespace(self.namespace):
+            db.put(self._build_entity_batch())
+        self._download_archive()
+        self._clear_datastore()
+        self._upload_archive(['--resume'])
+        self.assertIn('Resuming upload at item number 0 of 20.',
+                      self.get_log())
+
+        # A new archive at the same path has different rows; the recorded
+        # progress does not match them and is not used.
+        self._clear_datastore()
+        with Namespace(self.namespace):
+            db.put(self._build_entity_batch())
+        self._download_archive(['--force_overwrite'])
+        self._clear_datastore()
+        self._upload_archive(['--resume'])
+        self.assertNotIn('All 20 entities already uploaded', self.get_log())
+        with Namespace(self.namespace):
+            self.assertEquals(20, EtlTestEntityPii.all().count())
+
+    def test_upload_row_ending_in_list(self):
+        sites.setup_courses(self.raw)
+        with Namespace(self.namespace):
+            db.put([EtlTestEntityTagged(key_name='a', tags=['t0']),
+                    EtlTestEntityTagged(key_name='b', tags=['t1', 't2'])])
+        self._download_archive()
+
+        # The last row ends with the list, next to the closing ]} line.
+        zip_archive = zipfile.ZipFile(self.archive_path)
+        lines = zip_archive.read('models/EtlTestEntityTagged.json').split('\n')
+        zip_archive.close()
+        self.assertTrue(lines[-3].endswith(']}'))
+        self.assertEquals(']}', lines[-2])
+
+        self._clear_datastore()
+        self._upload_archive()
+        with Namespace(self.namespace):
+            self.assertEquals(
+                ['t1', 't2'], EtlTestEntityTagged.get_by_key_name('b').tags)
+
+    def test_upload_without_resumption_saves_no_progress(self):
+        sites.setup_courses(self.raw)
+        with Namespace(self.namespace):
+            db.put(self._build_entity_batch())
+        self._download_archive()
+        self._clear_datastore()
+        self._upload_archive()
+        progress_path = self.archive_path + etl._UPLOAD_PROGRESS_SUFFIX
+        self.assertFalse(os.path.exists(progress_path))
+
+        self._clear_datastore()
+        self._upload_archive(['--resume'])
+        self.assertTrue(os.path.exists(progress_path))
+
     def test_is_identity_transform_when_privacy_false(self):
         self.assertEqual(
             1, etl._get_privacy_transform_fn(False, 'no_effect')(1))
@@ -4749,6 +4906,22 @@ class TransformsJsonFileTestCase(actions.TestBase):
         self.assertEqual(
             {'rows': [self.first, self.second]}, self.reader.read())
 
+    def test_iter_lines_of_file_with_rows_ending_in_lists(self):
+        third = {'e': ['f', 'g']}
+        self.writer.open('w')
+        self.writer.write(third)
+        self.writer.write(self.second)
+        self.writer.write(third)
+        self.writer.close()
+        self.reader.open('r')
+        self.assertEqual(
+            {'rows': [third, self.second, third]}, self.reader.read())
+        with open(self.path) as stream:
+            self.assertEqual(
+                [third, self.second, third],
+                [transforms.loads(line)
+                 for line in transforms.JsonFile.iter_lines(stream)])
+
 
 class ImportAssessmentTests(DatastoreBackedCourseTest):
     """Functional tests for assessments."""
@@ -0,0 +1,162 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests and benchmark for dispatching requests to course handlers."""
+
+import logging
+import time
+import unittest
+
+from controllers import sites
+from models import config
+
+from google.appengine.ext import zipserve
+
+NUM_COURSES = 40
+NUM_ROUTES = 300
+NUM_ZIP_ROUTES = 20
+NUM_DISPATCHES = 20000
+
+
+class FakeHandler(object):
+
+    def __init__(self):
+        self.app_context = None
+
+
+class FakeZipHandler(zipserve.ZipHandler):
+
+    def __init__(self):
+        super(FakeZipHandler, self).__init__()
+        self.app_context = None
+
+
+def _make_routes():
+    routes = [('/', FakeHandler)]
+    for index in xrange(NUM_ROUTES):
+        routes.append(('/section%s/page%s' % (index % 10, index), FakeHandler))
+    for index in xrange(NUM_ZIP_ROUTES):
+        routes.append(('/static/lib%s' % index, FakeZipHandler))
+        routes.append(('/static/lib%s/sub' % index, FakeZipHandler))
+    return routes
+
+
+def _get_handler_factory_by_partial_paths(urls_map, path):
+    """Resolves a path the way it was done before routes were compiled."""
+    if path in urls_map:
+        return urls_map[path]
+    candidate = None
+    partial_path = ''
+    for part in path.split('/'):
+        if part:
+            partial_path += '/' + part
+            if partial_path in urls_map:
+                handler = urls_map[partial_path]
+                if (isinstance(handler, zipserve.ZipHandler) or
+                    issubclass(handler, zipserve.ZipHandler)):
+                    candidate = handler
+    return candidate
+
+
+def _make_paths():
+    paths = []
+    for index in xrange(0, NUM_ROUTES, 7):
+        paths.append('/section%s/page%s' % (index % 10, index))
+        paths.append('/section%s/page%s/' % (index % 10, index))
+    for index in xrange(NUM_ZIP_ROUTES):
+        paths.append('/static/lib%s/js/main.js' % index)
+        paths.append('/static/lib%s/sub/css/main.css' % index)
+    paths += ['/', '/unknown', '/static', '/static/none/a.js', '/a//b']
+    return paths
+
+
+class RoutingTrieTests(unittest.TestCase):
+    """Checks compiled routes resolve paths as before."""
+
+    def test_same_handlers_as_partial_path_match(self):
+        routes = _make_routes()
+        urls_map = dict(routes)
+        trie = sites.RoutingTrie(urls_map)
+        for path in _make_paths():
+            self.assertEqual(
+                _get_handler_factory_by_partial_paths(urls_map, path),
+                trie.get_handler_factory(path), msg=path)
+
+    def test_longest_prefix_wins(self):
+        trie = sites.RoutingTrie(dict(_make_routes()))
+        self.assertEqual(
+            FakeZipHandler, trie.get_handler_factory('/static/lib1/sub/a.js'))
+        self.assertIsNone(trie.get_handler_factory('/section1/page1/a.js'))
+        self.assertIsNone(trie.get_handler_factory('/static'))
+
+
+class RoutingBenchmark(unittest.TestCase):
+    """Measures the cost of dispatching requests to course handlers."""
+
+    def setUp(self):
+        super(RoutingBenchmark, self).setUp()
+        config.Registry.test_overrides[
+            sites.GCB_COURSES_CONFIG.name] = ','.join(
+                'course:/course%s::ns_course%s' % (index, index)
+                for index in xrange(NUM_COURSES))
+        sites.ApplicationRequestHandler.bind(_make_routes())
+
+    def tearDown(self):
+        sites.ApplicationRequestHandler.bind([])
+        config.Registry.test_overrides = {}
+        super(RoutingBenchmark, self).tearDown()
+
+    def _dispatch_all(self, urls):
+        app_handler = sites.ApplicationRequestHandler()
+        app_handler.can_handle_course_requests = lambda context: True
+        handled = 0
+        start = time.time()
+        for url in urls:
+            sites.set_path_info(url)
+            try:
+                if app_handler.get_handler():
+                    handled += 1
+            finally:
+                sites.unset_path_info()
+        return handled, time.time() - start
+
+    def test_dispatch_cost(self):
+        paths = _make_paths()
+        urls = [
+            '/course%s%s' % (index % NUM_COURSES, paths[index % len(paths)])
+            for index in xrange(NUM_DISPATCHES)]
+
+        handled, trie_secs = self._dispatch_all(urls)
+
+        # pylint: disable=protected-access
+        urls_map = sites.ApplicationRequestHandler.urls_map
+        original = sites.ApplicationRequestHandler._get_handler_factory_for_path
+        sites.ApplicationRequestHandler._get_handler_factory_for_path = (
+            lambda unused_self, path: _get_handler_factory_by_partial_paths(
+                urls_map, path))
+        try:
+            handled_before, before_secs = self._dispatch_all(urls)
+        finally:
+            sites.ApplicationRequestHandler._get_handler_factory_for_path = (
+                original)
+
+        logging.info(
+            'Dispatched %s requests to %s courses and %s routes: '
+            'compiled routes %.3fs, partial paths %.3fs.',
+            len(urls), NUM_COURSES, len(urls_map), trie_secs, before_secs)
+        self.assertEqual(handled_before, handled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for request tracing in models.counters."""
+
+import unittest
+
+from models import counters
+
+
+@counters.traced('outer')
+def _outer(inner_calls):
+    for _ in xrange(inner_calls):
+        _inner()
+
+
+@counters.traced('inner')
+def _inner():
+    with counters.Tracer.span('leaf'):
+        pass
+
+
+class TracerTests(unittest.TestCase):
+
+    def setUp(self):
+        super(TracerTests, self).setUp()
+        self.rpc_count = 0
+        self.old_get_request_rpc_count = counters.get_request_rpc_count
+        counters.get_request_rpc_count = lambda: self.rpc_count
+
+    def tearDown(self):
+        counters.Tracer.end_request()
+        counters.Tracer.clear_recent()
+        counters.get_request_rpc_count = self.old_get_request_rpc_count
+        super(TracerTests, self).tearDown()
+
+    def test_nothing_is_recorded_unless_request_is_traced(self):
+        self.assertFalse(counters.Tracer.is_tracing())
+        _outer(3)
+        self.assertIsNone(counters.Tracer.end_request())
+
+    def test_spans_are_nested(self):
+        counters.Tracer.begin_request('GET /')
+        _outer(2)
+        trace = counters.Tracer.end_request()
+
+        self.assertEquals('GET /', trace.name)
+        self.assertEquals(
+            ['outer'], [span.name for span in trace.root.children])
+        outer = trace.root.children[0]
+        self.assertEquals(
+            ['inner', 'inner'], [span.name for span in outer.children])
+        self.assertEquals(
+            ['leaf'], [span.name for span in outer.children[0].children])
+        self.assertEquals(6, trace.span_count)
+        self.assertFalse(counters.Tracer.is_tracing())
+
+    def test_span_is_closed_on_exception(self):
+
+        @counters.traced('failing')
+        def failing():
+            raise ValueError()
+
+        counters.Tracer.begin_request('GET /')
+        with self.assertRaises(ValueError):
+            failing()
+        _inner()
+        trace = counters.Tracer.end_request()
+        self.assertEquals(
+            ['failing', 'inner'],
+            [span.name for span in trace.root.children])
+        self.assertIsNotNone(trace.root.children[0].end_time)
+
+    def test_spans_count_rpcs(self):
+        counters.Tracer.begin_request('GET /')
+        with counters.Tracer.span('a'):
+            self.rpc_count += 2
+            with counters.Tracer.span('b'):
+                self.rpc_count += 1
+        self.rpc_count += 4
+        trace = counters.Tracer.end_request()
+
+        span_a = trace.root.children[0]
+        self.assertEquals(7, trace.root.rpc_count)
+        self.assertEquals(3, span_a.rpc_count)
+        self.assertEquals(1, span_a.children[0].rpc_count)
+
+    def test_text_groups_siblings_with_the_same_name(self):
+        counters.Tracer.begin_request('GET /')
+        _outer(5)
+        trace = counters.Tracer.end_request()
+        lines = trace.to_text().split('\n')
+        self.assertEquals(4, len(lines))
+        self.assertTrue(lines[0].startswith('GET /: '))
+        self.assertTrue(lines[1].startswith('  outer: '))
+        self.assertTrue(lines[2].startswith('    inner x 5: '))
+        self.assertTrue(lines[3].startswith('      leaf x 5: '))
+
+    def test_number_of_spans_is_capped(self):
+        counters.Tracer.begin_request('GET /')
+        for _ in xrange(counters.RequestTrace.MAX_SPANS):
+            _inner()
+        trace = counters.Tracer.end_request()
+        self.assertEquals(counters.RequestTrace.MAX_SPANS, trace.span_count)
+        self.assertEquals(
+            counters.RequestTrace.MAX_SPANS + 1, trace.dropped_span_count)
+        self.assertIn('more spans not recorded', trace.to_text())
+
+    def test_recent_traces_are_kept(self):
+        for index in xrange(counters.Tracer.MAX_RECENT_TRACES + 1):
+            counters.Tracer.begin_request('GET /%s' % index)
+            counters.Tracer.keep(counters.Tracer.end_request())
+        recent = counters.Tracer.get_recent()
+        self.assertEquals(counters.Tracer.MAX_RECENT_TRACES, len(recent))
+        self.assertEquals(
+            'GET /%s' % counters.Tracer.MAX_RECENT_TRACES, recent[0].name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests and benchmark for serialization of course mementos."""
+
+import logging
+import pickle
+import unittest
+
+from models import courses
+
+
+class CustomValue(object):
+    """A value that can be pickled, but not marshalled."""
+
+    def __eq__(self, other):
+        return isinstance(other, CustomValue)
+
+
+def _make_synthetic_course(num_units, num_lessons_per_unit):
+    """Makes a CachedCourse13 similar in shape to a real course."""
+    units = []
+    lessons = []
+    unit_id_to_lesson_ids = {}
+    next_id = 1
+    for unit_index in xrange(num_units):
+        unit = courses.Unit13()
+        unit.unit_id = next_id
+        unit.type = 'U'
+        unit.title = u'Unit %s' % unit_index
+        unit.description = u'Description of unit %s.' % unit_index
+        unit.now_available = True
+        unit._index = unit_index + 1  # pylint: disable=protected-access
+        units.append(unit)
+        next_id += 1
+
+        lesson_ids = []
+        for lesson_index in xrange(num_lessons_per_unit):
+            lesson = courses.Lesson13()
+            lesson.lesson_id = next_id
+            lesson.unit_id = unit.unit_id
+            lesson.title = u'Lesson %s.%s' % (unit_index, lesson_index)
+            lesson.objectives = u'<p>Objectives %s</p>' % lesson_index * 10
+            lesson.now_available = True
+            lesson.properties = {'key': lesson_index}
+            lesson._index = lesson_index + 1  # pylint: disable=protected-access
+            lessons.append(lesson)
+            lesson_ids.append(str(lesson.lesson_id))
+            next_id += 1
+        unit_id_to_lesson_ids[str(unit.unit_id)] = lesson_ids
+
+    return courses.CachedCourse13(
+        next_id=next_id, units=units, lessons=lessons,
+        unit_id_to_lesson_ids=unit_id_to_lesson_ids)
+
+
+class CachedCourse13SerializationTests(unittest.TestCase):
+    """Checks compact serialization of CachedCourse13 round-trips."""
+
+    def _assert_same(self, expected, actual):
+        self.assertEqual(expected.version, actual.version)
+        self.assertEqual(expected.next_id, actual.next_id)
+        self.assertEqual(
+            expected.unit_id_to_lesson_ids, actual.unit_id_to_lesson_ids)
+        self.assertEqual(len(expected.units), len(actual.units))
+        for before, after in zip(expected.units, actual.units):
+            self.assertIsInstance(after, courses.Unit13)
+            self.assertEqual(before.__dict__, after.__dict__)
+        self.assertEqual(len(expected.lessons), len(actual.lessons))
+        for before, after in zip(expected.lessons, actual.lessons):
+            self.assertIsInstance(after, courses.Lesson13)
+            self.assertEqual(before.__dict__, after.__dict__)
+
+    def test_round_trip(self):
+        course = _make_synthetic_course(3, 4)
+        data = course.serialize()
+        self.assertTrue(data.startswith(
+            courses.CachedCourse13.COMPACT_FORMAT_MAGIC))
+        memento = courses.CachedCourse13()
+        memento.deserialize(data)
+        self._assert_same(course, memento)
+
+    def test_round_trip_without_compression(self):
+        course = _make_synthetic_course(2, 2)
+        course.CAN_COMPRESS = False
+        memento = courses.CachedCourse13()
+        memento.deserialize(course.serialize())
+        self._assert_same(course, memento)
+
+    def test_objects_with_different_attributes(self):
+        course = _make_synthetic_course(2, 2)
+        course.lessons[1].extra_attribute = u'extra'
+        del course.units[0].description
+        memento = courses.CachedCourse13()
+        memento.deserialize(course.serialize())
+        self._assert_same(course, memento)
+
+    def test_unmarshallable_values_fall_back_to_pickle(self):
+        course = _make_synthetic_course(1, 1)
+        course.lessons[0].properties = {'custom': CustomValue()}
+        data = course.serialize()
+        self.assertFalse(data.startswith(
+            courses.CachedCourse13.COMPACT_FORMAT_MAGIC))
+        memento = courses.CachedCourse13()
+        memento.deserialize(data)
+        self._assert_same(course, memento)
+
+    def test_pickle_representation_is_still_readable(self):
+        course = _make_synthetic_course(2, 3)
+        data = pickle.dumps(course.__dict__)
+        memento = courses.CachedCourse13()
+        memento.deserialize(data)
+        self._assert_same(course, memento)
+
+    def test_wrong_format_version_is_rejected(self):
+        data = _make_synthetic_course(1, 1).serialize()
+        offset = len(courses.CachedCourse13.COMPACT_FORMAT_MAGIC)
+        data = data[:offset] + chr(255) + data[offset + 1:]
+        with self.assertRaises(Exception):
+            courses.CachedCourse13().deserialize(data)
+
+
+class CachedCourse13SerializationBenchmark(unittest.TestCase):
+    """Compares sizes of compact and pickle formats on synthetic courses."""
+
+    LESSON_COUNTS = [100, 1000, 5000]
+    LESSONS_PER_UNIT = 20
+
+    def test_compact_format_is_smaller(self):
+        for num_lessons in self.LESSON_COUNTS:
+            course = _make_synthetic_course(
+                num_lessons // self.LESSONS_PER_UNIT, self.LESSONS_PER_UNIT)
+            pickled = pickle.dumps(course.__dict__)
+            compact = course.serialize()
+
+            logging.info(
+                'Course with %s lessons: pickle %s bytes; compact %s bytes.',
+                num_lessons, len(pickled), len(compact))
+            self.assertLess(len(compact), len(pickled))
+            self.assertLessEqual(
+                len(compact), courses.CachedCourse13._max_size())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests and benchmark for intermediate values of map/reduce jobs."""
+
+import logging
+import random
+import time
+import unittest
+
+from models import jobs
+from models import transforms
+
+
+_USER_AGENTS = [
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/39.0.2171.95 Safari/537.36',
+    'Mozilla/5.0 (X11; Linux i586; rv:31.0) Gecko/20100101 Firefox/31.0',
+    'Opera/9.80 (X11; Linux i686; Ubuntu/14.10) Presto/2.12.388 '
+    'Version/12.16']
+
+
+def _make_synthetic_events(num_events, num_students):
+    """Makes (user_id, recorded_on_usec, items) like student aggregate's."""
+    rand = random.Random(num_events)
+    events = []
+    for index in xrange(num_events):
+        user_id = str(100000000 + rand.randrange(num_students))
+        timestamp = 1420070400 + index
+        events.append((user_id, timestamp * 1000000, [
+            ('location', ['US', 'CA', 'Mountain View']),
+            ('locale', 'en_US'),
+            ('user_agent', rand.choice(_USER_AGENTS)),
+            ('page_event', [['lesson', str(rand.randrange(200)), timestamp,
+                             rand.choice(['enter-page', 'exit-page'])]])]))
+    return events
+
+
+class _StringValuesJob(jobs.MapReduceJob):
+    """Emits values the way jobs did before they could use a codec."""
+
+    @staticmethod
+    def map(event):
+        user_id, recorded_on_usec, items = event
+        for component_name, item in items:
+            yield user_id, '%s:%d:%s' % (
+                component_name, recorded_on_usec, transforms.dumps(item))
+
+    @staticmethod
+    def reduce(key, values):
+        yield key, len(values)
+
+
+class _EncodedValuesJob(jobs.MapReduceJob):
+
+    INTERMEDIATE_VALUE_CODEC = jobs.MarshalValueCodec
+
+    @staticmethod
+    def map(event):
+        user_id, recorded_on_usec, items = event
+        yield user_id, [
+            (component_name, recorded_on_usec, transforms.dumps(item))
+            for component_name, item in items]
+
+    @staticmethod
+    def combine(unused_key, values, previously_combined_outputs=None):
+        items = []
+        for value in values:
+            items += value
+        for value in previously_combined_outputs or []:
+            items += value
+        yield items
+
+    @staticmethod
+    def reduce(key, values):
+        yield key, sum(len(value) for value in values)
+
+
+def _shuffle(job_class, events, events_per_shard=None):
+    """Maps events in shards, combining the output of each one if asked to.
+
+    Returns:
+        The total bytes of keys and values to shuffle, and the values
+        grouped by key, as reduce() would get them.
+    """
+    values_by_key = {}
+    total_bytes = 0
+    shard_size = events_per_shard or len(events)
+    for start in xrange(0, len(events), shard_size):
+        shard_values_by_key = {}
+        for event in events[start:start + shard_size]:
+            for key, value in job_class.map_encoded(event):
+                shard_values_by_key.setdefault(key, []).append(value)
+        for key, values in shard_values_by_key.iteritems():
+            if events_per_shard:
+                values = list(job_class.combine_encoded(key, values))
+            total_bytes += sum(len(key) + len(value) for value in values)
+            values_by_key.setdefault(key, []).extend(values)
+    return total_bytes, values_by_key
+
+
+class MarshalValueCodecTests(unittest.TestCase):
+
+    def test_values_are_decoded_as_encoded(self):
+        for value in [
+            None, True, 1, 2L ** 70, 1.5, 'a', u'\u00e9', (1, 'a'), [1, 2],
+            {'a': [1, (2, 3)], u'b': None}]:
+            encoded = jobs.MarshalValueCodec.encode(value)
+            self.assertIsInstance(encoded, str)
+            self.assertEquals(value, jobs.MarshalValueCodec.decode(encoded))
+
+    def test_large_values_are_compressed(self):
+        value = ['enter-page'] * 1000
+        encoded = jobs.MarshalValueCodec.encode(value)
+        self.assertTrue(
+            ord(encoded[0]) & jobs.MarshalValueCodec.FLAG_ZLIB)
+        self.assertLess(len(encoded), len(transforms.dumps(value)))
+        self.assertEquals(value, jobs.MarshalValueCodec.decode(encoded))
+
+    def test_small_values_are_not_compressed(self):
+        encoded = jobs.MarshalValueCodec.encode('a')
+        self.assertEquals(0, ord(encoded[0]))
+
+    def test_unsupported_values_are_rejected(self):
+        with self.assertRaises(ValueError):
+            jobs.MarshalValueCodec.encode(object())
+
+
+class IntermediateValueCodecTests(unittest.TestCase):
+
+    def test_job_without_codec_sees_values_unchanged(self):
+        self.assertFalse(_StringValuesJob.has_combiner())
+        event = ('1', 5, [('locale', 'en_US')])
+        self.assertEquals(
+            [('1', 'locale:5:"en_US"')],
+            list(_StringValuesJob.map_encoded(event)))
+        self.assertEquals(
+            [('1', 2)], list(_StringValuesJob.reduce_encoded('1', ['a', 'b'])))
+
+    def test_job_with_codec_sees_decoded_values(self):
+        self.assertTrue(_EncodedValuesJob.has_combiner())
+        events = _make_synthetic_events(100, 3)
+        _, values_by_key = _shuffle(_EncodedValuesJob, events, 10)
+        for key, values in values_by_key.iteritems():
+            for value in values:
+                self.assertIsInstance(value, str)
+            expected = sum(
+                len(event[2]) for event in events if event[0] == key)
+            self.assertEquals(
+                [(key, expected)],
+                list(_EncodedValuesJob.reduce_encoded(key, values)))
+
+    def test_combine_decodes_previously_combined_outputs(self):
+        codec = jobs.MarshalValueCodec
+        combined = list(_EncodedValuesJob.combine_encoded(
+            'key', [codec.encode([1])], [codec.encode([2, 3])]))
+        self.assertEquals([[1, 2, 3]], [codec.decode(c) for c in combined])
+
+
+class ShuffleBytesBenchmark(unittest.TestCase):
+    """Compares bytes shuffled for str() values and for encoded values."""
+
+    # Add 1000000 to measure a large course; that takes a few minutes.
+    EVENT_COUNTS = [10000, 100000]
+    STUDENT_COUNT = 5000
+    EVENTS_PER_SHARD = 10000
+
+    def test_encoded_values_are_smaller(self):
+        for num_events in self.EVENT_COUNTS:
+            events = _make_synthetic_events(num_events, self.STUDENT_COUNT)
+
+            start = time.time()
+            string_bytes, _ = _shuffle(_StringValuesJob, events)
+            string_secs = time.time() - start
+            start = time.time()
+            encoded_bytes, _ = _shuffle(_EncodedValuesJob, events)
+            encoded_secs = time.time() - start
+            start = time.time()
+            combined_bytes, _ = _shuffle(
+                _EncodedValuesJob, events, self.EVENTS_PER_SHARD)
+            combined_secs = time.time() - start
+
+            logging.info(
+                '%s events: str() %s bytes in %.3fs; encoded %s bytes in '
+                '%.3fs; encoded and combined per %s events %s bytes in '
+                '%.3fs.', num_events, string_bytes, string_secs,
+                encoded_bytes, encoded_secs, self.EVENTS_PER_SHARD,
+                combined_bytes, combined_secs)
+            self.assertLess(encoded_bytes, string_bytes)
+            self.assertLess(combined_bytes, string_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -62,6 +62,10 @@ the same --privacy_secret (or all with no secret).
 
 Other flags for uploading are recommended:
     --resume:  Use this flag to permit an upload to resume where it left off.
+      As each batch of an upload with this flag is uploaded, the number of
+      entities written so far is saved in a file next to the archive, named like
+      archive.zip.upload_progress.json; a resumed upload skips those entities
+      without contacting the server.
     --force_overwrite:  Unless this flag is specified, every entity to be
       uploaded is checked to see whether an entity with this key already
       exists in the datastore.  This takes substantial additional time.
@@ -161,7 +165,9 @@ __author__ = [
 ]
 
 import argparse
+import contextlib
 import functools
+import itertools
 import logging
 import os
 import random
@@ -254,6 +260,8 @@ _TYPE_COURSE = 'course'
 _TYPE_DATASTORE = 'datastore'
 # Number of items upon which to emit upload rate statistics.
 _UPLOAD_CHUNK_SIZE = 1000
+# String. Added to the archive path to name the file recording upload progress.
+_UPLOAD_PROGRESS_SUFFIX = '.upload_progress.json'
 # We support .zip files as one archive format.
 ARCHIVE_TYPE_ZIP = 'zip'
 # We support plain UNIX directory structure as an archive format
@@ -339,7 +347,8 @@ def create_args_parser():
             'flag assumes that the only data present is that provided by the '
             'upload.  This permits significant time savings if an upload is '
             'interrupted or otherwise needs to be performed in multiple '
-            'stages.'))
+            'stages: entities recorded as uploaded in the progress file '
+            'saved next to the archive are skipped.'))
     parser.add_argument(
         '--job_args', default=[],
         help=(
@@ -517,6 +526,19 @@ class _AbstractArchive(object):
         """Opens archive in the mode given by mode string ('r', 'w', 'a')."""
         raise NotImplementedError()
 
+    def open_stream(self, path):
+        """Opens the archive entity found at path for reading.
+
+        Returns None if path is not in the archive.
+
+        Args:
+            path: string. Path of file to read from the archive.
+
+        Returns:
+            A file-like object; the caller must close it.
+        """
+        raise NotImplementedError()
+
     @property
     def manifest(self):
         """Returns the archive's manifest."""
@@ -578,6 +600,13 @@ class _ZipArchive(_AbstractArchive):
         assert not self._zipfile
         self._zipfile = zipfile.ZipFile(self._path, mode, allowZip64=True)
 
+    def open_stream(self, path):
+        assert self._zipfile
+        try:
+            return self._zipfile.open(path)
+        except KeyError:
+            return None
+
 
 class _DirectoryArchive(_AbstractArchive):
 
@@ -602,6 +631,12 @@ class _DirectoryArchive(_AbstractArchive):
         with open(os.path.join(self.path, filename), 'rb') as fp:
             return fp.read()
 
+    def open_stream(self, filename):
+        path = os.path.join(self.path, filename)
+        if os.path.exists(path):
+            return open(path, 'rb')
+        return None
+
     def open(self, mode):
         if mode in ('w', 'a'):
             if not os.path.exists(self.path):
@@ -1360,30 +1395,43 @@ def _upload_datastore(params, included_type_names):
 
     type_names = _determine_type_names(params, included_type_names, archive)
     entity_classes = _get_classes_for_type_names(type_names)
+    progress_path = (
+        params.archive_path.rstrip(os.sep) + _UPLOAD_PROGRESS_SUFFIX)
+    target = '%s %s %s' % (
+        params.application_id, params.server, params.course_url_prefix)
+    if params.resume:
+        upload_progress = _UploadProgress.load(progress_path, target)
+    else:
+        # Only uploads that may be resumed leave a progress file behind.
+        upload_progress = _UploadProgress(None, target)
     total_count = 0
     total_start = time.time()
     for entity_class in entity_classes:
         _LOG.info('-------------------------------------------------------')
         _LOG.info('Adding entities of type %s', entity_class.__name__)
 
-        # Get JSON contents from .zip file
+        # Rows are streamed from the archive twice: to count them, and then
+        # to upload them.
         json_path = _AbstractArchive.get_internal_path(
             '%s.json' % entity_class.__name__,
             prefix=_ARCHIVE_PATH_PREFIX_MODELS)
-        _LOG.info('Fetching data from .zip archive')
-        json_text = archive.get(json_path)
-        if not json_text:
+        stream = archive.open_stream(json_path)
+        if not stream:
             _LOG.info(
                 'Unable to find data file %s for entity %s; skipping',
                 json_path, entity_class.__name__)
             continue
-        _LOG.info('Parsing data into JSON')
-        json_object = transforms.loads(json_text)
+        with contextlib.closing(stream):
+            num_entities, resume_offset = _count_rows(
+                entity_class, transforms.JsonFile.iter_lines(stream),
+                upload_progress)
         schema = (entity_transforms
                   .get_schema_for_entity(entity_class)
                   .get_json_schema_dict())
-        total_count += _upload_entities_for_class(
-            entity_class, schema, json_object['rows'], params)
+        with contextlib.closing(archive.open_stream(json_path)) as stream:
+            total_count += _upload_entities_for_class(
+                entity_class, schema, transforms.JsonFile.iter_lines(stream),
+                num_entities, resume_offset, upload_progress, params)
     _LOG.info('Flushing all caches')
     memcache.flush_all()
     total_end = time.time()
@@ -1393,44 +1441,103 @@ def _upload_datastore(params, included_type_names):
         'y' if total_count == 1 else 'ies', int(total_end - total_start))
 
 
-def _upload_entities_for_class(entity_class, schema, entities, params):
-    num_entities = len(entities)
+class _UploadProgress(object):
+    """Records how many rows of each kind have been uploaded from an archive.
+
+    Rows are uploaded in archive order.  After each batch, the number of rows
+    written so far and the key of the last of them are saved to a local file,
+    so that an interrupted upload can be resumed by skipping those rows.
+    Progress is kept for one target course; uploading to another one starts
+    over.  Without --resume, progress is not saved; path is None.
+    """
+
+    def __init__(self, path, target, kinds=None):
+        self._path = path
+        self._target = target
+        self._kinds = kinds or {}
+
+    @classmethod
+    def load(cls, path, target):
+        if not os.path.exists(path):
+            return cls(path, target)
+        with open(path) as fp:
+            saved = transforms.loads(fp.read())
+        if saved.get('target') != target:
+            _LOG.info('Ignoring upload progress in %s recorded for %s.',
+                      path, saved.get('target'))
+            return cls(path, target)
+        return cls(path, target, saved['kinds'])
+
+    def get(self, kind):
+        """Returns the number of rows uploaded and the key of the last one."""
+        progress = self._kinds.get(kind)
+        if not progress:
+            return 0, None
+        return progress['offset'], progress['last_key']
+
+    def set(self, kind, offset, last_key):
+        self._kinds[kind] = {'offset': offset, 'last_key': last_key}
+        if not self._path:
+            return
+        temp_path = self._path + '.tmp'
+        with open(temp_path, 'w') as fp:
+            fp.write(transforms.dumps(
+                {'target': self._target, 'kinds': self._kinds}))
+        os.rename(temp_path, self._path)
+
+
+def _count_rows(entity_class, lines, upload_progress):
+    """Counts rows, and finds how many were uploaded by an earlier upload.
+
+    Args:
+        entity_class: the class of the entities in the rows.
+        lines: iterable of rows as unparsed JSON strings.
+        upload_progress: _UploadProgress.
+
+    Returns:
+        The number of rows, and the number of rows upload_progress records
+        as uploaded, or None if it has no record that matches the rows.
+    """
+    offset, last_key = upload_progress.get(entity_class.__name__)
+    num_rows = 0
+    resume_offset = None
+    for line in lines:
+        num_rows += 1
+        if num_rows == offset:
+            _, id_or_name = _get_entity_key(
+                entity_class, transforms.loads(line))
+            if id_or_name == last_key:
+                resume_offset = offset
+    return num_rows, resume_offset
+
+
+def _iter_batches(lines, batch_size):
+    batch = []
+    for line in lines:
+        batch.append(transforms.loads(line))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _upload_entities_for_class(entity_class, schema, lines, num_entities,
+                               resume_offset, upload_progress, params):
     i = 0
-    is_first_batch_after_resume = False
+    skip_existing = False
 
-    # Binary search to find first un-uploaded entity.
     if params.resume:
-        _LOG.info('Resuming upload; searching for first non-uploaded entry.')
-        start = 0
-        end = num_entities
-        while start < end:
-            guess = (start + end) / 2
-            if params.verbose:
-                _LOG.info('Checking whether instance %d exists', guess)
-            key, _ = _get_entity_key(entity_class, entities[guess])
-            if db.get(key):
-                start = guess + 1
-            else:
-                end = guess
-        i = start
-
-        # If we are doing things in batches, it is possible that the previous
-        # batch only partially completed.  Experiments on a dev instance show
-        # that partial writes do not proceed in the order the items are
-        # supplied.  I see no reason to trust that production will be any
-        # friendlier.  Check that there are no missed entities up to one
-        # chunk back from where we are planning on restarting the upload.
-        if params.batch_size > 1 and i > 0:
-            start = max(0, i - params.batch_size)
-            end = min(start + params.batch_size, len(entities))
-            is_first_batch_after_resume = True
-            existing = _find_existing_items(entity_class, entities, start, end)
-            if None in existing:
-                if start > 0:
-                    _LOG.info('Previous chunk only partially completed; '
-                              'backing up from found location by one full '
-                              'chunk just in case.')
-                i = start
+        # The batch after the rows recorded as uploaded may have been
+        # partially written, so entities in it that already exist are not
+        # written again.  Without a record, this holds for all entities.
+        skip_existing = True
+        if resume_offset is None:
+            _LOG.info('No upload progress recorded for this archive; not '
+                      'writing entities that already exist.')
+        else:
+            i = resume_offset
+            lines = itertools.islice(lines, i, None)
 
         if i < num_entities:
             _LOG.info('Resuming upload at item number %d of %d.', i,
@@ -1443,54 +1550,56 @@ def _upload_entities_for_class(entity_class, schema, entities, params):
     # pylint: disable=protected-access
     progress = etl_lib._ProgressReporter(
         _LOG, 'Uploaded', entity_class.__name__, _UPLOAD_CHUNK_SIZE,
-        len(entities) - i)
+        num_entities - i)
     if i < num_entities:
         _LOG.info('Starting upload of entities')
-        while i < num_entities:
-            quantity = _upload_batch(entity_class, schema, entities, i,
-                                     is_first_batch_after_resume, params)
-            progress.count(quantity)
+        for entities in _iter_batches(lines, params.batch_size):
+            quantity = _upload_batch(
+                entity_class, schema, entities, i, skip_existing, params)
             i += quantity
-            is_first_batch_after_resume = False
+            _, last_key = _get_entity_key(entity_class, entities[-1])
+            upload_progress.set(entity_class.__name__, i, last_key)
+            progress.count(quantity)
+            if resume_offset is not None:
+                skip_existing = False
 
         progress.report()
         _LOG.info('Upload of %s complete', entity_class.__name__)
     return progress.get_count()
 
 
-def _find_existing_items(entity_class, entities, start, end):
+def _find_existing_items(entity_class, entities):
     keys = []
-    for i in xrange(start, end):
-        key, _ = _get_entity_key(entity_class, entities[i])
+    for entity in entities:
+        key, _ = _get_entity_key(entity_class, entity)
         keys.append(key)
     return db.get(keys)
 
 
 @_retry(message='Uploading batch of entities failed; retrying')
-def _upload_batch(entity_class, schema, entities, start,
-                  is_first_batch_after_resume, params):
-    end = min(start + params.batch_size, len(entities))
-
+def _upload_batch(entity_class, schema, entities, start, skip_existing,
+                  params):
     # See what elements we want to upload already exist in the datastore.
     if params.force_overwrite:
         existing = []
     else:
-        existing = _find_existing_items(entity_class, entities, start, end)
+        existing = _find_existing_items(entity_class, entities)
 
     # Build up array of things to batch-put to DB.
     to_put = []
-    for i in xrange(start, end):
-        key, id_or_name = _get_entity_key(entity_class, entities[i])
+    for index, entity in enumerate(entities):
+        i = start + index
+        key, id_or_name = _get_entity_key(entity_class, entity)
         if params.force_overwrite:
             if params.verbose:
                 _LOG.info('Forcing write of object #%d with key %s',
                           i, id_or_name)
-        elif existing[i - start]:
-            if is_first_batch_after_resume:
+        elif existing[index]:
+            if skip_existing:
                 if params.verbose:
                     _LOG.info('Not overwriting object #%d with key %s '
-                              'written in previous batch which we are '
-                              'now recovering.', i, id_or_name)
+                              'written by a previous upload which we are '
+                              'now resuming.', i, id_or_name)
                 continue
             else:
                 _die('Object #%d of class %s with key %s already exists.' % (
@@ -1498,11 +1607,11 @@ def _upload_batch(entity_class, schema, entities, start,
         else:
             if params.verbose:
                 _LOG.info('Adding new object #%d with key %s', i, id_or_name)
-        to_put.append(_build_entity(entity_class, schema, entities[i], key))
+        to_put.append(_build_entity(entity_class, schema, entity, key))
     if params.verbose:
-        _LOG.info('Sending batch of %d objects to DB', end - start)
+        _LOG.info('Sending batch of %d objects to DB', len(entities))
     db.put(to_put)
-    return end - start
+    return len(entities)
 
 
 def _get_entity_key(entity_class, entity):
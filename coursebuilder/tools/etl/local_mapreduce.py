@@ -0,0 +1,454 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs models.jobs.MapReduceJob subclasses locally over datastore downloads.
+
+The analytics generators only run inside App Engine, through the mapreduce
+pipeline. This module runs the same map(), combine() and reduce() static
+methods on a workstation, reading the entities to map over from an archive
+made by:
+
+$ python etl.py download datastore /cs101 myapp server.appspot.com \
+    --archive_path archive.zip --datastore_types EventEntity
+
+and then:
+
+$ python etl.py run tools.etl.local_mapreduce.RunMapReduceJob \
+    /cs101 myapp server.appspot.com --job_args='\
+        modules.analytics.student_aggregate.StudentAggregateGenerator \
+        archive.zip results.json --num_workers 8'
+
+Map work is split in chunks of rows that are handed to a pool of worker
+processes. Map output is hash-partitioned by key, combined if the job has a
+combine() and spilled to disk in sorted runs whenever a worker buffers too
+many values, so the size of the course is bounded by disk, not memory. Each
+partition is then merged and reduced by one worker. As on App Engine, keys
+and values are converted to strings between the phases, or encoded with the
+job's INTERMEDIATE_VALUE_CODEC, and results are the reducer outputs passed
+through str() and ast.literal_eval().
+
+Everything other than the mapped entities, e.g. the Student lookups done by
+some reducers, or the entities they put(), goes to the datastore etl.py is
+connected to. With --disable_remote there are no datastore services, so only
+jobs that do not use the datastore can run that way.
+"""
+
+import ast
+import cPickle
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+import zlib
+
+from mapreduce import context
+
+from common import utils as common_utils
+from models import entity_transforms
+from models import jobs
+from models import transforms
+from tools.etl import etl_lib
+
+from google.appengine.api import namespace_manager
+from google.appengine.ext import db
+
+_LOG = logging.getLogger('coursebuilder.tools.etl')
+
+# Path of the entity files inside of an archive; see etl._download_type().
+_ARCHIVE_PATH_MODELS = 'models'
+
+# State of a worker process, set by _init_worker().
+_worker = None
+
+
+def iter_archive_lines(archive_path, kind):
+    """Yields the serialized rows of one entity kind in a download archive.
+
+    Args:
+        archive_path: string. Path of a zip or directory archive made by
+            etl.py download datastore.
+        kind: string. Kind of the entities to read.
+
+    Yields:
+        One JSON string per entity, without parsing it.
+    """
+    internal_path = os.path.join(_ARCHIVE_PATH_MODELS, '%s.json' % kind)
+    if os.path.isdir(archive_path):
+        stream = open(os.path.join(archive_path, internal_path), 'rb')
+        archive = None
+    else:
+        archive = zipfile.ZipFile(archive_path, 'r', allowZip64=True)
+        stream = archive.open(internal_path)
+    try:
+        for line in transforms.JsonFile.iter_lines(stream):
+            yield line
+    finally:
+        stream.close()
+        if archive:
+            archive.close()
+
+
+def _get_partition(key, num_partitions):
+    return (zlib.crc32(key) & 0xffffffff) % num_partitions
+
+
+class _MapperSpec(object):
+
+    def __init__(self, params):
+        self.params = params
+
+
+class _MapreduceSpec(object):
+
+    def __init__(self, params):
+        self.mapper = _MapperSpec(params)
+
+
+class _LocalContext(object):
+    """Stands in for mapreduce.context.Context while a job runs locally.
+
+    Jobs only read their parameters from the context, via
+    context.get().mapreduce_spec.mapper.params.
+    """
+
+    def __init__(self, params):
+        self.mapreduce_spec = _MapreduceSpec(params)
+
+
+class _Worker(object):
+    """Map and reduce work of one process."""
+
+    def __init__(self, job, mapper_params, work_dir, num_partitions,
+                 max_buffered_values):
+        self.job = job
+        self.entity_class = job.entity_class()
+        self.schema = entity_transforms.get_schema_for_entity(
+            self.entity_class).get_json_schema_dict()
+        self.work_dir = work_dir
+        self.num_partitions = num_partitions
+        self.max_buffered_values = max_buffered_values
+        self.has_combiner = job.has_combiner()
+        namespace_manager.set_namespace(mapper_params['namespace'])
+        # pylint: disable=protected-access
+        context.Context._set(_LocalContext(mapper_params))
+
+    def build_entity(self, line):
+        """Builds an entity from its row the way etl.py upload does."""
+        row = transforms.loads(line)
+        key = db.Key.from_path(
+            self.entity_class.kind(), row['key.id'] or row['key.name'])
+        entity = self.entity_class(key=key)
+        entity_transforms.dict_to_entity(entity, transforms.json_to_dict(
+            row, self.schema, permit_none_values=True))
+        return entity
+
+    def _spill(self, buffers, chunk_index, spill_index):
+        """Writes buffered map output to one sorted run per partition."""
+        spills = []
+        for partition, values_by_key in buffers.iteritems():
+            path = os.path.join(self.work_dir, 'map-%06d-%04d-%04d' % (
+                chunk_index, spill_index, partition))
+            with open(path, 'wb') as stream:
+                for key in sorted(values_by_key):
+                    values = values_by_key[key]
+                    if self.has_combiner:
+                        values = [str(value) for value in
+                                  self.job.combine_encoded(key, values, [])]
+                    cPickle.dump((key, values), stream,
+                                 cPickle.HIGHEST_PROTOCOL)
+            spills.append((partition, path))
+        return spills
+
+    def map_chunk(self, chunk_index, lines):
+        """Maps a chunk of rows.
+
+        Returns:
+            A list of (partition, path) of the sorted runs written to disk and
+            the number of (key, value) pairs that map() produced.
+        """
+        spills = []
+        spill_count = 0
+        buffers = {}
+        buffered_values = 0
+        output_count = 0
+        for line in lines:
+            for key, value in self.job.map_encoded(self.build_entity(line)):
+                key = str(key)
+                values_by_key = buffers.setdefault(
+                    _get_partition(key, self.num_partitions), {})
+                values_by_key.setdefault(key, []).append(str(value))
+                buffered_values += 1
+                output_count += 1
+                if buffered_values >= self.max_buffered_values:
+                    spills += self._spill(buffers, chunk_index, spill_count)
+                    spill_count += 1
+                    buffers = {}
+                    buffered_values = 0
+        if buffers:
+            spills += self._spill(buffers, chunk_index, spill_count)
+        return spills, output_count
+
+    def reduce_partition(self, paths):
+        """Merges the sorted runs of a partition and reduces every key.
+
+        Returns:
+            A list of the reducer outputs, as strings.
+        """
+        results = []
+        streams = [open(path, 'rb') for path in paths]
+        try:
+            records = heapq.merge(*[
+                _iter_records(stream) for stream in streams])
+            for key, group in itertools.groupby(
+                    records, lambda record: record[0]):
+                values = []
+                for _, more_values in group:
+                    values += more_values
+                for result in self.job.reduce_encoded(key, values) or []:
+                    results.append(str(result))
+        finally:
+            for stream in streams:
+                stream.close()
+        return results
+
+
+def _iter_records(stream):
+    while True:
+        try:
+            yield cPickle.load(stream)
+        except EOFError:
+            return
+
+
+def _init_worker(*args):
+    global _worker  # pylint: disable=global-statement
+    _worker = _Worker(*args)
+
+
+def _map_chunk(args):
+    return _worker.map_chunk(*args)
+
+
+def _reduce_partition(paths):
+    return _worker.reduce_partition(paths)
+
+
+def build_mapper_params(job, app_context):
+    """Returns the parameters App Engine would pass to the mappers of job."""
+    entity_class = job.entity_class()
+    namespace = app_context.get_namespace_name()
+    with common_utils.Namespace(namespace):
+        mapper_params = job.build_additional_mapper_params(app_context)
+    mapper_params.update({
+        'entity_kind': '%s.%s' % (
+            entity_class.__module__, entity_class.__name__),
+        'namespace': namespace,
+    })
+    return mapper_params
+
+
+def _iter_chunks(lines, chunk_size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class LocalMapReduce(object):
+    """Runs the map, combine and reduce steps of a job in local processes."""
+
+    def __init__(self, job, mapper_params, num_workers=1,
+                 num_partitions=None, chunk_size=1000,
+                 max_buffered_values=100000, work_dir=None):
+        """Creates a new runner.
+
+        Args:
+            job: an instance of a models.jobs.MapReduceJob subclass.
+            mapper_params: dict. The parameters of the job, including
+                'namespace'; see build_mapper_params().
+            num_workers: int. Number of processes; 1 runs in this process.
+            num_partitions: int. Number of reduce partitions; defaults to
+                twice the number of workers.
+            chunk_size: int. Number of rows mapped by one task.
+            max_buffered_values: int. Number of map values a task holds in
+                memory before it spills them to disk.
+            work_dir: string. Directory for the map output; a temporary
+                directory that is removed after the run by default.
+        """
+        self._job = job
+        # Parameters reach mappers on App Engine as JSON; do the same here so
+        # the job sees lists, not tuples, and unicode strings.
+        self._mapper_params = transforms.loads(
+            transforms.dumps(mapper_params))
+        self._num_workers = num_workers
+        self._num_partitions = num_partitions or 2 * num_workers
+        self._chunk_size = chunk_size
+        self._max_buffered_values = max_buffered_values
+        self._work_dir = work_dir
+
+    def run(self, lines):
+        """Maps over the serialized entities in lines and reduces the output.
+
+        Args:
+            lines: iterable of JSON strings, one per entity of the kind of
+                job.entity_class(); see iter_archive_lines().
+
+        Returns:
+            The list of outputs of the job, as MapReduceJob.get_results()
+            would return them.
+        """
+        work_dir = self._work_dir or tempfile.mkdtemp(prefix='mapreduce-')
+        worker_args = (
+            self._job, self._mapper_params, work_dir,
+            self._num_partitions, self._max_buffered_values)
+        pool = None
+        if self._num_workers > 1:
+            pool = multiprocessing.Pool(
+                self._num_workers, _init_worker, worker_args)
+            imap = pool.imap_unordered
+        else:
+            imap = itertools.imap
+        try:
+            with common_utils.Namespace(namespace_manager.get_namespace()):
+                if not pool:
+                    _init_worker(*worker_args)
+                return self._run(imap, lines)
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+            else:
+                # pylint: disable=protected-access
+                context.Context._set(None)
+            if not self._work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _run(self, imap, lines):
+        start = time.time()
+        paths_by_partition = [[] for _ in xrange(self._num_partitions)]
+        chunk_count = 0
+        output_count = 0
+        for spills, count in imap(_map_chunk, enumerate(
+                _iter_chunks(lines, self._chunk_size))):
+            for partition, path in spills:
+                paths_by_partition[partition].append(path)
+            chunk_count += 1
+            output_count += count
+        _LOG.info(
+            'Mapped %d chunks of %s to %d values in %d seconds',
+            chunk_count, self._job.entity_class().kind(), output_count,
+            int(time.time() - start))
+
+        start = time.time()
+        results = []
+        for partition_results in imap(
+                _reduce_partition,
+                [paths for paths in paths_by_partition if paths]):
+            for result in partition_results:
+                results.append(ast.literal_eval(result))
+        _LOG.info(
+            'Reduced %d partitions to %d results in %d seconds',
+            self._num_partitions, len(results), int(time.time() - start))
+        return results
+
+
+class RunMapReduceJob(etl_lib.Job):
+    """Runs a MapReduceJob over entities in an etl.py download archive.
+
+    Usage:
+
+    etl.py run tools.etl.local_mapreduce.RunMapReduceJob /course myapp \
+        server.appspot.com --job_args='path.to.MyMapReduceJob \
+        /path/to/archive.zip /path/to/results.json'
+
+    The results are written to a JSON file with one row per job output.
+    """
+
+    def _configure_parser(self):
+        self.parser.add_argument(
+            'job', help='Full name of the MapReduceJob class to run', type=str)
+        self.parser.add_argument(
+            'archive_path',
+            help='Path of the zip file or directory with the entities',
+            type=str)
+        self.parser.add_argument(
+            'output', help='Path of the JSON file to write results to',
+            type=str)
+        self.parser.add_argument(
+            '--num_workers', default=multiprocessing.cpu_count(),
+            help='Number of worker processes', type=int)
+        self.parser.add_argument(
+            '--num_partitions', default=None,
+            help='Number of reduce partitions; twice --num_workers if unset',
+            type=int)
+        self.parser.add_argument(
+            '--chunk_size', default=1000,
+            help='Number of entities mapped by one task', type=int)
+        self.parser.add_argument(
+            '--max_buffered_values', default=100000,
+            help='Map values held in memory before spilling to disk',
+            type=int)
+        self.parser.add_argument(
+            '--work_dir', default=None,
+            help='Directory to keep map output in; temporary if unset',
+            type=str)
+
+    def _get_job_class(self):
+        module_name, class_name = self.args.job.rsplit('.', 1)
+        module = __import__(module_name, globals(), locals(), [class_name])
+        job_class = getattr(module, class_name)
+        if not issubclass(job_class, jobs.MapReduceJob):
+            sys.exit('%s is not a MapReduceJob' % self.args.job)
+        return job_class
+
+    def main(self):
+        if self.args.num_workers < 1:
+            sys.exit('--num_workers must be positive')
+        if not os.path.exists(self.args.archive_path):
+            sys.exit('Archive %s not found' % self.args.archive_path)
+        if os.path.exists(self.args.output):
+            sys.exit('Cannot write to %s; file exists' % self.args.output)
+        app_context = etl_lib.get_context(self.etl_args.course_url_prefix)
+        if not app_context:
+            sys.exit('No course found with course_url_prefix %s' %
+                     self.etl_args.course_url_prefix)
+        job = self._get_job_class()(app_context)
+        with common_utils.Namespace(app_context.get_namespace_name()):
+            results = LocalMapReduce(
+                job, build_mapper_params(job, app_context),
+                num_workers=self.args.num_workers,
+                num_partitions=self.args.num_partitions,
+                chunk_size=self.args.chunk_size,
+                max_buffered_values=self.args.max_buffered_values,
+                work_dir=self.args.work_dir,
+            ).run(iter_archive_lines(
+                self.args.archive_path, job.entity_class().kind()))
+
+        json_file = transforms.JsonFile(self.args.output)
+        json_file.open('w')
+        try:
+            for result in results:
+                json_file.write(result)
+        finally:
+            json_file.close()